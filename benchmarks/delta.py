@@ -0,0 +1,140 @@
+"""Compares a full dataset reload with a delta upsert.
+
+A synthetic dataset is loaded in place of companies, then a changeset
+with unchanged, updated and new companies is upserted, and both reports
+are printed as JSON. The companies table is replaced, so the benchmark
+must only be run against a scratch database:
+
+    DB_URL=postgresql://... python -m benchmarks.delta --rows 1000000
+
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterator
+
+import asyncpg
+import orjson
+
+from invest_api.loader import load, load_delta
+from invest_api.settings import env
+
+SIZES = ("Микропредприятие", "Малое", "Среднее", "Крупное")
+REGIONS = {
+    "50": "Московская область",
+    "77": "Москва",
+    "78": "Санкт-Петербург",
+    "24": "Красноярский край",
+}
+STAGES = ("Рост активов", "Стабильное", "Спад выручки")
+
+
+def make_company(i: int, seed: int) -> Dict:
+    # Каждая компания воспроизводится по своему номеру и зерну,
+    # генератор не криптографический намеренно
+    rng = random.Random(seed * 1000003 + i)  # nosec
+    region_code = rng.choice(list(REGIONS))
+
+    return {
+        "id": i,
+        "name": f"ООО Компания {i}",
+        "size": rng.choice(SIZES),
+        "registered_at": str(date(2000, 1, 1) + timedelta(days=i % 7000)),
+        "itn": f"{i:010}",
+        "psrn": f"{i:013}",
+        "region_code": region_code,
+        "region_name": REGIONS[region_code],
+        "activity_code": "47.51.1",
+        "activity_name": "Торговля розничная",
+        "charter_capital": rng.randint(10000, 10 ** 9),
+        "is_acting": rng.random() < 0.9,
+        "is_liquidating": rng.random() < 0.05,
+        "not_reported_last_year": rng.random() < 0.2,
+        "not_in_same_registry": rng.random() < 0.3,
+        "ceo_has_other_companies": rng.random() < 0.1,
+        "negative_list_risk": rng.random() < 0.05,
+        "bankruptcy_probability": rng.randint(0, 100),
+        "bankruptcy_vars": {"assets": rng.random()},
+        "is_enough_finance_data": rng.random() < 0.8,
+        "relative_success": rng.randint(-9, 9),
+        "revenue_forecast": rng.randint(1, 10 ** 7),
+        "assets_forecast": rng.randint(1, 10 ** 7),
+        "dev_stage": rng.choice(STAGES),
+        "dev_stage_coordinates": [rng.random() for _ in range(4)],
+    }
+
+
+def make_dataset(args: argparse.Namespace) -> Iterator[Dict]:
+    for i in range(1, args.rows + 1):
+        yield make_company(i, args.seed)
+
+
+def make_delta(args: argparse.Namespace) -> Iterator[Dict]:
+    """Yields new, updated and unchanged companies in given shares."""
+
+    rng = random.Random(args.seed)  # nosec
+    companies = sorted(rng.sample(range(1, args.rows + 1), args.changes))
+
+    for n, i in enumerate(companies):
+        share = n / args.changes
+        if share < args.new_share:
+            yield make_company(args.rows + n + 1, args.seed)
+            continue
+
+        company = make_company(i, args.seed)
+        if share < args.new_share + args.updated_share:
+            company["name"] += " (изменено)"
+            company["bankruptcy_probability"] = rng.randint(0, 100)
+
+        yield company
+
+
+def write_rows(path: Path, rows: Iterator[Dict]) -> None:
+    with path.open("wb") as f:
+        for row in rows:
+            f.write(orjson.dumps(row) + b"\n")
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = Path(directory) / "dataset.jsonl"
+        delta = Path(directory) / "delta.jsonl"
+
+        write_rows(dataset, make_dataset(args))
+        write_rows(delta, make_delta(args))
+
+        connection = await asyncpg.connect(args.db_url)
+        try:
+            full = await load(connection, dataset, args.batch_size)
+            report, _ = await load_delta(connection, delta, args.batch_size)
+        finally:
+            await connection.close()
+
+    return {
+        "full_reload": full,
+        "delta": report,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=env.str("DB_URL", None))
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--changes", type=int, default=10000)
+    parser.add_argument("--updated-share", type=float, default=0.4)
+    parser.add_argument("--new-share", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
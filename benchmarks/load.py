@@ -0,0 +1,391 @@
+"""Measures throughput and tail latency of the HTTP API.
+
+A synthetic dataset is loaded in place of companies, the application is
+started with gunicorn for every given number of workers, and a weighted
+mix of requests is sent by concurrent clients for a fixed duration.
+Requests per second and latency percentiles of every route are printed
+as JSON. The companies table is replaced, so the benchmark must only be
+run against a scratch database:
+
+    DB_URL=postgresql://... python -m benchmarks.load --workers 1 4
+
+Without DB_URL a disposable Postgres container is started and migrated,
+as the test suite does. The dataset and the sequence of requests are
+derived from --seed, so runs of different commits with the same
+arguments are comparable.
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+# Запускаются только gunicorn и git с фиксированными аргументами
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import asyncpg
+from aiohttp.test_utils import unused_port
+from yarl import URL
+
+from benchmarks.delta import make_company, make_dataset, write_rows
+from invest_api.loader import load
+from invest_api.pytest_plugin import (
+    ALEMBIC_INI,
+    LOCALHOST,
+    ROOT,
+    PostgresConfig,
+    migrations_context,
+    postgres_server_context,
+    sqlalchemy_bind_context,
+)
+from invest_api.settings import env
+
+GUNICORN_CONFIG = os.path.join(ROOT, "gunicorn.config.py")
+
+# gunicorn запускается тем же интерпретатором, что и бенчмарк
+GUNICORN_RUN = "from gunicorn.app.wsgiapp import run; run()"
+
+# Маршруты называются так же, как в роутере приложения
+ROUTES = (
+    "company_details",
+    "companies_query",
+    "companies_selection",
+    "regions",
+)
+
+DEFAULT_MIX = (
+    "company_details=5",
+    "companies_query=2",
+    "companies_selection=2",
+    "regions=1",
+)
+
+PERCENTILES = (50, 95, 99)
+
+Target = Tuple[str, str, Dict]
+
+
+def parse_mix(items: List[str]) -> Dict[str, int]:
+    mix = {}
+
+    for item in items:
+        route, _, weight = item.partition("=")
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route: {route}")
+        mix[route] = int(weight or 1)
+
+    if not any(mix.values()):
+        raise ValueError("Mix of requests is empty")
+
+    return mix
+
+
+def make_target(route: str, company: Dict, rng: random.Random) -> Target:
+    if route == "company_details":
+        identifier = rng.choice((company["itn"], company["psrn"]))
+        return route, f"/companies/{identifier}", {}
+
+    if route == "companies_query":
+        name = company["name"]
+        return route, "/companies/query", {
+            "name": name[:rng.randint(len(name) // 2, len(name))],
+            "limit": 5,
+        }
+
+    if route == "companies_selection":
+        return route, "/companies/selection", {
+            "size": company["size"],
+            "region_codes": company["region_code"],
+            "is_acting": int(company["is_acting"]),
+            "bankruptcy_probability": company["bankruptcy_probability"],
+            "is_liquidating": int(company["is_liquidating"]),
+            "not_reported_last_year": int(company["not_reported_last_year"]),
+            "not_in_same_registry": int(company["not_in_same_registry"]),
+            "ceo_has_other_companies": int(
+                company["ceo_has_other_companies"],
+            ),
+            "negative_list_risk": int(company["negative_list_risk"]),
+            "limit": 10,
+        }
+
+    return route, "/regions", {}
+
+
+def make_targets(args: argparse.Namespace) -> List[Target]:
+    """Returns the sequence of requests every run replays."""
+
+    # Воспроизводимая нагрузка, а не криптография
+    rng = random.Random(args.seed)  # nosec
+    routes, weights = zip(*args.mix.items())
+
+    targets = []
+    for route in rng.choices(routes, weights, k=args.targets):
+        company = make_company(rng.randint(1, args.rows), args.seed)
+        targets.append(make_target(route, company, rng))
+
+    return targets
+
+
+def percentile(latencies: List[float], q: int) -> float:
+    # Ближайший ранг по отсортированным задержкам
+    index = max(0, -(-len(latencies) * q // 100) - 1)
+    return latencies[index]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    latencies = sorted(latencies)
+    summary: Dict[str, float] = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / duration, 1),
+    }
+
+    if latencies:
+        mean = sum(latencies, 0.0) / len(latencies)
+        summary["mean_ms"] = round(1000 * mean, 3)
+        for q in PERCENTILES:
+            summary[f"p{q}_ms"] = round(1000 * percentile(latencies, q), 3)
+        summary["max_ms"] = round(1000 * latencies[-1], 3)
+
+    return summary
+
+
+async def generate_load(
+        url: URL,
+        targets: List[Target],
+        args: argparse.Namespace,
+) -> Dict:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+
+    loop = asyncio.get_event_loop()
+    started_at = loop.time() + args.warmup
+    finished_at = started_at + args.duration
+
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async def client(session: aiohttp.ClientSession, n: int) -> None:
+        # Клиенты идут по общей последовательности со своих смещений
+        position = n * len(targets) // args.connections
+
+        while loop.time() < finished_at:
+            route, path, params = targets[position % len(targets)]
+            position += 1
+
+            request = session.get(url.with_path(path), params=params)
+
+            start = time.perf_counter()
+            try:
+                async with request as response:
+                    await response.read()
+                    failed = response.status >= 400
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                failed = True
+            elapsed = time.perf_counter() - start
+
+            if loop.time() < started_at:
+                continue
+            if failed:
+                errors[route] += 1
+            else:
+                latencies[route].append(elapsed)
+
+    async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+    ) as session:
+        await asyncio.gather(*(
+            client(session, n)
+            for n in range(args.connections)
+        ))
+
+    routes = {
+        route: summarize(latencies[route], errors[route], args.duration)
+        for route in args.mix
+    }
+    total = summarize(
+        [latency for values in latencies.values() for latency in values],
+        sum(errors.values()),
+        args.duration,
+    )
+
+    return {
+        "routes": routes,
+        "total": total,
+    }
+
+
+async def wait_until_ready(url: URL, process: subprocess.Popen) -> None:
+    async with aiohttp.ClientSession() as session:
+        for _ in range(300):
+            if process.poll() is not None:
+                code = process.returncode
+                raise RuntimeError(f"gunicorn exited with code {code}")
+            try:
+                async with session.get(url.with_path("/ping")) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+
+    raise RuntimeError("gunicorn did not start in time")
+
+
+@contextmanager
+def gunicorn_context(
+        db_url: str,
+        workers: int,
+        worker_class: Optional[str],
+) -> Iterator[Tuple[URL, subprocess.Popen]]:
+    port = unused_port()
+
+    environ = {
+        **os.environ,
+        "DB_URL": db_url,
+        "GUNICORN_BIND": f"{LOCALHOST}:{port}",
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_MAX_REQUESTS": "0",
+    }
+    if worker_class is not None:
+        environ["GUNICORN_WORKER_CLASS"] = worker_class
+
+    process = subprocess.Popen(  # nosec
+        [
+            sys.executable, "-c", GUNICORN_RUN,
+            "invest_api:create_app",
+            "--config", GUNICORN_CONFIG,
+        ],
+        cwd=ROOT,
+        env=environ,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        yield URL.build(scheme="http", host=LOCALHOST, port=port), process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def seed_dataset(db_url: str, args: argparse.Namespace) -> Dict:
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = Path(directory) / "dataset.jsonl"
+        write_rows(dataset, make_dataset(args))
+
+        connection = await asyncpg.connect(db_url)
+        try:
+            return await load(connection, dataset, args.batch_size)
+        finally:
+            await connection.close()
+
+
+async def run_workers(
+        db_url: str,
+        workers: int,
+        targets: List[Target],
+        args: argparse.Namespace,
+) -> Dict:
+    with gunicorn_context(db_url, workers, args.worker_class) as server:
+        url, process = server
+        await wait_until_ready(url, process)
+        report = await generate_load(url, targets, args)
+
+    return {
+        "workers": workers,
+        **report,
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        # git ищется в PATH того, кто запускает бенчмарк
+        output = subprocess.check_output(  # nosec
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+async def run(db_url: str, args: argparse.Namespace) -> Dict:
+    dataset = await seed_dataset(db_url, args)
+    targets = make_targets(args)
+
+    runs = []
+    for workers in args.workers:
+        runs.append(await run_workers(db_url, workers, targets, args))
+
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "arguments": {
+            "rows": args.rows,
+            "seed": args.seed,
+            "targets": args.targets,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "connections": args.connections,
+            "mix": args.mix,
+        },
+        "dataset": dataset,
+        "runs": runs,
+    }
+
+
+@contextmanager
+def database_context(db_url: Optional[str]) -> Iterator[str]:
+    if db_url is not None:
+        yield db_url
+        return
+
+    with ExitStack() as stack:
+        url = stack.enter_context(postgres_server_context(PostgresConfig()))
+        stack.enter_context(sqlalchemy_bind_context(url))
+        stack.enter_context(migrations_context(ALEMBIC_INI, url))
+        yield url
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=env.str("DB_URL", None))
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--worker-class", default=None)
+    parser.add_argument("--mix", nargs="+", default=list(DEFAULT_MIX))
+    parser.add_argument("--targets", type=int, default=100000)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+    args.mix = parse_mix(args.mix)
+
+    with database_context(args.db_url) as db_url:
+        result = asyncio.run(run(db_url, args))
+
+    report = json.dumps(result, indent=4)
+    if args.output is not None:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
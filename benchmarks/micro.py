@@ -0,0 +1,303 @@
+"""Measures the per-request CPU work that does not touch the database.
+
+Selection validation, company serialization, response building and the
+middleware chain are run on synthetic records at several batch sizes.
+Operations per second and bytes allocated per operation of every case
+are printed as JSON:
+
+    python -m benchmarks.micro --sizes 1 10 100 --save baseline.json
+    python -m benchmarks.micro --sizes 1 10 100 --baseline baseline.json
+
+With --baseline the run fails when a case is slower or allocates more
+than the stored one by more than --threshold. Baselines only compare
+runs made on the same machine and Python version.
+
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from http import HTTPStatus
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, cast
+
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from benchmarks.serializers import make_rows
+from invest_api import Company, CompanySchema
+from invest_api.app.catalogue import CurrentDataset
+from invest_api.app.compression import Compressor
+from invest_api.app.dataset import DatasetVersion
+from invest_api.app.middlewares import add_middlewares
+from invest_api.app.models import CompanySelectionSchema
+from invest_api.app.responses import create_response, encode_ok, raw_ok
+from invest_api.app.views import ViewsSchema
+from invest_api.types import Handler
+
+SELECTION_QUERY = {
+    "size": "Малая",
+    "region_codes": "77,50,78",
+    "is_acting": "1",
+    "bankruptcy_probability": "50",
+    "is_liquidating": "0",
+    "not_reported_last_year": "1",
+    "not_in_same_registry": "0",
+    "ceo_has_other_companies": "1",
+    "negative_list_risk": "0",
+    "limit": "10",
+}
+
+Case = Callable[[int], Callable[[], object]]
+AsyncCase = Callable[[int], Callable[[], Awaitable]]
+
+
+def selection_schema_load(size: int) -> Callable[[], object]:
+    schema = CompanySelectionSchema()
+    queries = [dict(SELECTION_QUERY, offset=str(i)) for i in range(size)]
+
+    def run() -> object:
+        return [schema.load(query) for query in queries]
+
+    return run
+
+
+def company_schema_dump(size: int) -> Callable[[], object]:
+    schema = CompanySchema()
+    rows = make_rows(size)
+
+    def run() -> object:
+        return schema.dump(rows, many=True)
+
+    return run
+
+
+def company_to_dict(size: int) -> Callable[[], object]:
+    companies = [Company(**row) for row in make_rows(size)]
+
+    def run() -> object:
+        return [company.to_dict() for company in companies]
+
+    return run
+
+
+def response_building(size: int) -> Callable[[], object]:
+    content = {
+        "data": CompanySchema().dump(make_rows(size), many=True),
+        "message": "OK",
+    }
+
+    def run() -> object:
+        return create_response(content, HTTPStatus.OK)
+
+    return run
+
+
+def make_app() -> web.Application:
+    app = web.Application()
+    add_middlewares(app)
+
+    dataset = CurrentDataset(None)
+    dataset.version = DatasetVersion(1, datetime.now(timezone.utc))
+
+    app["dataset"] = dataset
+    app["views"] = ViewsSchema().load({})
+    app["compressor"] = Compressor.from_dict({})
+    app["metrics"] = None
+
+    return app
+
+
+def middleware_chain(size: int) -> Callable[[], Awaitable]:
+    body = encode_ok(CompanySchema().dump(make_rows(size), many=True))
+
+    async def view(_: web.Request) -> web.Response:
+        return raw_ok(body)
+
+    app = make_app()
+    app.router.add_get(
+        "/companies/selection",
+        view,
+        name="companies_selection",
+    )
+
+    request = make_mocked_request(
+        hdrs.METH_GET,
+        "/companies/selection",
+        headers={hdrs.ACCEPT_ENCODING: "gzip"},
+        app=app,
+    )
+    match_info = asyncio.get_event_loop().run_until_complete(
+        app.router.resolve(request),
+    )
+    match_info.add_app(app)
+    request._match_info = match_info  # pylint: disable=W0212
+
+    # Обработчик оборачивается middleware так же, как это делает aiohttp
+    handler: Handler = view
+    for middleware in reversed(app.middlewares):
+        handler = cast(Handler, functools.partial(middleware, handler=handler))
+
+    def run() -> Awaitable:
+        return handler(request)
+
+    return run
+
+
+CASES: Dict[str, Case] = {
+    "selection_schema_load": selection_schema_load,
+    "company_schema_dump": company_schema_dump,
+    "company_to_dict": company_to_dict,
+    "response_building": response_building,
+}
+
+ASYNC_CASES: Dict[str, AsyncCase] = {
+    "middleware_chain": middleware_chain,
+}
+
+
+def measure_time(func: Callable, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def measure_async_time(func: Callable, number: int, repeat: int) -> float:
+    loop = asyncio.get_event_loop()
+
+    async def batch() -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        return time.perf_counter() - start
+
+    times = [loop.run_until_complete(batch()) for _ in range(repeat)]
+    return min(times) / number
+
+
+def measure_allocations(func: Callable, repeat: int) -> int:
+    # Пик отслеживаемой памяти за одну операцию, медиана по повторам
+    peaks = []
+
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            tracemalloc.clear_traces()
+            baseline, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+
+    return sorted(peaks)[len(peaks) // 2]
+
+
+def measure_case(
+        func: Callable,
+        is_async: bool,
+        args: argparse.Namespace,
+) -> Dict:
+    if is_async:
+        loop = asyncio.get_event_loop()
+        seconds = measure_async_time(func, args.number, args.repeat)
+        allocated = measure_allocations(
+            lambda: loop.run_until_complete(func()),
+            args.repeat,
+        )
+    else:
+        seconds = measure_time(func, args.number, args.repeat)
+        allocated = measure_allocations(func, args.repeat)
+
+    return {
+        "ops_per_sec": round(1 / seconds, 1),
+        "us_per_op": round(seconds * 1e6, 3),
+        "alloc_bytes_per_op": allocated,
+    }
+
+
+def run_cases(args: argparse.Namespace) -> Dict[str, Dict]:
+    cases = [(name, case, False) for name, case in CASES.items()]
+    cases += [(name, case, True) for name, case in ASYNC_CASES.items()]
+
+    results = {}
+    for name, case, is_async in cases:
+        if args.cases and name not in args.cases:
+            continue
+        for size in args.sizes:
+            func = case(size)
+            results[f"{name}[{size}]"] = measure_case(func, is_async, args)
+
+    return results
+
+
+def compare(
+        results: Dict[str, Dict],
+        baseline: Dict[str, Dict],
+        threshold: float,
+) -> List[str]:
+    regressions = []
+
+    for name, result in results.items():
+        stored = baseline.get(name)
+        if stored is None:
+            continue
+
+        ops = result["ops_per_sec"] / stored["ops_per_sec"]
+        if ops < 1 - threshold:
+            regressions.append(f"{name}: ops/sec {ops - 1:+.1%}")
+
+        allocated = result["alloc_bytes_per_op"]
+        limit = stored["alloc_bytes_per_op"] * (1 + threshold)
+        if allocated > limit:
+            regressions.append(
+                f"{name}: allocations {allocated} > {int(limit)} bytes",
+            )
+
+    return regressions
+
+
+def read_baseline(path: Optional[Path]) -> Optional[Dict[str, Dict]]:
+    if path is None:
+        return None
+    return json.loads(path.read_text())["results"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--cases", nargs="+", default=None)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--save", type=Path, default=None)
+    args = parser.parse_args()
+
+    baseline = read_baseline(args.baseline)
+    results = run_cases(args)
+
+    report = {
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+    if baseline is not None:
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    output = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.save is not None:
+        args.save.write_text(output)
+    print(output)
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
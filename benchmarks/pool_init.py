@@ -0,0 +1,131 @@
+"""Measures the latency of freshly opened connections.
+
+For every connection init mode a number of new connections is opened,
+the time of the init itself and of the first execution of each known
+query is recorded, and the medians are printed as JSON:
+
+    DB_URL=postgresql://... python -m benchmarks.pool_init
+
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+import asyncpg
+
+from invest_api.app.db import (
+    COMPANIES_BY_IDS_QUERY,
+    COMPANIES_BY_ITNS_QUERY,
+    COMPANIES_BY_PSRNS_QUERY,
+    COMPANY_BY_ITN_QUERY,
+    COMPANY_BY_PSRN_QUERY,
+    SELECT_COMPANY_QUERY,
+    ConnectionInit,
+)
+from invest_api.settings import env
+
+MODES = {
+    "lazy": None,
+    "prepare": ConnectionInit(prepare=True),
+    "prepare_text_dates": ConnectionInit(prepare=True, text_dates=True),
+}
+
+
+async def sample_queries(url: str) -> List[Tuple[str, str, tuple]]:
+    connection = await asyncpg.connect(url)
+    try:
+        company = await connection.fetchrow(
+            "SELECT * FROM companies ORDER BY id LIMIT 1;",
+        )
+    finally:
+        await connection.close()
+
+    if company is None:
+        raise RuntimeError("companies table is empty")
+
+    selection = (
+        company["size"],
+        [company["region_code"]],
+        company["is_acting"],
+        100,
+        company["is_liquidating"],
+        company["not_reported_last_year"],
+        company["not_in_same_registry"],
+        company["ceo_has_other_companies"],
+        company["negative_list_risk"],
+        100,
+        0,
+    )
+
+    return [
+        ("company_by_itn", COMPANY_BY_ITN_QUERY, (company["itn"], )),
+        ("company_by_psrn", COMPANY_BY_PSRN_QUERY, (company["psrn"], )),
+        ("companies_by_itns", COMPANIES_BY_ITNS_QUERY, ([company["itn"]], )),
+        ("companies_by_psrns", COMPANIES_BY_PSRNS_QUERY, (
+            [company["psrn"]],
+        )),
+        ("companies_by_ids", COMPANIES_BY_IDS_QUERY, ([company["id"]], )),
+        ("select_company", SELECT_COMPANY_QUERY, selection),
+    ]
+
+
+async def measure_mode(
+        url: str,
+        init: ConnectionInit,
+        queries: List[Tuple[str, str, tuple]],
+        connections: int,
+) -> Dict[str, float]:
+    timings: Dict[str, List[float]] = {"init": []}
+
+    for _ in range(connections):
+        connection = await asyncpg.connect(url)
+        try:
+            started = time.perf_counter()
+            if init is not None:
+                await init(connection)
+            timings["init"].append(time.perf_counter() - started)
+
+            for name, query, args in queries:
+                started = time.perf_counter()
+                await connection.fetch(query, *args)
+                elapsed = time.perf_counter() - started
+                timings.setdefault(name, []).append(elapsed)
+        finally:
+            await connection.close()
+
+    result = {
+        f"{name}_ms": statistics.median(values) * 1000
+        for name, values in timings.items()
+    }
+    result["first_queries_ms"] = sum(
+        value
+        for name, value in result.items()
+        if name != "init_ms"
+    )
+    return result
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    queries = await sample_queries(args.db_url)
+    return {
+        name: await measure_mode(args.db_url, init, queries, args.connections)
+        for name, init in MODES.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=env.str("DB_URL", None))
+    parser.add_argument("--connections", type=int, default=20)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
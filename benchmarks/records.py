@@ -0,0 +1,82 @@
+"""Compares cached ORM companies with CompanyRecord.
+
+Measures the memory a cache entry takes and the time the detail view
+spends to encode a response body from it, and prints both as JSON.
+ORM instances share their values with the source rows, so their size
+is a lower bound:
+
+    python -m benchmarks.records --companies 10000
+
+"""
+
+import argparse
+import gc
+import json
+import timeit
+import tracemalloc
+from typing import Callable, List
+
+from invest_api import Company
+from invest_api.app.models import CompanyRecord
+from invest_api.app.responses import encode_ok, encode_raw_ok
+
+from .serializers import make_rows
+
+
+def allocated(factory: Callable[[], List]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        objects = factory()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(objects)
+
+
+def measure(func: Callable, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--companies", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.companies)
+
+    orm_bytes = allocated(lambda: [Company(**row) for row in rows])
+    record_bytes = allocated(
+        lambda: [CompanyRecord.from_record(row) for row in rows],
+    )
+
+    company = Company(**rows[0])
+    record = CompanyRecord.from_record(rows[0])
+    assert encode_ok(company.to_dict()) == encode_raw_ok(record.json)
+
+    orm_time = measure(
+        lambda: encode_ok(company.to_dict()),
+        args.number,
+        args.repeat,
+    )
+    record_time = measure(
+        lambda: encode_raw_ok(record.json),
+        args.number,
+        args.repeat,
+    )
+
+    result = {
+        "companies": args.companies,
+        "orm_bytes": orm_bytes,
+        "record_bytes": record_bytes,
+        "orm_us": orm_time * 1e6,
+        "record_us": record_time * 1e6,
+    }
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Compares the compiled company serializer with CompanySchema.dump.
+
+Both paths encode the same page of rows to JSON bytes, as the views do,
+and the best time per page of each one is printed as JSON:
+
+    python -m benchmarks.serializers --rows 100
+
+"""
+
+import argparse
+import json
+import timeit
+from datetime import date
+from typing import Callable, Dict, List
+
+import orjson
+
+from invest_api import CompanySchema
+from invest_api.app.serializers import compile_serializer
+
+
+def make_rows(count: int) -> List[Dict]:
+    return [
+        {
+            "id": i,
+            "name": f"ООО Компания {i}",
+            "size": "Малая",
+            "registered_at": date(2010, 1, 1),
+            "itn": f"{i:010}",
+            "psrn": f"{i:013}",
+            "region_code": "77",
+            "region_name": "Москва",
+            "activity_code": "47.51.1",
+            "activity_name": None,
+            "charter_capital": 10000,
+            "is_acting": True,
+            "is_liquidating": False,
+            "not_reported_last_year": None,
+            "not_in_same_registry": False,
+            "ceo_has_other_companies": True,
+            "negative_list_risk": False,
+            "bankruptcy_probability": i % 100,
+            "bankruptcy_vars": '{"x": 1}',
+            "is_enough_finance_data": True,
+            "relative_success": 3,
+            "revenue_forecast": 25000,
+            "assets_forecast": None,
+            "dev_stage": "Рост активов",
+            "dev_stage_coordinates": None,
+        }
+        for i in range(count)
+    ]
+
+
+def measure(func: Callable, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    schema = CompanySchema()
+    serialize = compile_serializer(schema)
+
+    def schema_path() -> bytes:
+        return orjson.dumps(schema.dump(rows, many=True))
+
+    def compiled_path() -> bytes:
+        return orjson.dumps(list(map(serialize, rows)))
+
+    assert schema_path() == compiled_path()
+
+    schema_time = measure(schema_path, args.number, args.repeat)
+    compiled_time = measure(compiled_path, args.number, args.repeat)
+
+    result = {
+        "rows": args.rows,
+        "schema_us": schema_time * 1e6,
+        "compiled_us": compiled_time * 1e6,
+        "speedup": schema_time / compiled_time,
+    }
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compares the in-process typeahead with the pg_trgm query.
+
+Runs a sample of company names, cut to their first characters, through
+both engines and prints recall@k of the typeahead against the SQL
+results together with latency percentiles as JSON:
+
+    DB_URL=postgresql://... python -m benchmarks.typeahead
+
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Dict, List, Sequence
+
+import asyncpg
+
+from invest_api.app.typeahead import TrigramIndex
+from invest_api.settings import env
+
+SQL_QUERY = """
+    SELECT
+        id
+        , companies.name <-> $1::TEXT AS distance
+    FROM companies
+    ORDER BY distance
+    LIMIT $2::SMALLINT
+    ;
+"""
+
+
+def percentiles(timings: Sequence[float]) -> Dict[str, float]:
+    ordered = sorted(timings)
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p99_ms": ordered[int(len(ordered) * 0.99)] * 1000,
+    }
+
+
+def make_queries(names: List[str], count: int, length: int) -> List[str]:
+    # Выборка только воспроизводит набор запросов по зерну
+    sample = random.sample(names, min(count, len(names)))  # nosec
+    return [name[:length] for name in sample]
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    connection = await asyncpg.connect(args.db_url)
+
+    try:
+        rows = await connection.fetch("SELECT id, name FROM companies;")
+        rows = [(row["id"], row["name"]) for row in rows]
+
+        if not rows:
+            raise RuntimeError("companies table is empty")
+
+        started = time.perf_counter()
+        index = TrigramIndex(rows)
+        build_time = time.perf_counter() - started
+
+        queries = make_queries([name for _, name in rows], args.queries,
+                               args.length)
+
+        sql_timings, index_timings, recalls = [], [], []
+        for query in queries:
+            started = time.perf_counter()
+            records = await connection.fetch(SQL_QUERY, query, args.limit)
+            sql_timings.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            found = index.search(query, args.limit)
+            index_timings.append(time.perf_counter() - started)
+
+            expected = {record["id"] for record in records}
+            if expected:
+                recalls.append(len(expected & set(found)) / len(expected))
+    finally:
+        await connection.close()
+
+    return {
+        "companies": len(rows),
+        "queries": len(queries),
+        "limit": args.limit,
+        "build_s": build_time,
+        "recall": statistics.mean(recalls) if recalls else None,
+        "sql": percentiles(sql_timings),
+        "typeahead": percentiles(index_timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=env.str("DB_URL", None))
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--length", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from multiprocessing import cpu_count
 from os import getenv as env
 
 from invest_api import log, settings
+from invest_api.app import cache, metrics
 
 STDOUT = "-"
 
@@ -70,3 +71,14 @@ proc_name = env("GUNICORN_PROC_NAME", "invest_api")
 
 # Internal setting that is adjusted for each type of application.
 default_proc_name = env("GUNiCORN_DEFAULT_PROC_NAME", "invest_api")
+
+
+def on_starting(_):
+    """Removes metrics samples and cached entries of a previous run."""
+    metrics.clear_multiprocess_dir()
+    cache.remove_shared_file(settings.get_cache_config())
+
+
+def child_exit(_, worker):
+    """Drops live gauges of an exited worker from aggregated metrics."""
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,629 @@
+import asyncio
+import fcntl
+import mmap
+import os
+# Файл кэша закрыт от других пользователей, см. make_private_dir
+import pickle  # nosec
+import stat
+import struct
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import partial, wraps
+from hashlib import blake2b
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+from zlib import crc32
+
+from marshmallow import Schema, ValidationError, fields, post_load, validate
+
+from .metrics import Metrics
+
+__all__ = (
+    "Cache",
+    "CacheSchema",
+    "HotKeys",
+    "MemoryBackend",
+    "SharedMemoryBackend",
+    "cached",
+    "default_cache_path",
+    "make_key",
+    "remove_shared_file",
+)
+
+Key = Tuple[Hashable, ...]
+Loader = Callable[[], Awaitable]
+
+MISSING = object()
+
+LRU = "lru"
+FIFO = "fifo"
+
+MEMORY = "memory"
+SHARED = "shared"
+
+
+def make_key(method: str, *args: Hashable) -> Key:
+    return (method, *args)
+
+
+def key_method(key: Key) -> str:
+    # Ключ всегда начинается с имени метода, см. make_key
+    return cast(str, key[0])
+
+
+def default_cache_path() -> str:
+    # Каталог RuntimeDirectory= из systemd или runtime-каталог пользователя
+    runtime = (
+        os.environ.get("RUNTIME_DIRECTORY")
+        or os.environ.get("XDG_RUNTIME_DIR")
+        or tempfile.gettempdir()
+    )
+    return os.path.join(runtime, f"invest_api-{os.getuid()}", "cache")
+
+
+def remove_shared_file(config: Dict) -> None:
+    """Removes the file of a shared cache left by a previous run."""
+
+    if config.get("backend") != SHARED:
+        return
+
+    try:
+        os.remove(config.get("path") or default_cache_path())
+    except FileNotFoundError:
+        pass
+
+
+def make_private_dir(path: str) -> None:
+    """Creates a directory which only the current user may access."""
+
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise NotADirectoryError(f"Cache directory is not a directory: {path}")
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"Cache directory is not private: {path}")
+
+
+class MemoryBackend:
+    """In-process storage bounded by the number of entries."""
+
+    __slots__ = ("_maxsize", "_eviction", "_data")
+
+    def __init__(self, maxsize: int = 512, eviction: str = LRU):
+        self._maxsize = maxsize
+        self._eviction = eviction
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Key, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            return default
+        if self._eviction == LRU:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Key, value: Any) -> Optional[Key]:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self._maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            return evicted
+        return None
+
+    def delete(self, key: Key) -> bool:
+        return self._data.pop(key, MISSING) is not MISSING
+
+    def evict(self, method: str) -> None:
+        for key in [key for key in self._data if key[0] == method]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def close(self) -> None:
+        self._data.clear()
+
+
+class SharedMemoryBackend:
+    """Storage in a memory-mapped file shared by all worker processes.
+
+    The file is split into fixed-size slots grouped into sets of
+    ``ways`` slots. A key may only live in the set picked by its hash,
+    so a lookup scans a handful of slots under a shared lock of that
+    set, and a store replaces the oldest slot of the set according to
+    the eviction policy. Values are pickled, entries which do not fit
+    into a slot are not stored. Every slot is tagged with a checksum of
+    the method name, so all entries of a method are evicted by a scan
+    of slot headers.
+
+    Unpickling runs code, so the file must live in a directory only the
+    service user can write to: a missing one is created private and a
+    shared one is refused. A file of another layout is never resized,
+    since other workers may have it mapped: it is replaced by a new one
+    and the workers which still use it keep their copy.
+    """
+
+    MAGIC = b"INVCACHE"
+    HEADER = struct.Struct("<8sIII")
+    SLOT = struct.Struct("<QQQII")
+
+    __slots__ = (
+        "_path",
+        "_size",
+        "_slot_size",
+        "_ways",
+        "_eviction",
+        "_fd",
+        "_mmap",
+        "_sets",
+    )
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            path: str,
+            size: int = 64 * 1024 * 1024,
+            slot_size: int = 4096,
+            ways: int = 8,
+            eviction: str = LRU,
+    ):
+        self._path = path
+        self._slot_size = slot_size
+        self._ways = ways
+        self._eviction = eviction
+
+        self._sets = (size - self.HEADER.size) // (slot_size * ways)
+        if self._sets < 1:
+            raise ValueError("Cache size is less than a single slot set")
+
+        self._size = self.HEADER.size + self._sets * ways * slot_size
+
+        make_private_dir(os.path.dirname(os.path.abspath(path)))
+        self._fd = self._open()
+        self._mmap = mmap.mmap(self._fd, self._size)
+
+    def _open(self) -> int:
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self._slot_size,
+            self._ways,
+            self._sets,
+        )
+        flags = os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW
+
+        while True:
+            fd = os.open(self._path, flags, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                if self._prepare(fd, header):
+                    return fd
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _prepare(self, fd: int, header: bytes) -> bool:
+        info = os.fstat(fd)
+        if not info.st_nlink:
+            # Файл заменили, пока ожидалась блокировка
+            return False
+
+        if not info.st_size:
+            os.ftruncate(fd, self._size)
+            os.pwrite(fd, header, 0)
+            return True
+
+        actual = os.pread(fd, self.HEADER.size, 0)
+        if info.st_size == self._size and actual == header:
+            return True
+
+        self._replace(header)
+        return False
+
+    def _replace(self, header: bytes) -> None:
+        # Файл другого формата может быть отображен в память живыми
+        # воркерами, поэтому он не обрезается, а заменяется новым
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, path = tempfile.mkstemp(dir=directory)
+        try:
+            os.ftruncate(fd, self._size)
+            os.pwrite(fd, header, 0)
+            os.replace(path, self._path)
+        except OSError:
+            os.remove(path)
+            raise
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _lock(self, operation: int, start: int, length: int) -> Iterator:
+        fcntl.lockf(self._fd, operation, length, start)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _locate(self, key: Key) -> Tuple[bytes, int, int]:
+        raw = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        digest = int.from_bytes(blake2b(raw, digest_size=8).digest(), "little")
+        offset = self.HEADER.size + digest % self._sets * self._ways * (
+            self._slot_size
+        )
+        return raw, digest, offset
+
+    def _slots(self, offset: int) -> Iterator[int]:
+        for way in range(self._ways):
+            yield offset + way * self._slot_size
+
+    def _find(self, raw: bytes, digest: int, offset: int) -> Optional[int]:
+        for slot in self._slots(offset):
+            hashed, _, _, length, _ = self.SLOT.unpack_from(self._mmap, slot)
+            if length and hashed == digest:
+                start = slot + self.SLOT.size
+                if self._mmap[start:start + len(raw)] == raw:
+                    return slot
+        return None
+
+    def get(self, key: Key, default: Any = None) -> Any:
+        raw, digest, offset = self._locate(key)
+        length = self._ways * self._slot_size
+
+        # Чтение при LRU обновляет время доступа к слоту
+        operation = fcntl.LOCK_EX if self._eviction == LRU else fcntl.LOCK_SH
+
+        with self._lock(operation, offset, length):
+            slot = self._find(raw, digest, offset)
+            if slot is None:
+                return default
+
+            _, _, inserted, size, tag = self.SLOT.unpack_from(
+                self._mmap, slot,
+            )
+            start = slot + self.SLOT.size + len(raw)
+            payload = self._mmap[start:slot + self.SLOT.size + size]
+
+            if self._eviction == LRU:
+                self.SLOT.pack_into(
+                    self._mmap,
+                    slot,
+                    digest,
+                    time.monotonic_ns(),
+                    inserted,
+                    size,
+                    tag,
+                )
+
+        try:
+            return pickle.loads(payload)  # nosec
+        except Exception:  # pylint: disable=W0703
+            self.delete(key)
+            return default
+
+    def set(self, key: Key, value: Any) -> Optional[Key]:
+        raw, digest, offset = self._locate(key)
+        payload = raw + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self._slot_size - self.SLOT.size:
+            return None
+
+        length = self._ways * self._slot_size
+        evicted = None
+
+        with self._lock(fcntl.LOCK_EX, offset, length):
+            slot = self._find(raw, digest, offset)
+            if slot is None:
+                slot = self._victim(offset)
+                evicted = self._key(slot)
+
+            stamp = time.monotonic_ns()
+            tag = crc32(key_method(key).encode())
+            self.SLOT.pack_into(
+                self._mmap, slot, digest, stamp, stamp, len(payload), tag,
+            )
+            start = slot + self.SLOT.size
+            self._mmap[start:start + len(payload)] = payload
+
+        return evicted
+
+    def _key(self, slot: int) -> Optional[Key]:
+        *_, size, _ = self.SLOT.unpack_from(self._mmap, slot)
+        if not size:
+            return None
+
+        # Полезная нагрузка начинается с ключа, и pickle читает только его
+        start = slot + self.SLOT.size
+        try:
+            return pickle.loads(self._mmap[start:start + size])  # nosec
+        except Exception:  # pylint: disable=W0703
+            return None
+
+    def _victim(self, offset: int) -> int:
+        victim = offset
+        oldest: Optional[int] = None
+
+        for slot in self._slots(offset):
+            _, accessed, inserted, length, _ = self.SLOT.unpack_from(
+                self._mmap, slot,
+            )
+            if not length:
+                return slot
+
+            stamp = accessed if self._eviction == LRU else inserted
+            if oldest is None or stamp < oldest:
+                victim, oldest = slot, stamp
+
+        return victim
+
+    def delete(self, key: Key) -> bool:
+        raw, digest, offset = self._locate(key)
+        length = self._ways * self._slot_size
+
+        with self._lock(fcntl.LOCK_EX, offset, length):
+            slot = self._find(raw, digest, offset)
+            if slot is None:
+                return False
+            self.SLOT.pack_into(self._mmap, slot, 0, 0, 0, 0, 0)
+            return True
+
+    def evict(self, method: str) -> None:
+        start = self.HEADER.size
+        tag = crc32(method.encode())
+        empty = bytes(self.SLOT.size)
+
+        with self._lock(fcntl.LOCK_EX, start, self._size - start):
+            for offset in range(start, self._size, self._slot_size):
+                *_, length, actual = self.SLOT.unpack_from(self._mmap, offset)
+                if length and actual == tag:
+                    self._mmap[offset:offset + self.SLOT.size] = empty
+
+    def clear(self) -> None:
+        start = self.HEADER.size
+        empty = bytes(self.SLOT.size)
+
+        with self._lock(fcntl.LOCK_EX, start, self._size - start):
+            for offset in range(start, self._size, self._slot_size):
+                self._mmap[offset:offset + self.SLOT.size] = empty
+
+    def close(self) -> None:
+        self._mmap.close()
+        os.close(self._fd)
+
+
+Backend = Union[MemoryBackend, SharedMemoryBackend]
+
+
+class HotKeys:
+    """Approximate access counts of the most requested keys.
+
+    Counts are halved after every snapshot, so keys which are no longer
+    requested fade out. Only the ``capacity`` most frequent keys are
+    kept between snapshots.
+    """
+
+    __slots__ = ("_capacity", "_counts")
+
+    def __init__(self, capacity: int = 10000):
+        self._capacity = capacity
+        self._counts: Counter = Counter()
+
+    def touch(self, key: Key) -> None:
+        self._counts[key] += 1
+        if len(self._counts) > 2 * self._capacity:
+            self._counts = Counter(dict(
+                self._counts.most_common(self._capacity),
+            ))
+
+    def snapshot(self, size: int) -> Dict[str, List[tuple]]:
+        hottest: Dict[str, List[tuple]] = {}
+
+        for (method, *args), _ in self._counts.most_common():
+            keys = hottest.setdefault(method, [])
+            if len(keys) < size:
+                keys.append(tuple(args))
+
+        self._counts = Counter({
+            key: count // 2
+            for key, count in self._counts.items()
+            if count > 1
+        })
+
+        return hottest
+
+
+class Cache:
+    """Cache of coroutine results on top of a storage backend.
+
+    Concurrent lookups of the same missing key share a single load,
+    failed loads are never cached. Entries expire after the TTL of
+    their method, the default TTL or never, in that order. Every
+    deletion, eviction or clearing starts a new generation: loads of
+    an older generation might have read replaced data, so their
+    results are returned to their callers but not cached.
+    """
+
+    __slots__ = (
+        "_backend",
+        "_ttl",
+        "_ttls",
+        "_pending",
+        "_generation",
+        "hot_keys",
+        "metrics",
+    )
+
+    def __init__(
+            self,
+            backend: Backend = None,
+            ttl: Optional[float] = None,
+            ttls: Dict[str, float] = None,
+    ):
+        self._backend = backend or MemoryBackend()
+        self._ttl = ttl
+        self._ttls = ttls or {}
+        self._pending: Dict[Key, asyncio.Future] = {}
+        self._generation = 0
+        self.hot_keys: Optional[HotKeys] = None
+        self.metrics: Optional[Metrics] = None
+
+    def __contains__(self, key: Key) -> bool:
+        return self.get(key, MISSING) is not MISSING
+
+    def get(self, key: Key, default: Any = None) -> Any:
+        entry = self._backend.get(key, MISSING)
+        if entry is MISSING:
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._backend.delete(key)
+            return default
+
+        return value
+
+    def set(self, key: Key, value: Any) -> None:
+        ttl = self._ttls.get(key_method(key), self._ttl)
+        expires_at = None if ttl is None else time.time() + ttl
+        evicted = self._backend.set(key, (expires_at, value))
+
+        if evicted is not None and self.metrics is not None:
+            self.metrics.observe_eviction(key_method(evicted))
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def delete(self, key: Key) -> bool:
+        self._invalidate()
+        return self._backend.delete(key)
+
+    def evict(self, method: str) -> None:
+        self._invalidate()
+        self._backend.evict(method)
+
+    def clear(self) -> None:
+        self._invalidate()
+        self._backend.clear()
+
+    def _invalidate(self) -> None:
+        # Загрузки в процессе не разделяются с новыми запросами
+        self._generation += 1
+        self._pending.clear()
+
+    def close(self) -> None:
+        self._backend.close()
+
+    def touch(self, key: Key) -> None:
+        if self.hot_keys is not None:
+            self.hot_keys.touch(key)
+
+    def lookup(self, key: Key, default: Any = None) -> Any:
+        """Returns a cached value, counting the request of its key."""
+
+        self.touch(key)
+
+        value = self.get(key, MISSING)
+        if self.metrics is not None:
+            self.metrics.observe_cache(key_method(key), value is not MISSING)
+
+        return default if value is MISSING else value
+
+    async def get_or_load(self, key: Key, loader: Loader) -> Any:
+        value = self.lookup(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            future.add_done_callback(
+                partial(self._loaded, key, self._generation),
+            )
+            self._pending[key] = future
+
+        return await asyncio.shield(future)
+
+    def _loaded(
+            self,
+            key: Key,
+            generation: int,
+            future: asyncio.Future,
+    ) -> None:
+        if self._pending.get(key) is future:
+            del self._pending[key]
+
+        if generation != self._generation:
+            return
+        if not future.cancelled() and future.exception() is None:
+            self.set(key, future.result())
+
+
+def cached(method: Callable) -> Callable:
+    """Caches method results in the ``_cache`` of its instance."""
+
+    name = method.__name__
+
+    @wraps(method)
+    async def wrapper(self, *args: Hashable) -> Any:
+        key = make_key(name, *args)
+        loader = partial(method, self, *args)
+        return await self._cache.get_or_load(key, loader)
+
+    return wrapper
+
+
+class CacheSchema(Schema):
+    backend = fields.Str(missing=MEMORY, validate=validate.OneOf([
+        MEMORY,
+        SHARED,
+    ]))
+    eviction = fields.Str(missing=LRU, validate=validate.OneOf([
+        LRU,
+        FIFO,
+    ]))
+
+    # Настройки локального кэша
+    maxsize = fields.Int(missing=512, validate=validate.Range(min=1))
+
+    # Настройки разделяемого между воркерами кэша
+    path = fields.Str(missing=None, allow_none=True)
+    size = fields.Int(missing=64 * 1024 * 1024, validate=validate.Range(
+        min=1024 * 1024,
+    ))
+    slot_size = fields.Int(missing=4096, validate=validate.Range(min=512))
+
+    # Время жизни записей в секундах, по умолчанию и для отдельных методов
+    ttl = fields.Float(missing=None, allow_none=True)
+    ttls = fields.Dict(keys=fields.Str(), values=fields.Float(), missing=dict)
+
+    @post_load
+    def make_cache(self, data: Dict, **kwargs) -> Cache:
+        backend: Backend
+        if data["backend"] == SHARED:
+            try:
+                backend = SharedMemoryBackend(
+                    path=data["path"] or default_cache_path(),
+                    size=data["size"],
+                    slot_size=data["slot_size"],
+                    eviction=data["eviction"],
+                )
+            except (OSError, ValueError) as e:
+                raise ValidationError(str(e), "path")
+        else:
+            backend = MemoryBackend(
+                maxsize=data["maxsize"],
+                eviction=data["eviction"],
+            )
+
+        return Cache(backend, data["ttl"], data["ttls"])
@@ -0,0 +1,41 @@
+from typing import Optional
+
+from .dataset import DatasetVersion
+from .db import DB
+from .responses import encode_ok
+
+__all__ = (
+    "CurrentDataset",
+    "RegionsCatalogue",
+)
+
+
+class CurrentDataset:
+    """Version of the dataset the service currently serves."""
+
+    __slots__ = ("_db", "version")
+
+    def __init__(self, db: DB):
+        self._db = db
+        self.version: Optional[DatasetVersion] = None
+
+    async def refresh(self) -> None:
+        self.version = await self._db.get_dataset_version()
+
+
+class RegionsCatalogue:
+    """Regions encoded into a response body once per dataset version."""
+
+    __slots__ = ("_db", "version", "body")
+
+    def __init__(self, db: DB):
+        self._db = db
+        self.version = None
+        self.body = encode_ok({})
+
+    async def refresh(self) -> None:
+        dataset = await self._db.get_dataset_version()
+        regions = await self._db.get_regions()
+
+        self.version = dataset.version
+        self.body = encode_ok(dict(regions))
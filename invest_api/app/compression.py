@@ -0,0 +1,165 @@
+import asyncio
+import zlib
+from hashlib import blake2b
+from typing import Callable, Dict, Iterable, Optional
+
+from marshmallow import Schema, ValidationError, fields, post_load, validate
+
+from .cache import MemoryBackend
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+__all__ = (
+    "Compressor",
+    "CompressionSchema",
+)
+
+GZIP = "gzip"
+BROTLI = "br"
+ZSTD = "zstd"
+
+
+def gzip_compress(body: bytes) -> bytes:
+    # Без времени в заголовке одинаковые ответы сжимаются одинаково
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def brotli_compress(body: bytes) -> bytes:
+    return brotli.compress(body, quality=5)
+
+
+def zstd_compress(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(body)
+
+
+# Кодировки в порядке предпочтения сервера
+CODECS: Dict[str, Callable[[bytes], bytes]] = {
+    ZSTD: zstd_compress,
+    BROTLI: brotli_compress,
+    GZIP: gzip_compress,
+}
+
+MODULES = {
+    ZSTD: zstandard,
+    BROTLI: brotli,
+    GZIP: zlib,
+}
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Returns the quality values of the codings a client accepts."""
+
+    codings = {}
+    for item in header.split(","):
+        coding, *params = item.strip().split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            codings[coding.strip().lower()] = quality
+    return codings
+
+
+class Compressor:
+    """Compresses response bodies with the best encoding a client accepts.
+
+    Compressed bodies are cached by their content hash, so the same
+    response is compressed once while it stays hot. Bodies larger than
+    ``executor_size`` are compressed on the default executor.
+    """
+
+    __slots__ = ("_encodings", "min_size", "_executor_size", "_cache")
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            encodings: Iterable[str] = None,
+            min_size: int = 1024,
+            executor_size: int = 64 * 1024,
+            cache_size: int = 256,
+    ):
+        if encodings is None:
+            encodings = [name for name in CODECS if MODULES[name]]
+
+        for name in encodings:
+            if MODULES[name] is None:
+                raise RuntimeError(f"{name} compression is not installed")
+
+        self._encodings = [name for name in CODECS if name in encodings]
+        self.min_size = min_size
+        self._executor_size = executor_size
+        self._cache = MemoryBackend(cache_size)
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        if not accept_encoding:
+            return None
+
+        codings = parse_accept_encoding(accept_encoding)
+        default = codings.get("*", 0.0)
+
+        for name in self._encodings:
+            if codings.get(name, default) > 0:
+                return name
+        return None
+
+    async def compress(self, body: bytes, encoding: str) -> bytes:
+        key = (encoding, blake2b(body, digest_size=16).digest())
+
+        compressed = self._cache.get(key)
+        if compressed is not None:
+            return compressed
+
+        codec = CODECS[encoding]
+        if len(body) < self._executor_size:
+            compressed = codec(body)
+        else:
+            loop = asyncio.get_event_loop()
+            compressed = await loop.run_in_executor(None, codec, body)
+
+        self._cache.set(key, compressed)
+        return compressed
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Optional["Compressor"]:
+        return CompressionSchema().load(data)
+
+
+class CompressionSchema(Schema):
+    enabled = fields.Bool(missing=True)
+    encodings = fields.List(
+        fields.Str(validate=validate.OneOf(list(CODECS))),
+        missing=None,
+        allow_none=True,
+    )
+
+    # Ответы меньше min_size не сжимаются, больше executor_size
+    # сжимаются в пуле потоков, чтобы не блокировать цикл событий
+    min_size = fields.Int(missing=1024, validate=validate.Range(min=0))
+    executor_size = fields.Int(
+        missing=64 * 1024,
+        validate=validate.Range(min=0),
+    )
+    cache_size = fields.Int(missing=256, validate=validate.Range(min=1))
+
+    @post_load
+    def make_compressor(self, data: Dict, **kwargs) -> Optional[Compressor]:
+        if not data.pop("enabled"):
+            return None
+
+        try:
+            return Compressor(**data)
+        except RuntimeError as e:
+            raise ValidationError(str(e), "encodings")
@@ -0,0 +1,11 @@
+from datetime import datetime
+
+import attr
+
+__all__ = ("DatasetVersion", )
+
+
+@attr.s(slots=True, frozen=True)
+class DatasetVersion:
+    version: int = attr.ib()
+    updated_at: datetime = attr.ib()
@@ -1,124 +1,1071 @@
+# pylint: disable=C0302
+
+import asyncio
 import logging
-from typing import Dict
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
-from async_lru import alru_cache
+import attr
+import orjson
+from asyncpg import Connection, Record
 from asyncpg.pool import Pool, create_pool
-from marshmallow import Schema, fields, post_load
+from marshmallow import Schema, fields, post_load, pre_load, validate
 
+from .cache import Cache, CacheSchema, HotKeys, cached, make_key
+from .dataset import DatasetVersion
 from .exceptions import CompanyNotFound
-from .models import Company, CompanySelection
+from .listener import Listener
+from .metrics import Metrics, timed
+from .models import (
+    FACETS,
+    CompanyPage,
+    CompanyRecord,
+    CompanySelection,
+    SelectionTotal,
+)
+from .querylog import QueryLog
+from .replicas import LATENCY, LEAST_LOADED, Router
+from .snapshot import Snapshot, SnapshotSchema
 
 __all__ = (
     "DB",
     "DBSchema",
 )
 
-CACHED = alru_cache(maxsize=512, cache_exceptions=False)
+COMPANIES_CHANNEL = "companies"
+DATASET_CHANNEL = "dataset"
+
+# Результаты этих методов могут содержать любую компанию,
+# поэтому при изменении компании они очищаются целиком
+LIST_METHODS = (
+    "get_companies_by_ids",
+    "get_companies_by_ids_json",
+    "get_companies_by_name",
+    "get_companies_by_name_json",
+    "select_company",
+    "select_company_json",
+    "get_selection_facets",
+    "count_selection",
+)
+
+# Параметры этих методов сохраняются в снимок как словари
+SELECTION_METHODS = (
+    "select_company",
+    "select_company_json",
+    "get_selection_facets",
+    "count_selection",
+)
+
+COMPANY_BY_ITN_QUERY = """
+    SELECT * FROM companies WHERE itn = $1::TEXT LIMIT 1;
+"""
+
+COMPANY_BY_PSRN_QUERY = """
+    SELECT * FROM companies WHERE psrn = $1::TEXT LIMIT 1;
+"""
+
+COMPANIES_BY_IDS_QUERY = """
+    SELECT * FROM companies WHERE id = ANY($1::BIGINT[]);
+"""
+
+COMPANIES_BY_ITNS_QUERY = """
+    SELECT * FROM companies WHERE itn = ANY($1::TEXT[]);
+"""
+
+COMPANIES_BY_PSRNS_QUERY = """
+    SELECT * FROM companies WHERE psrn = ANY($1::TEXT[]);
+"""
+
+# Компании из пакетных запросов кэшируются под ключами одиночных методов,
+# каждому из которых соответствуют столбец ключа и пакетный запрос
+BATCH_QUERIES = {
+    "get_company_by_itn": ("itn", COMPANIES_BY_ITNS_QUERY),
+    "get_company_by_psrn": ("psrn", COMPANIES_BY_PSRNS_QUERY),
+}
+
+COMPANIES_BY_NAME_QUERY = """
+    SELECT
+        *
+        , companies.name <-> $1::TEXT AS distance
+    FROM companies
+    ORDER BY distance
+    LIMIT $2::SMALLINT
+    ;
+"""
+
+COMPANIES_BY_NAMES_QUERY = """
+    SELECT
+        queries.ordinality AS query_index
+        , matches.*
+    FROM
+        unnest($1::TEXT[], $2::SMALLINT[])
+            WITH ORDINALITY AS queries (name, lim, ordinality)
+        CROSS JOIN LATERAL (
+            SELECT
+                *
+                , companies.name <-> queries.name AS distance
+            FROM companies
+            ORDER BY distance
+            LIMIT queries.lim
+        ) AS matches
+    ORDER BY
+        query_index
+        , matches.distance
+    ;
+"""
+
+
+SELECTION_FILTER = """
+    size = $1::TEXT
+    AND region_code = any($2::TEXT[])
+    AND is_acting = $3::BOOL
+    AND bankruptcy_probability <= $4::SMALLINT
+    AND is_liquidating = $5::BOOL
+    AND not_reported_last_year = $6::BOOL
+    AND not_in_same_registry = $7::BOOL
+    AND ceo_has_other_companies = $8::BOOL
+    AND negative_list_risk = $9::BOOL
+"""
+
+# Запросы собираются из констант, данные передаются только параметрами.
+# Компании с одинаковой вероятностью банкротства упорядочены по id,
+# чтобы страницы были стабильны и курсор однозначно задавал позицию.
+# Курсор заменяет смещение: страница после него не пропускает строк
+SELECT_COMPANY_QUERY = f"""
+    SELECT * FROM companies WHERE
+        {SELECTION_FILTER}
+    ORDER BY
+        bankruptcy_probability
+        , id
+    LIMIT $10::SMALLINT
+    OFFSET $11::SMALLINT
+    ;
+"""  # nosec
+
+SELECT_COMPANY_AFTER_QUERY = f"""
+    SELECT * FROM companies WHERE
+        {SELECTION_FILTER}
+        AND (bankruptcy_probability, id) > ($11::SMALLINT, $12::BIGINT)
+    ORDER BY
+        bankruptcy_probability
+        , id
+    LIMIT $10::SMALLINT
+    ;
+"""  # nosec
+
+
+STREAM_COMPANY_QUERY = f"""
+    SELECT * FROM companies WHERE
+        {SELECTION_FILTER}
+    ORDER BY
+        bankruptcy_probability
+        , id
+    ;
+"""  # nosec
+
+STREAM_COMPANY_AFTER_QUERY = f"""
+    SELECT * FROM companies WHERE
+        {SELECTION_FILTER}
+        AND (bankruptcy_probability, id) > ($10::SMALLINT, $11::BIGINT)
+    ORDER BY
+        bankruptcy_probability
+        , id
+    ;
+"""  # nosec
+
+STREAM_CHUNK_SIZE = 1000
+
+# Прогрев выполняется до приема запросов, поэтому одновременно
+# он занимает не больше этого числа соединений пула
+WARM_UP_CONCURRENCY = 8
+
+# Компания в том же виде, в каком ее выдает CompanySchema
+COMPANY_JSON = """
+    json_build_object(
+        'id', id,
+        'name', name,
+        'size', size,
+        'registered_at', to_char(registered_at, 'YYYY-MM-DD'),
+        'itn', itn,
+        'psrn', psrn,
+        'region_code', region_code,
+        'region_name', region_name,
+        'activity_code', activity_code,
+        'activity_name', activity_name,
+        'charter_capital', charter_capital,
+        'is_acting', is_acting,
+        'is_liquidating', is_liquidating,
+        'not_reported_last_year', not_reported_last_year,
+        'not_in_same_registry', not_in_same_registry,
+        'ceo_has_other_companies', ceo_has_other_companies,
+        'negative_list_risk', negative_list_risk,
+        'bankruptcy_probability', bankruptcy_probability,
+        'bankruptcy_vars', bankruptcy_vars::TEXT,
+        'is_enough_finance_data', is_enough_finance_data,
+        'relative_success', relative_success,
+        'revenue_forecast', revenue_forecast,
+        'assets_forecast', assets_forecast,
+        'dev_stage', dev_stage,
+        'dev_stage_coordinates', dev_stage_coordinates::TEXT
+    )
+"""
+
+
+def json_page_query(query: str, order: str) -> str:
+    """Wraps a query of companies to return them as a JSON array.
+
+    Along with the array text the query returns the number of companies
+    and the greatest keyset position among them.
+    """
+
+    # Запрос и порядок берутся только из констант модуля
+    companies = query.strip().rstrip(";")
+    return f"""
+        SELECT
+            COALESCE(json_agg({COMPANY_JSON} ORDER BY {order}), '[]')::TEXT
+                AS data
+            , count(*) AS count
+            , max(ARRAY[bankruptcy_probability::BIGINT, id]) AS position
+        FROM (
+            {companies}
+        ) AS companies
+        ;
+    """  # nosec
+
+
+COMPANIES_BY_IDS_JSON_QUERY = json_page_query(
+    COMPANIES_BY_IDS_QUERY,
+    "array_position($1::BIGINT[], id)",
+)
+
+COMPANIES_BY_NAME_JSON_QUERY = json_page_query(
+    COMPANIES_BY_NAME_QUERY,
+    "distance",
+)
+
+SELECT_COMPANY_JSON_QUERY = json_page_query(
+    SELECT_COMPANY_QUERY,
+    "bankruptcy_probability, id",
+)
+
+SELECT_COMPANY_AFTER_JSON_QUERY = json_page_query(
+    SELECT_COMPANY_AFTER_QUERY,
+    "bankruptcy_probability, id",
+)
+
+# Фильтр выборки подставляется из константы, значения идут параметрами
+SELECTION_COUNT_QUERY = f"""
+    SELECT count(*) FROM companies WHERE
+        {SELECTION_FILTER}
+    ;
+"""  # nosec
+
+# Оценка планировщика по статистике таблицы, без чтения самих строк
+SELECTION_ESTIMATE_QUERY = f"""
+    EXPLAIN (FORMAT JSON) SELECT * FROM companies WHERE
+        {SELECTION_FILTER}
+    ;
+"""  # nosec
+
+# Каждый фасет считается по компаниям, прошедшим все фильтры, кроме
+# фильтра по самому фасету, то есть промахнувшимся не больше чем по нему
+SELECTION_FACETS_QUERY = """
+    SELECT
+        GROUPING(
+            size
+            , region_code
+            , is_acting
+            , is_liquidating
+            , not_reported_last_year
+            , not_in_same_registry
+            , ceo_has_other_companies
+            , negative_list_risk
+        ) AS grouping
+        , size
+        , region_code
+        , is_acting
+        , is_liquidating
+        , not_reported_last_year
+        , not_in_same_registry
+        , ceo_has_other_companies
+        , negative_list_risk
+        , count(*) FILTER (WHERE misses = size_missed) AS size_count
+        , count(*) FILTER (
+            WHERE misses = region_code_missed
+        ) AS region_code_count
+        , count(*) FILTER (
+            WHERE misses = is_acting_missed
+        ) AS is_acting_count
+        , count(*) FILTER (
+            WHERE misses = is_liquidating_missed
+        ) AS is_liquidating_count
+        , count(*) FILTER (
+            WHERE misses = not_reported_last_year_missed
+        ) AS not_reported_last_year_count
+        , count(*) FILTER (
+            WHERE misses = not_in_same_registry_missed
+        ) AS not_in_same_registry_count
+        , count(*) FILTER (
+            WHERE misses = ceo_has_other_companies_missed
+        ) AS ceo_has_other_companies_count
+        , count(*) FILTER (
+            WHERE misses = negative_list_risk_missed
+        ) AS negative_list_risk_count
+    FROM (
+        SELECT
+            *
+            , size_missed
+                + region_code_missed
+                + is_acting_missed
+                + is_liquidating_missed
+                + not_reported_last_year_missed
+                + not_in_same_registry_missed
+                + ceo_has_other_companies_missed
+                + negative_list_risk_missed
+            AS misses
+        FROM (
+            SELECT
+                size
+                , region_code
+                , is_acting
+                , is_liquidating
+                , not_reported_last_year
+                , not_in_same_registry
+                , ceo_has_other_companies
+                , negative_list_risk
+                , (size IS DISTINCT FROM $1::TEXT)::INT AS size_missed
+                , (
+                    NOT coalesce(region_code = any($2::TEXT[]), FALSE)
+                )::INT AS region_code_missed
+                , (
+                    is_acting IS DISTINCT FROM $3::BOOL
+                )::INT AS is_acting_missed
+                , (
+                    is_liquidating IS DISTINCT FROM $5::BOOL
+                )::INT AS is_liquidating_missed
+                , (
+                    not_reported_last_year IS DISTINCT FROM $6::BOOL
+                )::INT AS not_reported_last_year_missed
+                , (
+                    not_in_same_registry IS DISTINCT FROM $7::BOOL
+                )::INT AS not_in_same_registry_missed
+                , (
+                    ceo_has_other_companies IS DISTINCT FROM $8::BOOL
+                )::INT AS ceo_has_other_companies_missed
+                , (
+                    negative_list_risk IS DISTINCT FROM $9::BOOL
+                )::INT AS negative_list_risk_missed
+            FROM companies
+            WHERE bankruptcy_probability <= $4::SMALLINT
+        ) AS filters
+    ) AS matches
+    GROUP BY GROUPING SETS (
+        (size)
+        , (region_code)
+        , (is_acting)
+        , (is_liquidating)
+        , (not_reported_last_year)
+        , (not_in_same_registry)
+        , (ceo_has_other_companies)
+        , (negative_list_risk)
+    )
+    ;
+"""
+
+
+# Запросы, которые готовятся на каждом новом соединении заранее
+PREPARED_QUERIES = (
+    COMPANY_BY_ITN_QUERY,
+    COMPANY_BY_PSRN_QUERY,
+    COMPANIES_BY_ITNS_QUERY,
+    COMPANIES_BY_PSRNS_QUERY,
+    COMPANIES_BY_IDS_QUERY,
+    COMPANIES_BY_NAME_QUERY,
+    SELECT_COMPANY_QUERY,
+    SELECT_COMPANY_AFTER_QUERY,
+)
+
+
+@attr.s(slots=True, frozen=True)
+class ConnectionInit:
+    """Prepares every new pool connection before it is used.
+
+    Known queries are put into the statement cache of the connection,
+    so their first execution skips the Parse/Describe round trip.
+    With ``text_dates`` DATE values are decoded as ISO strings that
+    go to responses as is.
+    """
+
+    prepare: bool = attr.ib(default=True)
+    text_dates: bool = attr.ib(default=False)
+
+    async def __call__(self, connection: Connection) -> None:
+        # Регистрация кодека очищает кэш выражений, поэтому идет первой
+        if self.text_dates:
+            await connection.set_type_codec(
+                "date",
+                schema="pg_catalog",
+                encoder=str,
+                decoder=str,
+                format="text",
+            )
+
+        # Connection.prepare() не кладет выражение в кэш соединения,
+        # а executemany() без параметров только готовит его через кэш
+        if self.prepare:
+            for query in PREPARED_QUERIES:
+                await connection.executemany(query, [])
+
+
+def make_page(record: Record) -> CompanyPage:
+    return CompanyPage(
+        data=record["data"].encode(),
+        count=record["count"],
+        position=record["position"],
+    )
+
+
+def grouped_facet(grouping: int) -> str:
+    # В GROUPING первому столбцу соответствует старший бит, а нулевым
+    # остается только бит столбца, по которому сгруппирована строка
+    grouped = ~grouping & ((1 << len(FACETS)) - 1)
+    return FACETS[len(FACETS) - grouped.bit_length()]
+
+
+def make_facets(records: Iterable[Record]) -> Dict[str, List[Dict]]:
+    facets: Dict[str, List[Dict]] = {name: [] for name in FACETS}
+
+    for record in records:
+        name = grouped_facet(record["grouping"])
+        value, count = record[name], record[f"{name}_count"]
+        if value is not None and count:
+            facets[name].append({"value": value, "count": count})
+
+    for values in facets.values():
+        values.sort(key=lambda facet: facet["value"])
+
+    return facets
+
+
+async def gather_limited(limit: int, loads: Iterable[Awaitable]) -> List:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def load(awaitable: Awaitable) -> Any:
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*map(load, loads))
 
 
-class DB:
-    __slots__ = ("_pool", "_logger")
+def selection_args(params: CompanySelection) -> Tuple:
+    return (
+        params.size,
+        params.region_codes.split(","),
+        params.is_acting,
+        params.bankruptcy_probability,
+        params.is_liquidating,
+        params.not_reported_last_year,
+        params.not_in_same_registry,
+        params.ceo_has_other_companies,
+        params.negative_list_risk,
+    )
 
-    def __init__(self, pool: Pool, logger: logging.Logger):
+
+class DB:  # pylint: disable=R0904
+    __slots__ = (
+        "_pool",
+        "_reader",
+        "_query_log",
+        "_logger",
+        "_cache",
+        "_listener",
+        "_list_eviction",
+        "_snapshot",
+        "_snapshot_task",
+        "_dataset_listeners",
+        "_dataset_refresh",
+        "_dataset_changed",
+        "_exact_count_limit",
+        "_batch_cache_limit",
+        "metrics",
+    )
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            pool: Pool,
+            logger: logging.Logger,
+            cache: Cache,
+            snapshot: Snapshot = None,
+            replicas: Dict = None,
+            exact_count_limit: int = 10000,
+            batch_cache_limit: int = 64,
+            slow_queries: Dict = None,
+            dsn: str = None,
+            listener: Dict = None,
+    ):
         self._pool = pool
+        self._query_log = QueryLog(logger, dsn, **(slow_queries or {}))
+        self._reader = Router(
+            pool,
+            logger,
+            query_log=self._query_log,
+            **(replicas or {}),
+        )
         self._logger = logger
+        self._cache = cache
+        self._listener = Listener(dsn, logger, **(listener or {}))
+        self._listener.add_listener(
+            COMPANIES_CHANNEL,
+            self._on_companies_change,
+        )
+        self._listener.add_listener(DATASET_CHANNEL, self._on_dataset_change)
+        self._listener.add_reconnect_listener(self._on_reconnect)
+        self._list_eviction: Optional[asyncio.Handle] = None
+        self._snapshot = snapshot
+        self._snapshot_task: Optional[asyncio.Future] = None
+        self._dataset_listeners: List[Callable[[], Awaitable]] = []
+        self._dataset_refresh: Optional[asyncio.Future] = None
+        self._dataset_changed = False
+        self._exact_count_limit = exact_count_limit
+        self._batch_cache_limit = batch_cache_limit
+        self.metrics: Optional[Metrics] = None
 
     async def setup(self) -> None:
         await self._pool
+        await self._reader.setup()
+        await self._listener.start()
+
+        if self._snapshot is not None:
+            await self.warm_up(self._snapshot.read())
+            self._cache.hot_keys = HotKeys()
+            self._snapshot_task = asyncio.ensure_future(
+                self._save_snapshots(),
+            )
 
     async def cleanup(self) -> None:
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            await self._save_snapshot()
+
+        if self._list_eviction is not None:
+            self._list_eviction.cancel()
+
+        if self._dataset_refresh is not None:
+            self._dataset_refresh.cancel()
+
+        await self._listener.close()
+        await self._query_log.close()
+        await self._reader.close()
         await self._pool.close()
+        self._cache.close()
+
+    def _on_companies_change(  # pylint: disable=R0913
+            self,
+            connection: Connection,
+            pid: int,
+            channel: str,
+            payload: str,
+    ) -> None:
+        # Вытесненные записи перечитываются с основной базы, пока
+        # реплики могут еще не получить изменение
+        self._reader.read_from_primary()
+
+        if not payload:
+            self._logger.info("Companies table changed, clearing cache")
+            self._cache.clear()
+            return
+
+        for identifiers in orjson.loads(payload):
+            itn, psrn = identifiers["itn"], identifiers["psrn"]
+            if itn is not None:
+                self._cache.delete(make_key("get_company_by_itn", itn))
+            if psrn is not None:
+                self._cache.delete(make_key("get_company_by_psrn", psrn))
+
+        # Изменения приходят пачками, списки очищаются один раз на пачку
+        if self._list_eviction is None:
+            loop = asyncio.get_event_loop()
+            self._list_eviction = loop.call_soon(self._evict_lists)
+
+    def _on_reconnect(self) -> None:
+        # Уведомления, отправленные без соединения, потеряны
+        self._logger.info("Notifications may have been lost, clearing cache")
+        self._reader.read_from_primary()
+        self._cache.clear()
+        self._refresh_dataset()
+
+    def observe(self, metrics: Metrics) -> None:
+        self.metrics = metrics
+        self._cache.metrics = metrics
+
+    def pools(self) -> Dict[str, Pool]:
+        pools = {"primary": self._pool}
+        for i, replica in enumerate(self._reader.replicas):
+            pools[f"replica{i}"] = replica.pool
+        return pools
+
+    def add_dataset_listener(self, callback: Callable[[], Awaitable]) -> None:
+        """Calls ``callback`` every time a new dataset version is loaded."""
+
+        self._dataset_listeners.append(callback)
+
+    def _on_dataset_change(  # pylint: disable=R0913
+            self,
+            connection: Connection,
+            pid: int,
+            channel: str,
+            payload: str,
+    ) -> None:
+        self._logger.info(f"Dataset version {payload} loaded")
+        self._refresh_dataset()
+
+    def _refresh_dataset(self) -> None:
+        # Обновления не пересекаются: версия, загруженная во время
+        # обновления, применяется сразу после него
+        self._dataset_changed = True
+
+        if self._dataset_refresh is None or self._dataset_refresh.done():
+            self._dataset_refresh = asyncio.ensure_future(
+                self._notify_dataset_listeners(),
+            )
 
+    async def _notify_dataset_listeners(self) -> None:
+        while self._dataset_changed:
+            self._dataset_changed = False
+
+            results = await asyncio.gather(
+                *(callback() for callback in self._dataset_listeners),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    name = result.__class__.__name__
+                    self._logger.error(
+                        f"Dataset refresh failed with {name}: {result}",
+                    )
+
+    def _evict_lists(self) -> None:
+        self._list_eviction = None
+        for method in LIST_METHODS:
+            self._cache.evict(method)
+
+    async def warm_up(self, snapshot: Dict) -> None:
+        """Loads the keys of a hot-key snapshot into the cache."""
+
+        itns = [itn for itn, in snapshot.get("get_company_by_itn", [])]
+        psrns = [psrn for psrn, in snapshot.get("get_company_by_psrn", [])]
+        names = snapshot.get("get_companies_by_name", [])
+        json_names = snapshot.get("get_companies_by_name_json", [])
+        selections = snapshot.get("select_company", [])
+        json_selections = snapshot.get("select_company_json", [])
+        facets = snapshot.get("get_selection_facets", [])
+        totals = snapshot.get("count_selection", [])
+
+        try:
+            selections = [CompanySelection(**params) for params, in selections]
+            json_selections = [
+                CompanySelection(**params)
+                for params, in json_selections
+            ]
+            facets = [CompanySelection(**params) for params, in facets]
+            totals = [CompanySelection(**params) for params, in totals]
+
+            # Прогрев загружает снимок целиком, без ограничения пакета
+            await self._get_companies(
+                "get_company_by_itn",
+                itns,
+                len(itns),
+            )
+            await self._get_companies(
+                "get_company_by_psrn",
+                psrns,
+                len(psrns),
+            )
+            await self._warm_up_names(names)
+            await gather_limited(WARM_UP_CONCURRENCY, (
+                self.get_companies_by_name_json(name, limit)
+                for name, limit in json_names
+            ))
+            await gather_limited(
+                WARM_UP_CONCURRENCY,
+                map(self.select_company, selections),
+            )
+            await gather_limited(
+                WARM_UP_CONCURRENCY,
+                map(self.select_company_json, json_selections),
+            )
+            await gather_limited(
+                WARM_UP_CONCURRENCY,
+                map(self.get_selection_facets, facets),
+            )
+            await gather_limited(
+                WARM_UP_CONCURRENCY,
+                map(self.count_selection, totals),
+            )
+        except Exception as e:  # pylint: disable=W0703
+            self._logger.warning(f"Cache warm up failed: {e}")
+            return
+
+        keys = (
+            itns,
+            psrns,
+            names,
+            json_names,
+            selections,
+            json_selections,
+            facets,
+            totals,
+        )
+        total = sum(map(len, keys))
+        self._logger.info(f"Cache warmed up with {total} keys")
+
+    async def _warm_up_names(self, names: List[List]) -> None:
+        method = "get_companies_by_name"
+
+        queries = [
+            (name, limit)
+            for name, limit in names
+            if make_key(method, name, limit) not in self._cache
+        ]
+        if not queries:
+            return
+
+        records = await self._reader.fetch(
+            COMPANIES_BY_NAMES_QUERY,
+            [name for name, _ in queries],
+            [limit for _, limit in queries],
+        )
+
+        matches: List[List[Dict]] = [[] for _ in queries]
+        for record in records:
+            company = dict(record)
+            index = company.pop("query_index") - 1
+            matches[index].append(company)
+
+        for (name, limit), companies in zip(queries, matches):
+            self._cache.set(make_key(method, name, limit), companies)
+
+    async def _save_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(self._snapshot.interval)
+            await self._save_snapshot()
+
+    async def _save_snapshot(self) -> None:
+        hottest = self._cache.hot_keys.snapshot(self._snapshot.size)
+
+        for method in SELECTION_METHODS:
+            hottest[method] = [
+                (attr.asdict(params), )
+                for params, in hottest.get(method, [])
+            ]
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._snapshot.write, hottest)
+        except OSError as e:
+            self._logger.warning(f"Cache snapshot was not saved: {e}")
+
+    @timed
     async def check_health(self) -> bool:
-        return await self._pool.fetchval("select $1::bool", True)
+        return await self._query_log.fetchval(
+            self._pool,
+            "select $1::bool",
+            True,
+        )
 
-    @CACHED
-    async def get_company_by_itn(self, itn: str) -> Company:
-        query = "SELECT * FROM companies WHERE itn = $1::TEXT LIMIT 1;"
-        record = await self._pool.fetchrow(query, itn)
+    @cached
+    @timed
+    async def get_company_by_itn(self, itn: str) -> CompanyRecord:
+        record = await self._reader.fetchrow(COMPANY_BY_ITN_QUERY, itn)
         if record is None:
             raise CompanyNotFound()
-        return Company(**record)
+        return CompanyRecord.from_record(record)
 
-    @CACHED
-    async def get_company_by_psrn(self, psrn: str) -> Company:
-        query = "SELECT * FROM companies WHERE psrn = $1::TEXT LIMIT 1;"
-        record = await self._pool.fetchrow(query, psrn)
+    @cached
+    @timed
+    async def get_company_by_psrn(self, psrn: str) -> CompanyRecord:
+        record = await self._reader.fetchrow(COMPANY_BY_PSRN_QUERY, psrn)
         if record is None:
             raise CompanyNotFound()
-        return Company(**record)
+        return CompanyRecord.from_record(record)
 
-    @CACHED
-    async def get_companies_by_name(
+    @timed
+    async def get_companies_by_itns(
             self,
-            name: str,
-            limit: int = 5,
-    ) -> list:
+            itns: Iterable[str],
+    ) -> Dict[str, CompanyRecord]:
+        return await self._get_companies(
+            "get_company_by_itn",
+            itns,
+            self._batch_cache_limit,
+        )
+
+    @timed
+    async def get_companies_by_psrns(
+            self,
+            psrns: Iterable[str],
+    ) -> Dict[str, CompanyRecord]:
+        return await self._get_companies(
+            "get_company_by_psrn",
+            psrns,
+            self._batch_cache_limit,
+        )
+
+    async def _get_companies(
+            self,
+            method: str,
+            identifiers: Iterable[str],
+            cache_limit: int,
+    ) -> Dict[str, CompanyRecord]:
+        column, query = BATCH_QUERIES[method]
+        companies = {}
+        misses = []
+
+        for identifier in identifiers:
+            company = self._cache.lookup(make_key(method, identifier))
+            if company is None:
+                misses.append(identifier)
+            else:
+                companies[identifier] = company
+
+        if misses:
+            generation = self._cache.generation
+            records = await self._reader.fetch(query, misses)
+            fetched = [
+                (record[column], CompanyRecord.from_record(record))
+                for record in records
+            ]
+            companies.update(fetched)
+
+            # Большой пакет не вытесняет горячие ключи: в кэш попадает
+            # не больше cache_limit его компаний, а прочитанные
+            # до изменения таблицы не попадают вовсе
+            if generation == self._cache.generation:
+                for identifier, company in fetched[:cache_limit]:
+                    self._cache.set(make_key(method, identifier), company)
+
+        return companies
+
+    @cached
+    @timed
+    async def get_companies_by_ids(self, ids: Tuple[int, ...]) -> list:
+        records = await self._reader.fetch(COMPANIES_BY_IDS_QUERY, ids)
+
+        companies = {record["id"]: dict(record) for record in records}
+        return [companies[i] for i in ids if i in companies]
+
+    @cached
+    @timed
+    async def get_companies_by_ids_json(
+            self,
+            ids: Tuple[int, ...],
+    ) -> CompanyPage:
+        record = await self._reader.fetchrow(COMPANIES_BY_IDS_JSON_QUERY, ids)
+        return make_page(record)
+
+    @timed
+    async def get_company_names(self) -> List[Tuple[int, str]]:
+        # Вызывается по уведомлению о новой версии данных,
+        # которой на репликах может еще не быть
+        query = "SELECT id, name FROM companies;"
+        records = await self._query_log.fetch(self._pool, query)
+        return [(record["id"], record["name"]) for record in records]
+
+    @timed
+    async def get_selection_rows(self) -> List[Tuple]:
+        # Как и имена компаний, читается с основного сервера
         query = """
             SELECT
-                *
-                , companies.name <-> $1::TEXT AS distance
+                id
+                , bankruptcy_probability
+                , size
+                , region_code
+                , is_acting
+                , is_liquidating
+                , not_reported_last_year
+                , not_in_same_registry
+                , ceo_has_other_companies
+                , negative_list_risk
             FROM companies
-            ORDER BY distance
-            LIMIT $2::SMALLINT
             ;
         """
 
-        return await self._pool.fetch(query, name, limit)
+        records = await self._query_log.fetch(self._pool, query)
+        return list(map(tuple, records))
+
+    @cached
+    @timed
+    async def get_companies_by_name(
+            self,
+            name: str,
+            limit: int = 5,
+    ) -> list:
+        records = await self._reader.fetch(
+            COMPANIES_BY_NAME_QUERY,
+            name,
+            limit,
+        )
+        return list(map(dict, records))
+
+    @cached
+    @timed
+    async def get_companies_by_name_json(
+            self,
+            name: str,
+            limit: int = 5,
+    ) -> CompanyPage:
+        record = await self._reader.fetchrow(
+            COMPANIES_BY_NAME_JSON_QUERY,
+            name,
+            limit,
+        )
+        return make_page(record)
 
-    @CACHED
+    @cached
+    @timed
     async def select_company(self, params: CompanySelection) -> list:
-        query = """
-            SELECT * FROM companies WHERE
-                size = $1::TEXT
-                AND region_code = any($2::TEXT[])
-                AND is_acting = $3::BOOL
-                AND bankruptcy_probability <= $4::SMALLINT
-                AND is_liquidating = $5::BOOL
-                AND not_reported_last_year = $6::BOOL
-                AND not_in_same_registry = $7::BOOL
-                AND ceo_has_other_companies = $8::BOOL
-                AND negative_list_risk = $9::BOOL
-            ORDER BY
-                bankruptcy_probability
-            LIMIT $10::SMALLINT
-            OFFSET $11::SMALLINT
-            ;
-        """
+        if params.cursor is None:
+            records = await self._reader.fetch(
+                SELECT_COMPANY_QUERY,
+                *selection_args(params),
+                params.limit,
+                params.offset,
+            )
+        else:
+            records = await self._reader.fetch(
+                SELECT_COMPANY_AFTER_QUERY,
+                *selection_args(params),
+                params.limit,
+                *params.cursor,
+            )
 
-        return await self._pool.fetch(
-            query,
-            params.size,
-            params.region_codes.split(","),
-            params.is_acting,
-            params.bankruptcy_probability,
-            params.is_liquidating,
-            params.not_reported_last_year,
-            params.not_in_same_registry,
-            params.ceo_has_other_companies,
-            params.negative_list_risk,
-            params.limit,
-            params.offset
+        return list(map(dict, records))
+
+    @cached
+    @timed
+    async def select_company_json(
+            self,
+            params: CompanySelection,
+    ) -> CompanyPage:
+        if params.cursor is None:
+            record = await self._reader.fetchrow(
+                SELECT_COMPANY_JSON_QUERY,
+                *selection_args(params),
+                params.limit,
+                params.offset,
+            )
+        else:
+            record = await self._reader.fetchrow(
+                SELECT_COMPANY_AFTER_JSON_QUERY,
+                *selection_args(params),
+                params.limit,
+                *params.cursor,
+            )
+
+        return make_page(record)
+
+    @cached
+    @timed
+    async def get_selection_facets(
+            self,
+            params: CompanySelection,
+    ) -> Dict[str, List[Dict]]:
+        records = await self._reader.fetch(
+            SELECTION_FACETS_QUERY,
+            *selection_args(params),
         )
+        return make_facets(records)
+
+    @cached
+    @timed
+    async def count_selection(
+            self,
+            params: CompanySelection,
+    ) -> SelectionTotal:
+        """Counts a selection exactly unless the planner expects it to
+        have more than ``exact_count_limit`` companies."""
+
+        args = selection_args(params)
+
+        plan = await self._reader.fetchval(SELECTION_ESTIMATE_QUERY, *args)
+        estimate = orjson.loads(plan)[0]["Plan"]["Plan Rows"]
+        if estimate > self._exact_count_limit:
+            return SelectionTotal(count=estimate, exact=False)
+
+        count = await self._reader.fetchval(SELECTION_COUNT_QUERY, *args)
+        return SelectionTotal(count=count, exact=True)
+
+    async def stream_selection(
+            self,
+            params: CompanySelection,
+            chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncGenerator[List[Record], None]:
+        """Yields all companies of a selection in chunks.
+
+        Rows are read through a server-side cursor, so only one chunk
+        is held in memory at a time. Limit and offset are ignored,
+        the cursor of the selection is used as a starting position.
+        """
 
+        if params.cursor is None:
+            query, args = STREAM_COMPANY_QUERY, selection_args(params)
+        else:
+            query = STREAM_COMPANY_AFTER_QUERY
+            args = (*selection_args(params), *params.cursor)
+
+        async with self._reader.acquire() as connection:
+            async with connection.transaction(readonly=True):
+                cursor = await connection.cursor(query, *args)
+                while True:
+                    records = await cursor.fetch(chunk_size)
+                    if not records:
+                        break
+                    yield records
+
+    @timed
     async def get_regions(self) -> list:
         query = """
             SELECT
-                DISTINCT region_code, region_name
+                code
+                , name
             FROM
-                companies
+                regions
             ORDER BY
-                region_code
+                code
             ;
         """
 
-        return await self._pool.fetch(query)
+        return await self._query_log.fetch(self._pool, query)
+
+    @timed
+    async def get_dataset_version(self) -> DatasetVersion:
+        query = "SELECT version, updated_at FROM dataset;"
+        record = await self._query_log.fetchrow(self._pool, query)
+        return DatasetVersion(**record)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "DB":
         return DBSchema().load(data)
 
 
+class ConnectionInitSchema(Schema):
+    prepare = fields.Bool(missing=True)
+    text_dates = fields.Bool(missing=False)
+
+    @post_load
+    def make_init(self, data: Dict, **kwargs) -> ConnectionInit:
+        return ConnectionInit(**data)
+
+
 class AsyncPGPoolSchema(Schema):
     dsn = fields.Str(required=True)
     min_size = fields.Int(missing=0)
@@ -129,6 +1076,7 @@ class AsyncPGPoolSchema(Schema):
     command_timeout = fields.Float(missing=10)
     statement_cache_size = fields.Int(missing=1024)
     max_cached_statement_lifetime = fields.Int(missing=3600)
+    init = fields.Nested(ConnectionInitSchema, missing=ConnectionInit)
 
     @post_load
     def make_pool(self, data: Dict, **kwargs) -> Pool:
@@ -143,9 +1091,82 @@ class LoggerSchema(Schema):
         return logging.getLogger(**data)
 
 
+class ReplicasSchema(Schema):
+    pools = fields.List(
+        fields.Nested(AsyncPGPoolSchema),
+        required=True,
+        validate=validate.Length(min=1),
+    )
+    strategy = fields.Str(missing=LEAST_LOADED, validate=validate.OneOf([
+        LEAST_LOADED,
+        LATENCY,
+    ]))
+    check_interval = fields.Float(missing=5, validate=validate.Range(
+        min=0.1,
+    ))
+    primary_window = fields.Float(missing=5, validate=validate.Range(
+        min=0,
+    ))
+
+
+class ListenerSchema(Schema):
+    check_interval = fields.Float(missing=5, validate=validate.Range(
+        min=0.1,
+    ))
+
+
+class SlowQueriesSchema(Schema):
+    threshold = fields.Float(missing=0.5, validate=validate.Range(min=0))
+    explain_rate = fields.Float(missing=0.1, validate=validate.Range(
+        min=0,
+        max=1,
+    ))
+    explain_timeout = fields.Float(missing=10, validate=validate.Range(
+        min=0.1,
+    ))
+
+
+def default_cache() -> Cache:
+    return CacheSchema().load({})
+
+
 class DBSchema(Schema):
     pool = fields.Nested(AsyncPGPoolSchema, required=True)
     logger = fields.Nested(LoggerSchema, required=True)
+    cache = fields.Nested(CacheSchema, missing=default_cache)
+    snapshot = fields.Nested(SnapshotSchema, missing=None, allow_none=True)
+    replicas = fields.Nested(ReplicasSchema, missing=None, allow_none=True)
+
+    slow_queries = fields.Nested(
+        SlowQueriesSchema,
+        missing=None,
+        allow_none=True,
+    )
+    listener = fields.Nested(ListenerSchema, missing=None, allow_none=True)
+
+    # Выборки больше этого числа по оценке планировщика не пересчитываются
+    exact_count_limit = fields.Int(
+        missing=10000,
+        validate=validate.Range(min=0),
+    )
+
+    # Столько компаний одного пакетного запроса попадает в кэш
+    batch_cache_limit = fields.Int(
+        missing=64,
+        validate=validate.Range(min=0),
+    )
+
+    # Уведомления и планы медленных запросов получают отдельные
+    # соединения с той же базой, что и пул
+    dsn = fields.Str(missing=None)
+
+    @pre_load
+    def copy_pool_dsn(self, data: Dict, **kwargs) -> Dict:
+        pool = data.get("pool")
+        dsn = pool.get("dsn") if isinstance(pool, dict) else None
+        if "dsn" in data or dsn is None:
+            return data
+        return {**data, "dsn": dsn}
 
     @post_load
     def make_db(self, data: Dict, **kwargs) -> DB:
@@ -0,0 +1,207 @@
+import asyncio
+from datetime import date
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+
+from marshmallow import Schema, ValidationError, fields, post_load, validate
+
+from .models import COMPANY_SCHEMA
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+__all__ = (
+    "ExportFormatSchema",
+    "ExportSchema",
+    "Exporter",
+    "export_content_type",
+    "export_disposition",
+)
+
+CSV = "csv"
+PARQUET = "parquet"
+ARROW = "arrow"
+
+FORMATS = {
+    CSV: ("text/csv", "csv"),
+    PARQUET: ("application/vnd.apache.parquet", "parquet"),
+    ARROW: ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+EXPORT_CHUNK_SIZE = 10000
+
+
+def export_content_type(export_format: str) -> str:
+    return FORMATS[export_format][0]
+
+
+def export_disposition(export_format: str) -> str:
+    extension = FORMATS[export_format][1]
+    return f'attachment; filename="companies.{extension}"'
+
+
+def arrow_schema() -> "pa.Schema":
+    """Returns the Arrow schema of companies as CompanySchema dumps them."""
+
+    types = {
+        fields.Bool: pa.bool_(),
+        fields.Date: pa.date32(),
+        fields.Int: pa.int64(),
+        fields.Str: pa.string(),
+    }
+
+    return pa.schema([
+        pa.field(field.data_key or name, types[type(field)], field.allow_none)
+        for name, field in COMPANY_SCHEMA.declared_fields.items()
+    ])
+
+
+def read_date(value: Any) -> Any:
+    # Даты, прочитанные текстовым кодеком, приходят строками
+    if value.__class__ is str:
+        return date.fromisoformat(value)
+    return value
+
+
+class Buffer:
+    """Write-only file collecting what an Arrow writer has written."""
+
+    __slots__ = ("_chunks", "_position", "closed")
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class Encoder:
+    """Encodes chunks of company records into one file of a format.
+
+    Every chunk becomes an Arrow record batch, which is written as a
+    CSV block, a Parquet row group or an IPC message.
+    """
+
+    __slots__ = ("_schema", "_columns", "_buffer", "_writer")
+
+    def __init__(self, export_format: str):
+        self._schema = arrow_schema()
+        self._columns = [
+            (field.name, read_date if field.type == pa.date32() else None)
+            for field in self._schema
+        ]
+        self._buffer = Buffer()
+
+        sink = self._buffer
+        if export_format == CSV:
+            self._writer = pa_csv.CSVWriter(sink, self._schema)
+        elif export_format == PARQUET:
+            self._writer = pq.ParquetWriter(sink, self._schema)
+        else:
+            self._writer = pa.ipc.new_stream(sink, self._schema)
+
+    def _batch(self, records: Sequence) -> "pa.RecordBatch":
+        arrays = []
+        for (name, convert), field in zip(self._columns, self._schema):
+            values = [record[name] for record in records]
+            if convert is not None:
+                values = [None if v is None else convert(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+
+        return pa.RecordBatch.from_arrays(arrays, schema=self._schema)
+
+    def encode(self, records: Sequence) -> bytes:
+        self._writer.write_batch(self._batch(records))
+        return self._buffer.pop()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._buffer.pop()
+
+
+class Exporter:
+    """Streams company selections as CSV, Parquet or Arrow IPC files.
+
+    Chunks are encoded on the default executor, so a large export does
+    not block the event loop.
+    """
+
+    __slots__ = ("chunk_size", )
+
+    def __init__(self, chunk_size: int = EXPORT_CHUNK_SIZE):
+        if pa is None:
+            raise RuntimeError("pyarrow is required by the export")
+
+        self.chunk_size = chunk_size
+
+    async def export(
+            self,
+            chunks: AsyncIterator[Sequence],
+            export_format: str,
+            write: Callable[[bytes], Awaitable],
+    ) -> None:
+        loop = asyncio.get_event_loop()
+        encoder = Encoder(export_format)
+
+        async for records in chunks:
+            data = await loop.run_in_executor(None, encoder.encode, records)
+            if data:
+                await write(data)
+
+        await write(await loop.run_in_executor(None, encoder.close))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Optional["Exporter"]:
+        return ExportSchema().load(data)
+
+
+class ExportFormatSchema(Schema):
+    format = fields.Str(missing=CSV, validate=validate.OneOf(list(FORMATS)))
+
+
+class ExportSchema(Schema):
+    enabled = fields.Bool(missing=False)
+    chunk_size = fields.Int(
+        missing=EXPORT_CHUNK_SIZE,
+        validate=validate.Range(min=1),
+    )
+
+    @post_load
+    def make_exporter(self, data: Dict, **kwargs) -> Optional[Exporter]:
+        if not data.pop("enabled"):
+            return None
+
+        try:
+            return Exporter(**data)
+        except RuntimeError as e:
+            raise ValidationError(str(e), "enabled")
@@ -10,9 +10,15 @@ from yarl import URL
 from invest_api.log import app_logger, setup_logging
 from invest_api.settings import get_config
 
+from .catalogue import CurrentDataset, RegionsCatalogue
+from .compression import Compressor
 from .db import DB
+from .export import Exporter
+from .metrics import Metrics
 from .middlewares import add_middlewares
-from .views import add_routes
+from .selection import SelectionEngine, SelectionSchema
+from .typeahead import Typeahead, TypeaheadSchema
+from .views import ViewsSchema, add_routes
 
 __all__ = (
     "create_app",
@@ -39,6 +45,8 @@ async def db_context(app: web.Application) -> AsyncIterator:
     db_config = app["config"]["db"]
 
     db = DB.from_dict(db_config)
+    if app["metrics"] is not None:
+        db.observe(app["metrics"])
     await db.setup()
 
     app["db"] = db
@@ -47,6 +55,65 @@ async def db_context(app: web.Application) -> AsyncIterator:
     await db.cleanup()
 
 
+async def catalogue_context(app: web.Application) -> AsyncIterator:
+    db = app["db"]
+
+    dataset = CurrentDataset(db)
+    await dataset.refresh()
+    db.add_dataset_listener(dataset.refresh)
+
+    regions = RegionsCatalogue(db)
+    await regions.refresh()
+    db.add_dataset_listener(regions.refresh)
+
+    app["dataset"] = dataset
+    app["regions"] = regions
+    yield
+
+
+async def typeahead_context(app: web.Application) -> AsyncIterator:
+    config = app["config"].get("typeahead", {})
+    options = TypeaheadSchema().load(config)
+
+    if options["enabled"]:
+        db = app["db"]
+
+        typeahead = Typeahead(db)
+        await typeahead.refresh()
+        db.add_dataset_listener(typeahead.refresh)
+
+        app["typeahead"] = typeahead
+
+    yield
+
+
+async def selection_context(app: web.Application) -> AsyncIterator:
+    config = app["config"].get("selection", {})
+    options = SelectionSchema().load(config)
+
+    if options["enabled"]:
+        db = app["db"]
+
+        selection = SelectionEngine(db)
+        await selection.refresh()
+        db.add_dataset_listener(selection.refresh)
+
+        app["selection"] = selection
+
+    yield
+
+
+async def metrics_context(app: web.Application) -> AsyncIterator:
+    metrics = app["metrics"]
+    if metrics is None:
+        yield
+        return
+
+    task = asyncio.ensure_future(metrics.watch_pools(app["db"].pools))
+    yield
+    task.cancel()
+
+
 async def create_app(config: Dict = None) -> web.Application:
     setup_logging()
     setup_asyncio()
@@ -56,8 +123,22 @@ async def create_app(config: Dict = None) -> web.Application:
     add_middlewares(app)
 
     app["config"] = config or get_config()
+    app["views"] = ViewsSchema().load(app["config"].get("views", {}))
+    app["compressor"] = Compressor.from_dict(
+        app["config"].get("compression", {}),
+    )
+    app["exporter"] = Exporter.from_dict(
+        app["config"].get("export", {}),
+    )
+    app["metrics"] = Metrics.from_dict(
+        app["config"].get("metrics", {}),
+    )
 
     app.cleanup_ctx.append(db_context)
+    app.cleanup_ctx.append(catalogue_context)
+    app.cleanup_ctx.append(typeahead_context)
+    app.cleanup_ctx.append(selection_context)
+    app.cleanup_ctx.append(metrics_context)
 
     return app
 
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import asyncpg
+from asyncpg import Connection
+
+__all__ = ("Listener", )
+
+Callback = Callable[[Connection, int, str, str], None]
+
+
+class Listener:
+    """Dedicated connection receiving notifications of the database.
+
+    The connection is opened outside of the pool, so it does not hold a
+    pool slot. It is probed every ``check_interval`` seconds and opened
+    again once it is lost. Notifications sent while it was down are
+    lost, so reconnect callbacks are called afterwards to drop whatever
+    they might have invalidated.
+    """
+
+    __slots__ = (
+        "_dsn",
+        "_logger",
+        "_check_interval",
+        "_channels",
+        "_reconnect_callbacks",
+        "_connection",
+        "_task",
+    )
+
+    def __init__(
+            self,
+            dsn: str,
+            logger: logging.Logger,
+            check_interval: float = 5,
+    ):
+        self._dsn = dsn
+        self._logger = logger
+        self._check_interval = check_interval
+        self._channels: List[Tuple[str, Callback]] = []
+        self._reconnect_callbacks: List[Callable[[], None]] = []
+        self._connection: Optional[Connection] = None
+        self._task: Optional[asyncio.Future] = None
+
+    def add_listener(self, channel: str, callback: Callback) -> None:
+        self._channels.append((channel, callback))
+
+    def add_reconnect_listener(self, callback: Callable[[], None]) -> None:
+        self._reconnect_callbacks.append(callback)
+
+    async def start(self) -> None:
+        self._connection = await self._connect()
+        self._task = asyncio.ensure_future(self._watch())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def _connect(self) -> Connection:
+        connection = await asyncpg.connect(self._dsn)
+        try:
+            for channel, callback in self._channels:
+                await connection.add_listener(channel, callback)
+        except BaseException:
+            connection.terminate()
+            raise
+        return connection
+
+    async def _is_alive(self) -> bool:
+        if self._connection.is_closed():
+            return False
+
+        # Обрыв без закрытия сокета заметен только по запросу
+        try:
+            await self._connection.fetchval(
+                "SELECT 1;",
+                timeout=self._check_interval,
+            )
+        except Exception:  # pylint: disable=W0703
+            return False
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._check_interval)
+            if await self._is_alive():
+                continue
+
+            self._logger.warning("Listener connection lost, reconnecting")
+            self._connection.terminate()
+            self._connection = await self._reconnect()
+            self._logger.info("Listener connection restored")
+
+            for callback in self._reconnect_callbacks:
+                callback()
+
+    async def _reconnect(self) -> Connection:
+        while True:
+            try:
+                return await self._connect()
+            except Exception as e:  # pylint: disable=W0703
+                self._logger.warning(f"Listener reconnect failed: {e}")
+            await asyncio.sleep(self._check_interval)
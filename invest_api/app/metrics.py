@@ -0,0 +1,304 @@
+import asyncio
+import os
+import time
+from functools import wraps
+from glob import glob
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from asyncpg.pool import Pool
+from marshmallow import Schema, ValidationError, fields, post_load, validate
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+__all__ = (
+    "CONTENT_TYPE",
+    "Metrics",
+    "MetricsSchema",
+    "clear_multiprocess_dir",
+    "mark_process_dead",
+    "timed",
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def multiprocess_dir() -> Optional[str]:
+    # prometheus_client читает этот каталог при импорте, поэтому он
+    # задаётся окружением до запуска gunicorn, а не конфигом приложения
+    return (
+        os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        or os.environ.get("prometheus_multiproc_dir")
+    )
+
+
+def clear_multiprocess_dir() -> None:
+    """Removes samples left by processes of a previous run."""
+
+    path = multiprocess_dir()
+    if path is None:
+        return
+
+    for name in glob(os.path.join(path, "*.db")):
+        os.remove(name)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops live gauges of a worker which has exited."""
+
+    path = multiprocess_dir()
+    if prometheus_client is None or path is None:
+        return
+
+    multiprocess.mark_process_dead(pid, path)
+
+
+def pool_stats(pool: Pool) -> Tuple[int, int, int]:
+    # asyncpg 0.20 не отдаёт статистику пула, она читается из его состояния
+    # pylint: disable=W0212
+    if pool._queue is None:
+        return 0, 0, 0
+
+    connected = [h for h in pool._holders if h._con is not None]
+    idle = sum(1 for h in connected if h._in_use is None)
+    waiters = sum(1 for w in pool._queue._getters if not w.done())
+
+    return len(connected), idle, waiters
+
+
+class Metrics:
+    """Prometheus metrics of the service.
+
+    When PROMETHEUS_MULTIPROC_DIR is set, every gunicorn worker writes
+    its samples into that directory and a scrape served by any worker
+    aggregates the samples of all of them.
+    """
+
+    __slots__ = (
+        "_path",
+        "_registry",
+        "requests",
+        "in_flight",
+        "queries",
+        "cache_hits",
+        "cache_misses",
+        "cache_evictions",
+        "pool_size",
+        "pool_idle",
+        "pool_waiters",
+        "pool_interval",
+    )
+
+    def __init__(
+            self,
+            buckets: Sequence[float] = BUCKETS,
+            pool_interval: float = 5,
+    ):
+        if prometheus_client is None:
+            raise RuntimeError("prometheus_client is required by the metrics")
+
+        self._path = multiprocess_dir()
+        self.pool_interval = pool_interval
+
+        if self._path is None:
+            self._registry = prometheus_client.CollectorRegistry()
+        else:
+            self._registry = None
+
+        self.requests = self._histogram(
+            "invest_api_request_duration_seconds",
+            "Duration of HTTP requests",
+            ("route", "method", "status"),
+            buckets,
+        )
+        self.in_flight = self._gauge(
+            "invest_api_requests_in_flight",
+            "HTTP requests being handled",
+        )
+        self.queries = self._histogram(
+            "invest_api_db_query_duration_seconds",
+            "Duration of database queries by DB method",
+            ("method", ),
+            buckets,
+        )
+
+        self.cache_hits = self._counter(
+            "invest_api_cache_hits",
+            "Cache hits by DB method",
+            ("method", ),
+        )
+        self.cache_misses = self._counter(
+            "invest_api_cache_misses",
+            "Cache misses by DB method",
+            ("method", ),
+        )
+        self.cache_evictions = self._counter(
+            "invest_api_cache_evictions",
+            "Entries evicted from a full cache by DB method",
+            ("method", ),
+        )
+
+        self.pool_size = self._gauge(
+            "invest_api_db_pool_size",
+            "Open connections of a pool",
+            ("pool", ),
+        )
+        self.pool_idle = self._gauge(
+            "invest_api_db_pool_idle",
+            "Idle connections of a pool",
+            ("pool", ),
+        )
+        self.pool_waiters = self._gauge(
+            "invest_api_db_pool_waiters",
+            "Requests waiting for a connection of a pool",
+            ("pool", ),
+        )
+
+    def _histogram(  # pylint: disable=R0913
+            self,
+            name: str,
+            documentation: str,
+            labels: Sequence[str],
+            buckets: Sequence[float],
+    ) -> "prometheus_client.Histogram":
+        return prometheus_client.Histogram(
+            name,
+            documentation,
+            labels,
+            buckets=buckets,
+            registry=self._registry,
+        )
+
+    def _counter(
+            self,
+            name: str,
+            documentation: str,
+            labels: Sequence[str],
+    ) -> "prometheus_client.Counter":
+        return prometheus_client.Counter(
+            name,
+            documentation,
+            labels,
+            registry=self._registry,
+        )
+
+    def _gauge(
+            self,
+            name: str,
+            documentation: str,
+            labels: Sequence[str] = (),
+    ) -> "prometheus_client.Gauge":
+        # Gauge завершившихся воркеров не учитываются в сумме
+        return prometheus_client.Gauge(
+            name,
+            documentation,
+            labels,
+            registry=self._registry,
+            multiprocess_mode="livesum",
+        )
+
+    def observe_request(  # pylint: disable=R0913
+            self,
+            route: str,
+            method: str,
+            status: int,
+            elapsed: float,
+    ) -> None:
+        self.requests.labels(route, method, str(status)).observe(elapsed)
+
+    def observe_query(self, method: str, elapsed: float) -> None:
+        self.queries.labels(method).observe(elapsed)
+
+    def observe_cache(self, method: str, hit: bool) -> None:
+        counter = self.cache_hits if hit else self.cache_misses
+        counter.labels(method).inc()
+
+    def observe_eviction(self, method: str) -> None:
+        self.cache_evictions.labels(method).inc()
+
+    def observe_pools(self, pools: Iterable[Tuple[str, Pool]]) -> None:
+        for name, pool in pools:
+            size, idle, waiters = pool_stats(pool)
+            self.pool_size.labels(name).set(size)
+            self.pool_idle.labels(name).set(idle)
+            self.pool_waiters.labels(name).set(waiters)
+
+    async def watch_pools(self, pools: Callable[[], Dict[str, Pool]]) -> None:
+        while True:
+            self.observe_pools(pools().items())
+            await asyncio.sleep(self.pool_interval)
+
+    def render(self) -> bytes:
+        if self._registry is not None:
+            return prometheus_client.generate_latest(self._registry)
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, self._path)
+        return prometheus_client.generate_latest(registry)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Optional["Metrics"]:
+        return MetricsSchema().load(data)
+
+
+def timed(method: Callable) -> Callable:
+    """Observes call durations in the ``metrics`` of its instance."""
+
+    name = method.__name__
+
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return await method(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            metrics.observe_query(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+class MetricsSchema(Schema):
+    enabled = fields.Bool(missing=False)
+    buckets = fields.List(
+        fields.Float(validate=validate.Range(min=0)),
+        missing=BUCKETS,
+        validate=validate.Length(min=1),
+    )
+    pool_interval = fields.Float(
+        missing=5,
+        validate=validate.Range(min=0.1),
+    )
+
+    @post_load
+    def make_metrics(self, data: Dict, **kwargs) -> Optional[Metrics]:
+        if not data.pop("enabled"):
+            return None
+
+        try:
+            return Metrics(**data)
+        except RuntimeError as e:
+            raise ValidationError(str(e), "enabled")
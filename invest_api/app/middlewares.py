@@ -1,14 +1,57 @@
-from aiohttp import web
+import time
+from http import HTTPStatus
+
+from aiohttp import hdrs, web
 from marshmallow import ValidationError
 
 from invest_api.types import Handler
 from invest_api.utils import generate_request_id
 
+from .compression import Compressor
 from .context import REQUEST_ID
-from .responses import error_response, server_error, validation_error
+from .dataset import DatasetVersion
+from .responses import (
+    error_response,
+    not_modified,
+    server_error,
+    validation_error,
+)
 
 __all__ = ("add_middlewares", )
 
+# Ответы этих маршрутов меняются только с новой версией данных
+CONDITIONAL_ROUTES = frozenset((
+    "company_details",
+    "companies_query",
+    "companies_selection",
+    "companies_facets",
+    "regions",
+))
+
+# Метка запросов, не попавших ни в один именованный маршрут
+UNKNOWN_ROUTE = "unknown"
+
+
+@web.middleware
+async def metrics_handler(request: web.Request, handler: Handler):
+    metrics = request.app["metrics"]
+    if metrics is None:
+        return await handler(request)
+
+    route = request.match_info.route.name or UNKNOWN_ROUTE
+    status: int = HTTPStatus.INTERNAL_SERVER_ERROR
+
+    metrics.in_flight.inc()
+    start = time.perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.in_flight.dec()
+        metrics.observe_request(route, request.method, status, elapsed)
+
 
 @web.middleware
 async def request_id_handler(request: web.Request, handler: Handler):
@@ -20,6 +63,55 @@ async def request_id_handler(request: web.Request, handler: Handler):
     return response
 
 
+def add_vary(response: web.StreamResponse, header: str) -> None:
+    vary = response.headers.get(hdrs.VARY)
+    if vary:
+        response.headers[hdrs.VARY] = f"{vary}, {header}"
+    else:
+        response.headers[hdrs.VARY] = header
+
+
+async def compress_body(
+        request: web.Request,
+        response: web.Response,
+        compressor: Compressor,
+) -> None:
+    # Сжимается только готовое тело, которое обработчик не сжал сам
+    body = response.body
+    if not isinstance(body, bytes):
+        return
+    if hdrs.CONTENT_ENCODING in response.headers:
+        return
+
+    add_vary(response, hdrs.ACCEPT_ENCODING)
+    if len(body) < compressor.min_size:
+        return
+
+    accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, "")
+    encoding = compressor.negotiate(accept_encoding)
+    if encoding is not None:
+        response.body = await compressor.compress(body, encoding)
+        response.headers[hdrs.CONTENT_ENCODING] = encoding
+
+
+@web.middleware
+async def compression_handler(request: web.Request, handler: Handler):
+    response = await handler(request)
+
+    compressor = request.app["compressor"]
+    if compressor is None or response.prepared:
+        return response
+
+    # Vary одинаков у ответа и заменяющего его 304, поэтому не зависит
+    # от того, пришлось ли сжимать тело
+    if response.status == HTTPStatus.NOT_MODIFIED:
+        add_vary(response, hdrs.ACCEPT_ENCODING)
+    elif isinstance(response, web.Response):
+        await compress_body(request, response, compressor)
+
+    return response
+
+
 @web.middleware
 async def default_error_handler(request: web.Request, handler: Handler):
     try:
@@ -27,6 +119,9 @@ async def default_error_handler(request: web.Request, handler: Handler):
     except Exception as e:  # pylint: disable=W0703
         name = e.__class__.__name__
         request.app.logger.error(f"Caught unhandled {name} exception: {e}")
+
+        # Оборванный поток уже отправил заголовки, ответ об ошибке
+        # записать некуда, он только отмечает запрос как неудачный
         return server_error()
 
 
@@ -47,8 +142,91 @@ async def validation_error_handler(request: web.Request, handler: Handler):
         return validation_error(errors)
 
 
+def make_etag(dataset: DatasetVersion) -> str:
+    return f'W/"{dataset.version}"'
+
+
+def is_not_modified(request: web.Request, dataset: DatasetVersion) -> bool:
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+
+    # If-Modified-Since учитывается только без If-None-Match
+    if if_none_match is not None:
+        etag = make_etag(dataset)
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return bool(tags & {"*", etag, etag[2:]})
+
+    if_modified_since = request.if_modified_since
+    if if_modified_since is None:
+        return False
+
+    updated_at = dataset.updated_at.replace(microsecond=0)
+    return updated_at <= if_modified_since
+
+
+def set_cache_headers(
+        response: web.StreamResponse,
+        dataset: DatasetVersion,
+        max_age: int = None,
+) -> None:
+    headers = response.headers
+
+    headers[hdrs.ETAG] = make_etag(dataset)
+    headers[hdrs.VARY] = hdrs.ACCEPT
+    response.last_modified = dataset.updated_at
+
+    headers.pop(hdrs.EXPIRES, None)
+    headers.pop(hdrs.PRAGMA, None)
+
+    if max_age is None:
+        headers[hdrs.CACHE_CONTROL] = "no-cache"
+    else:
+        headers[hdrs.CACHE_CONTROL] = f"public, max-age={max_age}"
+
+
+@web.middleware
+async def conditional_request_handler(
+        request: web.Request,
+        handler: Handler,
+):
+    route = request.match_info.route.name
+    dataset = request.app["dataset"].version
+
+    is_conditional = (
+        route in CONDITIONAL_ROUTES
+        and request.method in (hdrs.METH_GET, hdrs.METH_HEAD)
+        and dataset is not None
+    )
+    if not is_conditional:
+        return await handler(request)
+
+    # Обработчик выполняется всегда: несуществующий ресурс и неверный
+    # запрос получают свои ответы, а не 304, и "*" совпадает только
+    # с существующим ресурсом
+    response = await handler(request)
+
+    # Потоковые ответы уже отправили свои заголовки
+    if response.status != HTTPStatus.OK or response.prepared:
+        return response
+
+    max_age = request.app["views"]["max_age"].get(route)
+    set_cache_headers(response, dataset, max_age)
+
+    if not is_not_modified(request, dataset):
+        return response
+
+    # 304 повторяет заголовки кэширования ответа, который он заменяет
+    vary = response.headers[hdrs.VARY]
+    response = not_modified()
+    set_cache_headers(response, dataset, max_age)
+    response.headers[hdrs.VARY] = vary
+    return response
+
+
 def add_middlewares(app: web.Application) -> None:
+    app.middlewares.append(metrics_handler)
     app.middlewares.append(request_id_handler)
+    app.middlewares.append(compression_handler)
     app.middlewares.append(default_error_handler)
     app.middlewares.append(client_error_handler)
     app.middlewares.append(validation_error_handler)
+    app.middlewares.append(conditional_request_handler)
@@ -1,19 +1,45 @@
-from typing import Dict
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
 
 import attr
+import orjson
 import sqlalchemy as sa
-from marshmallow import Schema, fields, post_load
+from marshmallow import Schema, fields, post_load, validate
 from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
 
+from .serializers import compile_serializer
+
 DATE_FORMAT = "%Y-%m-%d"
 
+BATCH_MAX_SIZE = 5000
+
+# Столбцы, по значениям которых считаются фасеты выборки
+FACETS = (
+    "size",
+    "region_code",
+    "is_acting",
+    "is_liquidating",
+    "not_reported_last_year",
+    "not_in_same_registry",
+    "ceo_has_other_companies",
+    "negative_list_risk",
+)
+
 __all__ = (
     "Base",
     "Company",
     "CompanySchema",
+    "CompanyBatchSchema",
+    "CompanyPage",
     "CompanyQuerySchema",
+    "CompanyRecord",
     "CompanySelection",
     "CompanySelectionSchema",
+    "Cursor",
+    "FACETS",
+    "SelectionTotal",
+    "encode_cursor",
+    "serialize_company",
 )
 
 Base: DeclarativeMeta = declarative_base()
@@ -57,7 +83,7 @@ class Company(Base):
     dev_stage_coordinates = sa.Column(sa.JSON(none_as_null=True))
 
     def to_dict(self) -> Dict:
-        return CompanySchema().dump(self)
+        return COMPANY_SCHEMA.dump(self)
 
 
 class CompanySchema(Schema):
@@ -96,11 +122,107 @@ class CompanySchema(Schema):
     dev_stage_coordinates = fields.Str(required=True, allow_none=True)
 
 
+COMPANY_SCHEMA = CompanySchema()
+
+serialize_company = compile_serializer(COMPANY_SCHEMA)
+
+
+@attr.s(slots=True, frozen=True)
+class CompanyRecord:
+    """Company as the service reads it, with the JSON encoded once.
+
+    Unlike ``Company`` it carries no ORM state, so cached companies
+    take only the memory of their encoded form.
+    """
+
+    id: int = attr.ib()
+    itn: Optional[str] = attr.ib()
+    psrn: Optional[str] = attr.ib()
+    json: bytes = attr.ib(repr=False)
+
+    @classmethod
+    def from_record(cls, record: Mapping) -> "CompanyRecord":
+        # orjson оставляет за результатом буфер с запасом,
+        # в кэше хранится копия точного размера
+        json = orjson.dumps(serialize_company(record))
+        return cls(
+            id=record["id"],
+            itn=record["itn"],
+            psrn=record["psrn"],
+            json=memoryview(json).tobytes(),
+        )
+
+    def to_dict(self) -> Dict:
+        return orjson.loads(self.json)
+
+
+class CompanyBatchSchema(Schema):
+    ids = fields.List(
+        fields.Str(),
+        required=True,
+        validate=validate.Length(min=1, max=BATCH_MAX_SIZE),
+    )
+
+
 class CompanyQuerySchema(Schema):
     name = fields.Str(required=True)
     limit = fields.Int(missing=5)
 
 
+# Границы типов SMALLINT и BIGINT, в которые передается позиция курсора
+SMALLINT_MAX = 2 ** 15 - 1
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_cursor(bankruptcy_probability: int, company_id: int) -> str:
+    position = orjson.dumps([bankruptcy_probability, company_id])
+    return urlsafe_b64encode(position).decode()
+
+
+def make_position(
+        value: Optional[Iterable[int]],
+) -> Optional[Tuple[int, int]]:
+    # Позиция приходит кортежем, списком из снимка или массивом из базы
+    if value is None:
+        return None
+    bankruptcy_probability, company_id = value
+    return bankruptcy_probability, company_id
+
+
+class Cursor(fields.Field):
+    """Opaque position of the last company of a selection page."""
+
+    default_error_messages = {
+        "invalid": "Not a valid cursor.",
+    }
+
+    def _deserialize(self, value: Any, *args, **kwargs) -> Tuple[int, int]:
+        try:
+            position = orjson.loads(urlsafe_b64decode(value))
+            bankruptcy_probability, company_id = map(int, position)
+        except (TypeError, ValueError):
+            raise self.make_error("invalid")
+
+        if not 0 <= bankruptcy_probability <= SMALLINT_MAX:
+            raise self.make_error("invalid")
+        if not BIGINT_MIN <= company_id <= BIGINT_MAX:
+            raise self.make_error("invalid")
+
+        return bankruptcy_probability, company_id
+
+
+@attr.s(slots=True, frozen=True)
+class CompanyPage:
+    """Companies encoded by the database as a JSON array."""
+
+    data: bytes = attr.ib()
+    count: int = attr.ib()
+    position: Optional[Tuple[int, int]] = attr.ib(
+        default=None,
+        converter=make_position,
+    )
+
+
 @attr.s(slots=True, frozen=True)
 class CompanySelection:
     size: str = attr.ib()
@@ -114,6 +236,34 @@ class CompanySelection:
     negative_list_risk: bool = attr.ib()
     limit: int = attr.ib()
     offset: int = attr.ib()
+    cursor: Optional[Tuple[int, int]] = attr.ib(
+        default=None,
+        converter=make_position,
+    )
+
+    # Признак запроса количества не меняет саму выборку
+    with_total: bool = attr.ib(default=False, eq=False)
+
+    def without_page(self) -> "CompanySelection":
+        """Returns the filter of the selection without its page."""
+
+        regions = sorted(set(self.region_codes.split(",")))
+        return attr.evolve(
+            self,
+            region_codes=",".join(regions),
+            limit=0,
+            offset=0,
+            cursor=None,
+            with_total=False,
+        )
+
+
+@attr.s(slots=True, frozen=True)
+class SelectionTotal:
+    """Number of companies in a selection, exact or estimated."""
+
+    count: int = attr.ib()
+    exact: bool = attr.ib()
 
 
 class CompanySelectionSchema(Schema):
@@ -135,6 +285,8 @@ class CompanySelectionSchema(Schema):
     # Запрос
     limit = fields.Int(missing=10)
     offset = fields.Int(missing=0)
+    cursor = Cursor(missing=None)
+    with_total = fields.Bool(missing=False)
 
     @post_load
     def release(self, data: Dict, **kwargs) -> CompanySelection:
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Optional, Tuple
+
+import asyncpg
+import orjson
+from asyncpg.pool import Pool
+
+__all__ = ("QueryLog", )
+
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+# Запросы и их параметры обрезаются, чтобы запись журнала была обозримой
+MAX_LENGTH = 2000
+
+
+def compact(query: str) -> str:
+    return " ".join(query.split())[:MAX_LENGTH]
+
+
+def format_args(args: Tuple) -> str:
+    return repr(args)[:MAX_LENGTH]
+
+
+class QueryLog:
+    """Times queries and logs the slow ones.
+
+    Every query is logged at the debug level with its duration. Queries
+    slower than ``threshold`` seconds are logged as warnings along with
+    their parameters, and for a sampled share of them the plan is
+    captured by EXPLAIN (ANALYZE, BUFFERS) on a dedicated connection to
+    ``dsn``, so capturing never takes a connection from the pools that
+    serve requests. Only one plan is captured at a time. Records carry
+    the id of the request which issued the query.
+    """
+
+    __slots__ = (
+        "_logger",
+        "_dsn",
+        "_threshold",
+        "_explain_rate",
+        "_explain_timeout",
+        "_explain_task",
+    )
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            logger: logging.Logger,
+            dsn: str,
+            threshold: float = 0.5,
+            explain_rate: float = 0.1,
+            explain_timeout: float = 10,
+    ):
+        self._logger = logger
+        self._dsn = dsn
+        self._threshold = threshold
+        self._explain_rate = explain_rate
+        self._explain_timeout = explain_timeout
+        self._explain_task: Optional[asyncio.Future] = None
+
+    async def close(self) -> None:
+        if self._explain_task is not None:
+            self._explain_task.cancel()
+            await asyncio.wait([self._explain_task])
+
+    async def fetch(self, pool: Pool, query: str, *args: Any) -> list:
+        return await self.execute(pool, "fetch", query, *args)
+
+    async def fetchrow(self, pool: Pool, query: str, *args: Any) -> Any:
+        return await self.execute(pool, "fetchrow", query, *args)
+
+    async def fetchval(self, pool: Pool, query: str, *args: Any) -> Any:
+        return await self.execute(pool, "fetchval", query, *args)
+
+    async def execute(
+            self,
+            pool: Pool,
+            method: str,
+            query: str,
+            *args: Any,
+    ) -> Any:
+        error = None
+        start = time.perf_counter()
+
+        try:
+            return await getattr(pool, method)(query, *args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._observe(query, args, elapsed, error)
+
+    def _observe(  # pylint: disable=R0913
+            self,
+            query: str,
+            args: Tuple,
+            elapsed: float,
+            error: Optional[Exception],
+    ) -> None:
+        ms = elapsed * 1000
+
+        if elapsed < self._threshold:
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug(f"Query took {ms:.1f} ms: {compact(query)}")
+            return
+
+        outcome = "took" if error is None else "failed after"
+        self._logger.warning(
+            f"Slow query {outcome} {ms:.1f} ms: {compact(query)} "
+            f"with args {format_args(args)}",
+        )
+
+        task = self._explain_task
+        if task is not None and not task.done():
+            return
+
+        # Выборка планов для журнала, а не криптография
+        if random.random() >= self._explain_rate:  # nosec
+            return
+
+        self._explain_task = asyncio.ensure_future(self._explain(query, args))
+
+    async def _explain(self, query: str, args: Tuple) -> None:
+        timeout = str(int(self._explain_timeout * 1000))
+
+        try:
+            connection = await asyncpg.connect(
+                self._dsn,
+                timeout=self._explain_timeout,
+            )
+            try:
+                # ANALYZE выполняет запрос, поэтому только на чтение
+                async with connection.transaction(readonly=True):
+                    await connection.execute(
+                        "SELECT set_config('statement_timeout', $1, true);",
+                        timeout,
+                    )
+                    plan = await connection.fetchval(EXPLAIN + query, *args)
+            finally:
+                await connection.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # pylint: disable=W0703
+            name = e.__class__.__name__
+            self._logger.warning(f"Slow query plan was not captured: {name}")
+        else:
+            plan = orjson.dumps(orjson.loads(plan)).decode()
+            self._logger.warning(f"Slow query plan: {plan}")
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Sequence
+
+from asyncpg import Connection, InterfaceError, PostgresConnectionError
+from asyncpg.pool import Pool
+
+from .querylog import QueryLog
+
+__all__ = (
+    "LATENCY",
+    "LEAST_LOADED",
+    "Replica",
+    "Router",
+)
+
+LEAST_LOADED = "least_loaded"
+LATENCY = "latency"
+
+# Ошибки, после которых реплика считается недоступной
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    InterfaceError,
+    PostgresConnectionError,
+)
+
+
+class Replica:
+    __slots__ = ("pool", "healthy", "active", "latency")
+
+    def __init__(self, pool: Pool):
+        self.pool = pool
+        self.healthy = False
+        self.active = 0
+        self.latency = 0.0
+
+    def observe(self, elapsed: float) -> None:
+        self.latency = 0.8 * self.latency + 0.2 * elapsed
+
+
+class Router:
+    """Routes reads to healthy replicas, falling back to the primary.
+
+    Replicas are checked every ``check_interval`` seconds. A replica
+    that fails a check or a query is ejected until it passes a check
+    again; the query it failed is retried on the primary. For
+    ``primary_window`` seconds after :meth:`read_from_primary` all
+    reads go to the primary, so data just changed there is not read
+    back stale from a lagging replica.
+    """
+
+    __slots__ = (
+        "_primary",
+        "_replicas",
+        "_strategy",
+        "_check_interval",
+        "_primary_window",
+        "_primary_until",
+        "_logger",
+        "_checks",
+        "_query_log",
+    )
+
+    def __init__(  # pylint: disable=R0913
+            self,
+            primary: Pool,
+            logger: logging.Logger,
+            pools: Sequence[Pool] = (),
+            strategy: str = LEAST_LOADED,
+            check_interval: float = 5,
+            primary_window: float = 5,
+            query_log: QueryLog = None,
+    ):
+        self._primary = primary
+        self._replicas: List[Replica] = [Replica(pool) for pool in pools]
+        self._strategy = strategy
+        self._check_interval = check_interval
+        self._primary_window = primary_window
+        self._primary_until = 0.0
+        self._logger = logger
+        self._checks: Optional[asyncio.Future] = None
+        self._query_log = query_log
+
+    @property
+    def replicas(self) -> List[Replica]:
+        return self._replicas
+
+    async def setup(self) -> None:
+        if not self._replicas:
+            return
+
+        for replica in self._replicas:
+            await replica.pool
+        await self.check_replicas()
+
+        self._checks = asyncio.ensure_future(self._check_replicas())
+
+    async def close(self) -> None:
+        if self._checks is not None:
+            self._checks.cancel()
+
+        for replica in self._replicas:
+            await replica.pool.close()
+
+    async def _check_replicas(self) -> None:
+        while True:
+            await asyncio.sleep(self._check_interval)
+            await self.check_replicas()
+
+    async def check_replicas(self) -> None:
+        await asyncio.gather(*map(self._check, self._replicas))
+
+    async def _check(self, replica: Replica) -> None:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                replica.pool.fetchval("select $1::bool", True),
+                self._check_interval,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # pylint: disable=W0703
+            # Любая ошибка проверки выводит реплику, но не цикл проверок
+            self._eject(replica, e)
+            return
+
+        replica.observe(time.monotonic() - started)
+        if not replica.healthy:
+            replica.healthy = True
+            self._logger.info(f"Replica {self._index(replica)} is healthy")
+
+    def _eject(self, replica: Replica, error: Exception) -> None:
+        if replica.healthy:
+            replica.healthy = False
+            name = error.__class__.__name__
+            index = self._index(replica)
+            self._logger.warning(f"Replica {index} ejected after {name}")
+
+    def read_from_primary(self) -> None:
+        self._primary_until = time.monotonic() + self._primary_window
+
+    def _index(self, replica: Replica) -> int:
+        return self._replicas.index(replica)
+
+    def _choose(self) -> Optional[Replica]:
+        if time.monotonic() < self._primary_until:
+            return None
+
+        healthy = [replica for replica in self._replicas if replica.healthy]
+        if not healthy:
+            return None
+
+        if self._strategy == LATENCY:
+            return min(healthy, key=lambda r: (r.latency, r.active))
+        return min(healthy, key=lambda r: (r.active, r.latency))
+
+    async def _execute(
+            self,
+            pool: Pool,
+            method: str,
+            query: str,
+            *args: Any,
+    ) -> Any:
+        if self._query_log is None:
+            return await getattr(pool, method)(query, *args)
+        return await self._query_log.execute(pool, method, query, *args)
+
+    async def _call(self, method: str, query: str, *args: Any) -> Any:
+        replica = self._choose()
+        if replica is None:
+            return await self._execute(self._primary, method, query, *args)
+
+        replica.active += 1
+        try:
+            return await self._execute(replica.pool, method, query, *args)
+        except CONNECTION_ERRORS as e:
+            self._eject(replica, e)
+        finally:
+            replica.active -= 1
+
+        return await self._execute(self._primary, method, query, *args)
+
+    async def fetch(self, query: str, *args: Any) -> list:
+        return await self._call("fetch", query, *args)
+
+    async def fetchrow(self, query: str, *args: Any) -> Any:
+        return await self._call("fetchrow", query, *args)
+
+    async def fetchval(self, query: str, *args: Any) -> Any:
+        return await self._call("fetchval", query, *args)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        replica = self._choose()
+        if replica is not None:
+            try:
+                connection = await replica.pool.acquire()
+            except CONNECTION_ERRORS as e:
+                self._eject(replica, e)
+                replica = None
+
+        if replica is None:
+            async with self._primary.acquire() as connection:
+                yield connection
+            return
+
+        replica.active += 1
+        try:
+            yield connection
+        finally:
+            replica.active -= 1
+            await replica.pool.release(connection)
@@ -8,8 +8,14 @@ from invest_api.types import Headers
 
 __all__ = (
     "create_response",
+    "raw_response",
+    "stream_response",
     "error_response",
+    "encode_ok",
+    "encode_raw_ok",
     "ok",
+    "raw_ok",
+    "not_modified",
     "validation_error",
     "server_error",
 )
@@ -25,7 +31,10 @@ HEADERS: Headers = {
 
 def create_response(content: Dict, status: int) -> web.Response:
     body = orjson.dumps(content)
+    return raw_response(body, status)
 
+
+def raw_response(body: bytes, status: int = HTTPStatus.OK) -> web.Response:
     return web.json_response(
         body=body,
         status=status,
@@ -33,6 +42,15 @@ def create_response(content: Dict, status: int) -> web.Response:
     )
 
 
+def stream_response(content_type: str) -> web.StreamResponse:
+    response = web.StreamResponse(
+        status=HTTPStatus.OK,
+        headers=HEADERS,
+    )
+    response.content_type = content_type
+    return response
+
+
 def error_response(status: int, message: str = None) -> web.Response:
     http_status = HTTPStatus(status)
 
@@ -45,12 +63,33 @@ def error_response(status: int, message: str = None) -> web.Response:
     return create_response(content, status)
 
 
-def ok(data: Any = None, message: str = None) -> web.Response:  # 200
+def encode_ok(data: Any = None, message: str = None) -> bytes:
     content = {
         "data": data,
         "message": message or "OK",
     }
-    return create_response(content, HTTPStatus.OK)
+    return orjson.dumps(content)
+
+
+def encode_raw_ok(data: bytes, message: str = None) -> bytes:
+    """Encodes a response around data that is already encoded JSON."""
+
+    encoded_message = orjson.dumps(message or "OK")
+    return b'{"data":' + data + b',"message":' + encoded_message + b"}"
+
+
+def ok(data: Any = None, message: str = None) -> web.Response:  # 200
+    body = encode_ok(data, message)
+    return raw_response(body, HTTPStatus.OK)
+
+
+def raw_ok(data: bytes, message: str = None) -> web.Response:  # 200
+    body = encode_raw_ok(data, message)
+    return raw_response(body, HTTPStatus.OK)
+
+
+def not_modified() -> web.Response:  # 304
+    return web.Response(status=HTTPStatus.NOT_MODIFIED, headers=HEADERS)
 
 
 def validation_error(errors: Any) -> web.Response:  # 422
@@ -0,0 +1,224 @@
+import asyncio
+from functools import reduce
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from marshmallow import Schema, fields
+
+from .db import DB
+from .models import FACETS, CompanySelection
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+__all__ = (
+    "SelectionEngine",
+    "SelectionIndex",
+    "SelectionSchema",
+)
+
+# Порядок колонок в строках, из которых строится индекс
+COLUMNS = ("id", "bankruptcy_probability", *FACETS)
+
+# Фасеты-признаки, которые фильтруются по одному значению
+FLAGS = FACETS[2:]
+
+# Компании без вероятности банкротства в SQL не проходят фильтр
+# и стоят в конце выборки, как NULL при сортировке по возрастанию
+NULL_PROBABILITY = 2 ** 62
+
+CHUNK_SIZE = 8 * 1024
+
+
+class SelectionIndex:
+    """Packed bitsets of the filter columns of a company selection.
+
+    Companies are ordered by bankruptcy probability and id, as the SQL
+    selection is, so the probability threshold and the keyset cursor
+    turn into a range of positions and the first matching positions
+    are the page itself.
+    """
+
+    __slots__ = ("_ids", "_probabilities", "_bitsets")
+
+    def __init__(self, rows: Iterable[Sequence]):
+        if np is None:
+            raise RuntimeError("numpy is required by the selection engine")
+
+        columns = dict(zip(COLUMNS, zip(*rows)))
+        if not columns:
+            columns = {name: () for name in COLUMNS}
+
+        ids = np.array(columns["id"], dtype=np.int64)
+        probabilities = np.array([
+            NULL_PROBABILITY if value is None else value
+            for value in columns["bankruptcy_probability"]
+        ], dtype=np.int64)
+        order = np.lexsort((ids, probabilities))
+
+        self._ids = ids[order]
+        self._probabilities = probabilities[order]
+        self._bitsets: Dict[Tuple[str, Any], np.ndarray] = {}
+
+        for name in FACETS:
+            values = np.array(columns[name], dtype=object)[order]
+            for value in set(values.tolist()) - {None}:
+                bits = np.packbits(values == value)
+                self._bitsets[(name, value)] = bits
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _stop(self, params: CompanySelection) -> int:
+        return int(np.searchsorted(
+            self._probabilities,
+            params.bankruptcy_probability,
+            side="right",
+        ))
+
+    def _range(self, params: CompanySelection) -> Tuple[int, int]:
+        probabilities = self._probabilities
+        stop = self._stop(params)
+
+        if params.cursor is None:
+            return 0, stop
+
+        probability, company_id = params.cursor
+        lo = np.searchsorted(probabilities, probability, side="left")
+        hi = np.searchsorted(probabilities, probability, side="right")
+        ids = self._ids[lo:hi]
+        start = lo + np.searchsorted(ids, company_id, side="right")
+        return int(start), stop
+
+    def _terms(self, params: CompanySelection) -> List[List]:
+        regions = params.region_codes.split(",")
+
+        terms = [
+            [("size", params.size)],
+            [("region_code", region) for region in regions],
+            *([(flag, getattr(params, flag))] for flag in FLAGS),
+        ]
+
+        # Каждый терм объединяет битсеты по ИЛИ, термы - по И
+        return [
+            [self._bitsets[key] for key in term if key in self._bitsets]
+            for term in terms
+        ]
+
+    def select(self, params: CompanySelection) -> List[int]:
+        """Returns ids of a selection page in the order of the SQL path."""
+
+        start, stop = self._range(params)
+        if start >= stop or params.limit <= 0:
+            return []
+
+        terms = self._terms(params)
+        if not all(terms):
+            return []
+
+        offset = params.offset if params.cursor is None else 0
+        wanted = offset + params.limit
+
+        found: List[np.ndarray] = []
+        count = 0
+
+        for first in range(start // 8, (stop + 7) // 8, CHUNK_SIZE):
+            last = first + CHUNK_SIZE
+            mask = reduce(np.bitwise_and, (
+                reduce(np.bitwise_or, (bits[first:last] for bits in term))
+                for term in terms
+            ))
+
+            positions = np.flatnonzero(np.unpackbits(mask)) + first * 8
+            positions = positions[(positions >= start) & (positions < stop)]
+
+            found.append(positions)
+            count += len(positions)
+            if count >= wanted:
+                break
+
+        if not found:
+            return []
+
+        positions = np.concatenate(found)[offset:wanted]
+        return self._ids[positions].tolist()
+
+    def count(self, params: CompanySelection) -> int:
+        """Counts all companies of a selection, ignoring its page."""
+
+        stop = self._stop(params)
+        size = (stop + 7) // 8
+        terms = self._terms(params)
+
+        if not all(terms):
+            return 0
+
+        mask = reduce(np.bitwise_and, (
+            reduce(np.bitwise_or, (bits[:size] for bits in term))
+            for term in terms
+        ))
+        return int(np.count_nonzero(np.unpackbits(mask, count=stop)))
+
+    def facets(self, params: CompanySelection) -> Dict[str, List[Dict]]:
+        """Counts companies by every value of every facet of a selection.
+
+        A facet is counted with all the filters but its own applied, the
+        page and the cursor of the selection are ignored.
+        """
+
+        stop = self._stop(params)
+        size = (stop + 7) // 8
+
+        terms = [
+            reduce(np.bitwise_or, (bits[:size] for bits in term))
+            if term else np.zeros(size, dtype=np.uint8)
+            for term in self._terms(params)
+        ]
+
+        facets: Dict[str, List[Dict]] = {name: [] for name in FACETS}
+
+        for i, name in enumerate(FACETS):
+            mask = reduce(np.bitwise_and, terms[:i] + terms[i + 1:])
+
+            for (column, value), bits in self._bitsets.items():
+                if column != name:
+                    continue
+
+                matched = np.unpackbits(mask & bits[:size], count=stop)
+                count = int(np.count_nonzero(matched))
+                if count:
+                    facets[name].append({"value": value, "count": count})
+
+            facets[name].sort(key=lambda facet: facet["value"])
+
+        return facets
+
+
+class SelectionEngine:
+    """Company selection rebuilt in memory on every dataset version."""
+
+    __slots__ = ("_db", "_index")
+
+    def __init__(self, db: DB):
+        self._db = db
+        self._index = SelectionIndex([])
+
+    async def refresh(self) -> None:
+        rows = await self._db.get_selection_rows()
+
+        loop = asyncio.get_event_loop()
+        self._index = await loop.run_in_executor(None, SelectionIndex, rows)
+
+    def select(self, params: CompanySelection) -> List[int]:
+        return self._index.select(params)
+
+    def count(self, params: CompanySelection) -> int:
+        return self._index.count(params)
+
+    def facets(self, params: CompanySelection) -> Dict[str, List[Dict]]:
+        return self._index.facets(params)
+
+
+class SelectionSchema(Schema):
+    enabled = fields.Bool(missing=False)
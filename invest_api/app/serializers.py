@@ -0,0 +1,109 @@
+from datetime import date
+from typing import Any, Callable, Dict, Mapping, Tuple, cast
+
+from marshmallow import Schema, fields
+
+__all__ = (
+    "compile_serializer",
+)
+
+Serializer = Callable[[Mapping], Dict]
+Converter = Callable[[Any, Mapping], Any]
+
+ISO_DATE_FORMAT = "%Y-%m-%d"
+
+# Типы значений, которые поля отдают без изменений
+PASSTHROUGH = (
+    (fields.Bool, bool),
+    (fields.Int, int),
+    (fields.Str, str),
+)
+
+
+def field_converter(field: fields.Field, name: str) -> Converter:
+    """Returns a function serializing a value as the field does.
+
+    Values of the expected type take a fast path, anything else falls
+    back to the field's own ``_serialize``, so the output is always the
+    same as ``Schema.dump`` gives. The only exception are ISO dates,
+    which are accepted as strings.
+    """
+
+    serialize = field._serialize  # pylint: disable=W0212
+
+    def slow(value: Any, row: Mapping) -> Any:
+        if value is None:
+            return None
+        return serialize(value, name, row)
+
+    for field_class, exact in PASSTHROUGH:
+        if type(field) is field_class:  # pylint: disable=C0123
+            return passthrough(exact, serialize, name)
+
+    if type(field) is fields.Date:  # pylint: disable=C0123
+        date_field = cast(fields.Date, field)
+        data_format = date_field.format or date_field.DEFAULT_FORMAT
+        if data_format not in date_field.SERIALIZATION_FUNCS:
+            # Даты, прочитанные текстовым кодеком, уже в формате ISO
+            iso = data_format == ISO_DATE_FORMAT
+            return formatted(data_format, iso, serialize, name)
+
+    return slow
+
+
+def passthrough(
+        exact: type,
+        serialize: Callable,
+        name: str,
+) -> Converter:
+    def convert(value: Any, row: Mapping) -> Any:
+        if value is None or value.__class__ is exact:
+            return value
+        return serialize(value, name, row)
+
+    return convert
+
+
+def formatted(
+        data_format: str,
+        iso: bool,
+        serialize: Callable,
+        name: str,
+) -> Converter:
+    def convert(value: Any, row: Mapping) -> Any:
+        if value is None:
+            return None
+        if value.__class__ is date:
+            return value.strftime(data_format)
+        if iso and value.__class__ is str:
+            return value
+        return serialize(value, name, row)
+
+    return convert
+
+
+def compile_serializer(schema: Schema) -> Serializer:
+    """Builds a function dumping a mapping the same way a schema does.
+
+    The function reads every dumped field by key, so it accepts asyncpg
+    records and dicts, but not objects. Unlike ``Schema.dump`` it does
+    not skip absent keys and raises ``KeyError`` instead.
+    """
+
+    getters: Tuple[Tuple[str, str, Converter], ...] = tuple(
+        (
+            field.data_key or name,
+            field.attribute or name,
+            field_converter(field, name),
+        )
+        for name, field in schema.dump_fields.items()
+    )
+
+    def serialize(row: Mapping) -> Dict:
+        return {
+            key: convert(row[attribute], row)
+            for key, attribute, convert in getters
+        }
+
+    serialize.__name__ = f"serialize_{type(schema).__name__}"
+    return serialize
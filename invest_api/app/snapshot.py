@@ -0,0 +1,43 @@
+import os
+from typing import Dict
+
+import attr
+import orjson
+from marshmallow import Schema, fields, post_load, validate
+
+__all__ = (
+    "Snapshot",
+    "SnapshotSchema",
+)
+
+
+@attr.s(slots=True, frozen=True)
+class Snapshot:
+    """Local file with the hottest cache keys of the last worker."""
+
+    path: str = attr.ib()
+    interval: float = attr.ib(default=60)
+    size: int = attr.ib(default=1000)
+
+    def read(self) -> Dict:
+        try:
+            with open(self.path, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, data: Dict) -> None:
+        path = f"{self.path}.{os.getpid()}"
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data))
+        os.replace(path, self.path)
+
+
+class SnapshotSchema(Schema):
+    path = fields.Str(required=True)
+    interval = fields.Float(missing=60, validate=validate.Range(min=1))
+    size = fields.Int(missing=1000, validate=validate.Range(min=1))
+
+    @post_load
+    def make_snapshot(self, data: Dict, **kwargs) -> Snapshot:
+        return Snapshot(**data)
@@ -0,0 +1,145 @@
+import asyncio
+import re
+from array import array
+from typing import Dict, Iterable, List, Set, Tuple
+
+from marshmallow import Schema, fields
+
+from .db import DB
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+__all__ = (
+    "TrigramIndex",
+    "Typeahead",
+    "TypeaheadSchema",
+    "trigrams",
+)
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns the trigrams of a text the same way pg_trgm does.
+
+    Every word is lowercased and padded with two spaces in front
+    and one space behind, so short words and word starts get their
+    own trigrams.
+    """
+
+    result = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+class TrigramIndex:
+    """Posting lists of company name trigrams in CSR layout.
+
+    ``postings[offsets[t]:offsets[t + 1]]`` holds the positions of all
+    names containing the trigram ``t``. Similarity is computed as in
+    pg_trgm: the number of shared trigrams divided by the number of
+    trigrams in either string.
+    """
+
+    __slots__ = ("_vocabulary", "_offsets", "_postings", "_ids", "_sizes")
+
+    def __init__(self, rows: Iterable[Tuple[int, str]]):
+        if np is None:
+            raise RuntimeError("numpy is required by the typeahead engine")
+
+        vocabulary: Dict[str, int] = {}
+        ids, sizes = array("q"), array("q")
+        pairs_trigrams, pairs_names = array("q"), array("q")
+
+        for position, (company_id, name) in enumerate(rows):
+            name_trigrams = trigrams(name)
+            ids.append(company_id)
+            sizes.append(len(name_trigrams))
+            for trigram in name_trigrams:
+                pairs_trigrams.append(
+                    vocabulary.setdefault(trigram, len(vocabulary)),
+                )
+                pairs_names.append(position)
+
+        pairs = np.array(pairs_trigrams, dtype=np.int64)
+        order = np.argsort(pairs, kind="stable")
+        counts = np.bincount(pairs, minlength=len(vocabulary))
+
+        self._vocabulary = vocabulary
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._postings = np.array(pairs_names, dtype=np.int32)[order]
+        self._ids = np.array(ids, dtype=np.int64)
+        self._sizes = np.array(sizes, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(self, query: str, limit: int = 5) -> List[int]:
+        """Returns ids of the ``limit`` names most similar to a query.
+
+        Names without a single shared trigram are never returned.
+        Equally similar names are ordered by id.
+        """
+
+        query_trigrams = trigrams(query)
+        lists = [
+            self._postings[self._offsets[t]:self._offsets[t + 1]]
+            for t in map(self._vocabulary.get, query_trigrams)
+            if t is not None
+        ]
+        if not lists or limit < 1:
+            return []
+
+        postings = np.concatenate(lists)
+
+        # Для частых триграмм дешевле посчитать совпадения по всем
+        # названиям сразу, чем сортировать объединенные списки
+        if len(postings) * 8 > len(self._ids):
+            shared = np.bincount(postings, minlength=len(self._ids))
+            candidates = np.flatnonzero(shared)
+            shared = shared[candidates]
+        else:
+            candidates, shared = np.unique(postings, return_counts=True)
+
+        union = len(query_trigrams) + self._sizes[candidates] - shared
+        similarity = shared / union
+
+        # Отбираются все названия не хуже limit-го, чтобы равные ему
+        # по сходству были упорядочены по id, а не выбраны произвольно
+        if len(candidates) > limit:
+            kth = -np.partition(-similarity, limit - 1)[limit - 1]
+            top = similarity >= kth
+            candidates, similarity = candidates[top], similarity[top]
+
+        ids = self._ids[candidates]
+        order = np.lexsort((ids, -similarity))[:limit]
+        return ids[order].tolist()
+
+
+class Typeahead:
+    """Company name typeahead rebuilt on every dataset version."""
+
+    __slots__ = ("_db", "_index")
+
+    def __init__(self, db: DB):
+        self._db = db
+        self._index = TrigramIndex([])
+
+    async def refresh(self) -> None:
+        rows = await self._db.get_company_names()
+
+        loop = asyncio.get_event_loop()
+        self._index = await loop.run_in_executor(None, TrigramIndex, rows)
+
+    def search(self, query: str, limit: int = 5) -> List[int]:
+        return self._index.search(query, limit)
+
+
+class TypeaheadSchema(Schema):
+    enabled = fields.Bool(missing=False)
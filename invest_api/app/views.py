@@ -1,24 +1,68 @@
+import asyncio
 import re
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
 
+import attr
+import orjson
 from aiohttp import hdrs, web
+from marshmallow import Schema, fields, validate
 
+from .context import REQUEST_ID
 from .db import DB
-from .models import CompanyQuerySchema, CompanySchema, CompanySelectionSchema
-from .responses import ok
+from .export import (
+    CSV,
+    ExportFormatSchema,
+    export_content_type,
+    export_disposition,
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .models import (
+    CompanyBatchSchema,
+    CompanyPage,
+    CompanyQuerySchema,
+    CompanySelection,
+    CompanySelectionSchema,
+    SelectionTotal,
+    encode_cursor,
+    serialize_company,
+)
+from .responses import ok, raw_ok, raw_response, stream_response
 
-__all__ = ("add_routes", )
+__all__ = (
+    "add_routes",
+    "ViewsSchema",
+)
 
 ITN_FORMAT = re.compile(r"[0-9]{10}")
 
-COMPANY_SCHEMA = CompanySchema()
+NEXT_CURSOR = "X-Next-Cursor"
+TOTAL_COUNT = "X-Total-Count"
+TOTAL_COUNT_APPROXIMATE = "X-Total-Count-Approximate"
+
+NDJSON = "application/x-ndjson"
+
+COMPANY_BATCH_SCHEMA = CompanyBatchSchema()
 COMPANY_QUERY_SCHEMA = CompanyQuerySchema()
 COMPANY_SELECTION_SCHEMA = CompanySelectionSchema()
+EXPORT_FORMAT_SCHEMA = ExportFormatSchema()
 
 
 def get_db(request: web.Request) -> DB:
     return request.app["db"]
 
 
+def is_json_passthrough(request: web.Request) -> bool:
+    return request.app["views"]["json_passthrough"]
+
+
+async def read_json(request: web.Request) -> Any:
+    try:
+        return await request.json(loads=orjson.loads)
+    except ValueError:
+        raise web.HTTPBadRequest()
+
+
 async def ping_view(_) -> web.Response:
     return ok(message="pong")
 
@@ -28,20 +72,239 @@ async def health_view(request: web.Request) -> web.Response:
     return ok()
 
 
+async def metrics_view(request: web.Request) -> web.Response:
+    metrics = request.app["metrics"]
+    if metrics is None:
+        raise web.HTTPNotFound()
+
+    # В режиме нескольких процессов сбор читает файлы всех воркеров
+    loop = asyncio.get_event_loop()
+    body = await loop.run_in_executor(None, metrics.render)
+
+    response = web.Response(body=body)
+    response.headers[hdrs.CONTENT_TYPE] = METRICS_CONTENT_TYPE
+    return response
+
+
 async def companies_query_view(request: web.Request) -> web.Response:
     query = COMPANY_QUERY_SCHEMA.load(request.query)
-    records = await get_db(request).get_companies_by_name(**query)
-    companies = map(dict, records)
-    data = COMPANY_SCHEMA.dump(companies, many=True)
+    typeahead = request.app.get("typeahead")
+
+    db = get_db(request)
+
+    if is_json_passthrough(request):
+        if typeahead is None:
+            page = await db.get_companies_by_name_json(
+                query["name"],
+                query["limit"],
+            )
+        else:
+            ids = typeahead.search(query["name"], query["limit"])
+            page = await db.get_companies_by_ids_json(tuple(ids))
+        return raw_ok(page.data)
+
+    if typeahead is None:
+        records = await db.get_companies_by_name(
+            query["name"],
+            query["limit"],
+        )
+    else:
+        ids = typeahead.search(query["name"], query["limit"])
+        records = await db.get_companies_by_ids(tuple(ids))
+
+    data = list(map(serialize_company, records))
     return ok(data)
 
 
-async def companies_selection_view(request: web.Request) -> web.Response:
+async def prepare_stream(
+        request: web.Request,
+        content_type: str,
+        headers: Dict[str, str] = None,
+) -> web.StreamResponse:
+    response = stream_response(content_type)
+    response.headers.update(headers or {})
+    response.headers["X-Request-ID"] = REQUEST_ID.get()
+    await response.prepare(request)
+    return response
+
+
+@asynccontextmanager
+async def aborting_stream(request: web.Request) -> AsyncIterator[None]:
+    """Closes the connection when a started stream fails.
+
+    The status and the headers are already sent, so an error response
+    would only corrupt the body: the client learns about the failure
+    from the connection closed before the end of the chunked body.
+    """
+
+    try:
+        yield
+    except Exception as e:  # pylint: disable=W0703
+        name = e.__class__.__name__
+        request.app.logger.error(f"Stream aborted by {name} exception: {e}")
+        request.transport.close()
+        raise
+
+
+async def stream_selection(
+        request: web.Request,
+        params: CompanySelection,
+) -> web.StreamResponse:
+    response = await prepare_stream(request, NDJSON)
+    chunks = get_db(request).stream_selection(params)
+
+    async with aborting_stream(request):
+        try:
+            async for records in chunks:
+                companies = map(serialize_company, records)
+                lines = [orjson.dumps(company) for company in companies]
+                lines.append(b"")
+                await response.write(b"\n".join(lines))
+        finally:
+            await chunks.aclose()
+
+    await response.write_eof()
+    return response
+
+
+def expose_headers(response: web.StreamResponse, *names: str) -> None:
+    exposed = response.headers.get(hdrs.ACCESS_CONTROL_EXPOSE_HEADERS)
+    if exposed:
+        names = (exposed, *names)
+    response.headers[hdrs.ACCESS_CONTROL_EXPOSE_HEADERS] = ", ".join(names)
+
+
+def select_company_page(
+        params: CompanySelection,
+        page: CompanyPage,
+) -> web.Response:
+    response = raw_ok(page.data)
+
+    if page.count and page.count == params.limit:
+        response.headers[NEXT_CURSOR] = encode_cursor(*page.position)
+        expose_headers(response, NEXT_CURSOR)
+
+    return response
+
+
+async def select_companies(
+        request: web.Request,
+        params: CompanySelection,
+) -> web.Response:
+    selection = request.app.get("selection")
+    db = get_db(request)
+
+    if is_json_passthrough(request):
+        if selection is None:
+            page = await db.select_company_json(params)
+        else:
+            ids = selection.select(params)
+            page = await db.get_companies_by_ids_json(tuple(ids))
+        return select_company_page(params, page)
+
+    if selection is None:
+        records = await db.select_company(params)
+    else:
+        ids = selection.select(params)
+        records = await db.get_companies_by_ids(tuple(ids))
+
+    data = list(map(serialize_company, records))
+    response = ok(data)
+
+    if records and len(records) == params.limit:
+        last = records[-1]
+        cursor = encode_cursor(last["bankruptcy_probability"], last["id"])
+        response.headers[NEXT_CURSOR] = cursor
+        expose_headers(response, NEXT_CURSOR)
+
+    return response
+
+
+async def count_companies(
+        request: web.Request,
+        params: CompanySelection,
+) -> SelectionTotal:
+    selection = request.app.get("selection")
+
+    # Количество не зависит от страницы, поэтому считается один раз
+    # на всю выборку и переиспользуется при ее листании
+    params = params.without_page()
+
+    if selection is None:
+        return await get_db(request).count_selection(params)
+    return SelectionTotal(count=selection.count(params), exact=True)
+
+
+async def companies_selection_view(
+        request: web.Request,
+) -> web.StreamResponse:
     params = COMPANY_SELECTION_SCHEMA.load(request.query)
-    records = await get_db(request).select_company(params)
-    companies = map(dict, records)
-    data = COMPANY_SCHEMA.dump(companies, many=True)
-    return ok(data)
+
+    if NDJSON in request.headers.get(hdrs.ACCEPT, ""):
+        return await stream_selection(request, params)
+
+    # Страница кэшируется одна и та же, запрошено количество или нет
+    with_total = params.with_total
+    params = attr.evolve(params, with_total=False)
+
+    response = await select_companies(request, params)
+
+    if with_total:
+        total = await count_companies(request, params)
+        approximate = "false" if total.exact else "true"
+        response.headers[TOTAL_COUNT] = str(total.count)
+        response.headers[TOTAL_COUNT_APPROXIMATE] = approximate
+        expose_headers(response, TOTAL_COUNT, TOTAL_COUNT_APPROXIMATE)
+
+    return response
+
+
+async def companies_export_view(
+        request: web.Request,
+) -> web.StreamResponse:
+    exporter = request.app["exporter"]
+    if exporter is None:
+        raise web.HTTPNotFound()
+
+    query = request.query.copy()
+    options = EXPORT_FORMAT_SCHEMA.load({
+        "format": query.popone("format", CSV),
+    })
+    params = COMPANY_SELECTION_SCHEMA.load(query)
+
+    export_format = options["format"]
+    response = await prepare_stream(
+        request,
+        export_content_type(export_format),
+        {hdrs.CONTENT_DISPOSITION: export_disposition(export_format)},
+    )
+
+    db = get_db(request)
+    chunks = db.stream_selection(params, exporter.chunk_size)
+
+    async with aborting_stream(request):
+        try:
+            await exporter.export(chunks, export_format, response.write)
+        finally:
+            await chunks.aclose()
+
+    await response.write_eof()
+    return response
+
+
+async def companies_facets_view(request: web.Request) -> web.Response:
+    params = COMPANY_SELECTION_SCHEMA.load(request.query)
+    selection = request.app.get("selection")
+
+    # Страница выборки на фасеты не влияет и не входит в ключ кэша
+    params = params.without_page()
+
+    if selection is None:
+        facets = await get_db(request).get_selection_facets(params)
+    else:
+        facets = selection.facets(params)
+
+    return ok(facets)
 
 
 async def company_details_view(request: web.Request) -> web.Response:
@@ -53,22 +316,86 @@ async def company_details_view(request: web.Request) -> web.Response:
     else:
         company = await db.get_company_by_psrn(identifier)
 
-    data = company.to_dict()
-    return ok(data)
+    return raw_ok(company.json)
+
+
+async def companies_batch_view(request: web.Request) -> web.Response:
+    payload = await read_json(request)
+    ids = COMPANY_BATCH_SCHEMA.load(payload)["ids"]
+    identifiers = list(dict.fromkeys(ids))
+
+    itns = [i for i in identifiers if ITN_FORMAT.fullmatch(i)]
+    psrns = [i for i in identifiers if not ITN_FORMAT.fullmatch(i)]
+
+    db = get_db(request)
+    companies = await db.get_companies_by_itns(itns)
+    companies.update(await db.get_companies_by_psrns(psrns))
+
+    found = b",".join(
+        orjson.dumps(identifier) + b":" + companies[identifier].json
+        for identifier in identifiers
+        if identifier in companies
+    )
+    not_found = orjson.dumps([
+        identifier
+        for identifier in identifiers
+        if identifier not in companies
+    ])
+
+    data = b'{"companies":{' + found + b'},"not_found":' + not_found + b"}"
+    return raw_ok(data)
 
 
 async def regions_view(request: web.Request) -> web.Response:
-    regions = await get_db(request).get_regions()
-    data = dict(regions)
-    return ok(data)
+    body = request.app["regions"].body
+    return raw_response(body)
 
 
 def add_routes(app: web.Application) -> None:
     app.router.add_route(hdrs.METH_ANY, "/ping", ping_view, name="ping")
     app.router.add_route(hdrs.METH_ANY, "/health", health_view, name="health")
+    app.router.add_get("/metrics", metrics_view, name="metrics")
+
+    app.router.add_get(
+        "/companies/query",
+        companies_query_view,
+        name="companies_query",
+    )
+    app.router.add_get(
+        "/companies/selection",
+        companies_selection_view,
+        name="companies_selection",
+    )
+    app.router.add_get(
+        "/companies/export",
+        companies_export_view,
+        name="companies_export",
+    )
+    app.router.add_get(
+        "/companies/facets",
+        companies_facets_view,
+        name="companies_facets",
+    )
+    app.router.add_post(
+        "/companies/batch",
+        companies_batch_view,
+        name="companies_batch",
+    )
+    app.router.add_get(
+        "/companies/{id}",
+        company_details_view,
+        name="company_details",
+    )
+
+    app.router.add_get("/regions", regions_view, name="regions")
+
 
-    app.router.add_get("/companies/query", companies_query_view)
-    app.router.add_get("/companies/selection", companies_selection_view)
-    app.router.add_get("/companies/{id}", company_details_view)
+class ViewsSchema(Schema):
+    json_passthrough = fields.Bool(missing=False)
 
-    app.router.add_get("/regions", regions_view)
+    # Время жизни ответов в HTTP кэшах по названиям маршрутов
+    max_age = fields.Dict(
+        keys=fields.Str(),
+        values=fields.Int(validate=validate.Range(min=0)),
+        missing=dict,
+    )
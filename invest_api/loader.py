@@ -0,0 +1,572 @@
+"""Loads a companies dataset into the database.
+
+Rows are read from a CSV file with a header or from a JSON lines file
+and copied in batches into a staging table, which has the constraints
+of ``companies``. The staging table then gets its indexes and triggers
+and replaces ``companies`` in a single transaction:
+
+    DB_URL=postgresql://... python -m invest_api.loader companies.csv
+
+With ``--delta`` the file is a changeset, which is upserted by ITN.
+Rows equal to the stored ones are skipped, the keys of the changed
+companies can be written to a JSON lines file with ``--changes``:
+
+    python -m invest_api.loader --delta --changes keys.jsonl delta.csv
+
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import re
+import sys
+import time
+from datetime import date
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import asyncpg
+import orjson
+from asyncpg import Connection, Record
+
+from invest_api import settings
+from invest_api.settings import env
+
+__all__ = (
+    "copy_rows",
+    "get_columns",
+    "load",
+    "load_delta",
+    "read_rows",
+    "swap_table",
+)
+
+TABLE = "companies"
+CHANNEL = "companies"
+DELTA = "companies_delta"
+
+# Столбцы, которые не меняются при обновлении компании из изменений
+KEY_COLUMNS = ("id", "itn")
+BATCH_SIZE = 10000
+PROGRESS_ROWS = 100000
+
+# Номер строки в таблице изменений, по которому они делятся на пачки
+DELTA_ROW = "delta_row"
+
+# Триггер сообщает о каждом запросе одним сообщением не длиннее 7900
+# байт, иначе пустым, и тогда кэш очищается целиком. Ключи компании
+# занимают в нем около 50 байт, а при обновлении в него попадают
+# и старые, и новые ключи, поэтому пачка не больше 64 строк
+NOTIFY_ROWS = 64
+
+logger = logging.getLogger("loader")
+
+Column = Tuple[str, str]
+
+TRUE = frozenset(("true", "t", "yes", "y", "1"))
+FALSE = frozenset(("false", "f", "no", "n", "0"))
+
+COLUMNS_QUERY = """
+    SELECT
+        attname
+        , format_type(atttypid, NULL)
+    FROM pg_attribute
+    WHERE
+        attrelid = $1::TEXT::REGCLASS
+        AND attnum > 0
+        AND NOT attisdropped
+    ORDER BY attnum
+    ;
+"""
+
+# Ограничения, которые создают индекс, строятся после загрузки
+CONSTRAINTS_QUERY = """
+    SELECT
+        conname
+        , pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE
+        conrelid = $1::TEXT::REGCLASS
+        AND contype IN ('p', 'u')
+    ;
+"""
+
+INDEXES_QUERY = """
+    SELECT
+        indexes.relname
+        , pg_get_indexdef(indexes.oid)
+    FROM pg_index
+        JOIN pg_class AS indexes ON indexes.oid = pg_index.indexrelid
+    WHERE
+        pg_index.indrelid = $1::TEXT::REGCLASS
+        AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE
+                pg_constraint.conrelid = pg_index.indrelid
+                AND pg_constraint.conindid = pg_index.indexrelid
+        )
+    ;
+"""
+
+# Последовательности столбцов таблицы удаляются вместе с ней
+SEQUENCES_QUERY = """
+    SELECT
+        attname
+        , sequence
+    FROM
+        pg_attribute
+        , pg_get_serial_sequence($1::TEXT, attname) AS sequence
+    WHERE
+        attrelid = $1::TEXT::REGCLASS
+        AND attnum > 0
+        AND NOT attisdropped
+        AND sequence IS NOT NULL
+    ;
+"""
+
+TRIGGERS_QUERY = """
+    SELECT
+        tgname
+        , pg_get_triggerdef(oid)
+    FROM pg_trigger
+    WHERE
+        tgrelid = $1::TEXT::REGCLASS
+        AND NOT tgisinternal
+    ;
+"""
+
+
+def parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def parse_date(value: Any) -> date:
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def parse_json(value: Any) -> str:
+    # В CSV значение уже является текстом JSON
+    if isinstance(value, str):
+        return value
+    return orjson.dumps(value).decode()
+
+
+# Приведение значений к типам, которые ожидает бинарный COPY
+CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "bigint": int,
+    "integer": int,
+    "smallint": int,
+    "boolean": parse_bool,
+    "date": parse_date,
+    "json": parse_json,
+    "jsonb": parse_json,
+    "text": str,
+}
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def staging_name(name: str) -> str:
+    return f"{name}_staging"
+
+
+def rename_index(definition: str, name: str) -> str:
+    return re.sub(
+        r"INDEX [^ ]+ ON ",
+        f"INDEX {quote(staging_name(name))} ON ",
+        definition,
+        count=1,
+    )
+
+
+def rename_relation(definition: str, table: str, staging: str) -> str:
+    """Points an index or a trigger definition to the staging table."""
+
+    pattern = rf' ON (ONLY )?([^ ]+\.)?("?){re.escape(table)}\3 '
+    return re.sub(pattern, f" ON {quote(staging)} ", definition, count=1)
+
+
+async def get_columns(connection: Connection, table: str) -> List[Column]:
+    records = await connection.fetch(COLUMNS_QUERY, table)
+    return [(record["attname"], record["format_type"]) for record in records]
+
+
+def read_csv(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # Пустая ячейка CSV означает NULL
+            yield {key: value or None for key, value in row.items()}
+
+
+def read_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open("rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
+
+
+def read_file(path: Path) -> Iterator[Dict[str, Any]]:
+    if path.suffix == ".csv":
+        return read_csv(path)
+    if path.suffix in (".jsonl", ".ndjson"):
+        return read_jsonl(path)
+    raise ValueError(f"unsupported file format: {path.suffix}")
+
+
+def read_rows(path: Path, columns: List[Column]) -> Iterator[tuple]:
+    """Reads a dataset file lazily as records of the given columns."""
+
+    rows = read_file(path)
+    converters = [
+        (name, CONVERTERS.get(type_name, str))
+        for name, type_name in columns
+    ]
+
+    for number, row in enumerate(rows, start=1):
+        record = []
+        for name, converter in converters:
+            value = row.get(name)
+            if value is not None:
+                try:
+                    value = converter(value)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"row {number}, {name}: {e}") from e
+            record.append(value)
+        yield tuple(record)
+
+
+async def copy_rows(  # pylint: disable=R0913
+        connection: Connection,
+        table: str,
+        columns: List[Column],
+        rows: Iterator[tuple],
+        batch_size: int = BATCH_SIZE,
+) -> int:
+    """Copies rows in batches, so only one batch is kept in memory."""
+
+    names = [name for name, _ in columns]
+    started = time.monotonic()
+    total = 0
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return total
+
+        await connection.copy_records_to_table(
+            table,
+            records=batch,
+            columns=names,
+        )
+        total += len(batch)
+
+        if total // PROGRESS_ROWS > (total - len(batch)) // PROGRESS_ROWS:
+            rate = total / (time.monotonic() - started)
+            logger.info("Copied %d rows, %.0f rows/sec", total, rate)
+
+
+async def create_staging(connection: Connection, table: str) -> str:
+    staging = staging_name(table)
+
+    # Проверки и NOT NULL копируются сразу и проверяются при COPY
+    await connection.execute(f"""
+        DROP TABLE IF EXISTS {quote(staging)};
+        CREATE TABLE {quote(staging)} (
+            LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        );
+    """)
+    return staging
+
+
+async def build_staging(
+        connection: Connection,
+        table: str,
+        staging: str,
+) -> None:
+    """Gives the staging table the indexes and triggers of the table.
+
+    Indexes get temporary names, since the names of the table indexes
+    are taken until the table is dropped.
+    """
+
+    for name, definition in await connection.fetch(CONSTRAINTS_QUERY, table):
+        await connection.execute(f"""
+            ALTER TABLE {quote(staging)}
+            ADD CONSTRAINT {quote(staging_name(name))} {definition}
+        """)
+
+    for name, definition in await connection.fetch(INDEXES_QUERY, table):
+        definition = rename_relation(definition, table, staging)
+        await connection.execute(rename_index(definition, name))
+
+    for _, definition in await connection.fetch(TRIGGERS_QUERY, table):
+        await connection.execute(rename_relation(definition, table, staging))
+
+    await connection.execute(f"ANALYZE {quote(staging)}")
+
+
+async def swap_table(
+        connection: Connection,
+        table: str,
+        staging: str,
+        lock_timeout: float,
+) -> int:
+    """Replaces the table with the staging one and refreshes the dataset.
+
+    Returns the new dataset version.
+    """
+
+    constraints = await connection.fetch(CONSTRAINTS_QUERY, table)
+    indexes = await connection.fetch(INDEXES_QUERY, table)
+    sequences = await connection.fetch(SEQUENCES_QUERY, table)
+
+    async with connection.transaction():
+        # Ожидающая блокировку загрузка задерживает всех читателей
+        await connection.execute(
+            "SELECT set_config('lock_timeout', $1::TEXT, TRUE)",
+            f"{int(lock_timeout * 1000)}ms",
+        )
+
+        for column, sequence in sequences:
+            await connection.execute(f"""
+                ALTER SEQUENCE {sequence}
+                OWNED BY {quote(staging)}.{quote(column)}
+            """)
+
+        await connection.execute(f"DROP TABLE {quote(table)}")
+        await connection.execute(
+            f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}",
+        )
+
+        for name, _ in constraints:
+            await connection.execute(f"""
+                ALTER TABLE {quote(table)}
+                RENAME CONSTRAINT {quote(staging_name(name))} TO {quote(name)}
+            """)
+
+        for name, _ in indexes:
+            await connection.execute(f"""
+                ALTER INDEX {quote(staging_name(name))} RENAME TO {quote(name)}
+            """)
+
+        # Пустое сообщение означает, что изменилась вся таблица
+        await connection.execute("SELECT pg_notify($1::TEXT, '')", CHANNEL)
+        return await connection.fetchval("SELECT refresh_dataset()")
+
+
+async def load(
+        connection: Connection,
+        path: Path,
+        batch_size: int = BATCH_SIZE,
+        lock_timeout: float = 60,
+) -> Dict[str, Any]:
+    """Loads a dataset file in place of companies and reports timings."""
+
+    table = TABLE
+    columns = await get_columns(connection, table)
+    staging = await create_staging(connection, table)
+    report: Dict[str, Any] = {}
+
+    try:
+        started = time.monotonic()
+        rows = read_rows(path, columns)
+        count = await copy_rows(connection, staging, columns, rows, batch_size)
+        report["rows"] = count
+        report["copy_seconds"] = time.monotonic() - started
+
+        started = time.monotonic()
+        await build_staging(connection, table, staging)
+        report["build_seconds"] = time.monotonic() - started
+
+        started = time.monotonic()
+        version = await swap_table(connection, table, staging, lock_timeout)
+        report["swap_seconds"] = time.monotonic() - started
+        report["version"] = version
+    finally:
+        await connection.execute(f"DROP TABLE IF EXISTS {quote(staging)}")
+
+    seconds = sum(
+        report[key]
+        for key in ("copy_seconds", "build_seconds", "swap_seconds")
+    )
+    report["rows_per_second"] = report["rows"] / seconds if seconds else 0.0
+    return report
+
+
+def upsert_query(columns: List[Column]) -> str:
+    """Returns a query upserting a part of the changeset by ITN.
+
+    The part is the rows numbered from ``$1`` exclusive to ``$2``
+    inclusive. A company is updated only if it differs from the stored
+    one, so unchanged rows neither fire the notify trigger nor are
+    returned.
+    """
+
+    names = [quote(name) for name, _ in columns]
+    updated = [quote(name) for name, _ in columns if name not in KEY_COLUMNS]
+
+    stored = ", ".join(f"{quote(TABLE)}.{name}" for name in updated)
+    excluded = ", ".join(f"EXCLUDED.{name}" for name in updated)
+
+    # В запрос попадают только идентификаторы, экранированные quote()
+    return f"""
+        INSERT INTO {quote(TABLE)} ({", ".join(names)})
+        SELECT {", ".join(names)} FROM {quote(DELTA)}
+        WHERE {quote(DELTA_ROW)} > $1::BIGINT
+            AND {quote(DELTA_ROW)} <= $2::BIGINT
+        ON CONFLICT (itn) DO UPDATE SET
+            ({", ".join(updated)}) = ROW({excluded})
+        WHERE
+            ROW({stored}) IS DISTINCT FROM ROW({excluded})
+        RETURNING
+            itn
+            , psrn
+            , xmax = 0 AS inserted
+        ;
+    """  # nosec
+
+
+async def upsert_delta(
+        connection: Connection,
+        columns: List[Column],
+        count: int,
+        notify_rows: int,
+) -> List[Record]:
+    # Каждая пачка изменений записывается отдельным запросом, чтобы
+    # триггер перечислил ее компании, а не очистил кэш целиком
+    query = upsert_query(columns)
+    records: List[Record] = []
+
+    for first in range(0, count, notify_rows):
+        last = first + notify_rows
+        records.extend(await connection.fetch(query, first, last))
+
+    return records
+
+
+async def load_delta(
+        connection: Connection,
+        path: Path,
+        batch_size: int = BATCH_SIZE,
+        notify_rows: int = NOTIFY_ROWS,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Upserts a changeset file into companies.
+
+    Returns the report and the keys of the inserted and updated
+    companies. Each ITN may occur in a changeset only once.
+    """
+
+    columns = await get_columns(connection, TABLE)
+    report: Dict[str, Any] = {}
+
+    async with connection.transaction():
+        await connection.execute(f"""
+            CREATE TEMPORARY TABLE {quote(DELTA)} (
+                LIKE {quote(TABLE)} INCLUDING DEFAULTS,
+                {quote(DELTA_ROW)} BIGINT GENERATED ALWAYS AS IDENTITY
+                    PRIMARY KEY
+            ) ON COMMIT DROP;
+        """)
+
+        started = time.monotonic()
+        rows = read_rows(path, columns)
+        count = await copy_rows(connection, DELTA, columns, rows, batch_size)
+        await connection.execute(f"ANALYZE {quote(DELTA)};")
+        report["rows"] = count
+        report["copy_seconds"] = time.monotonic() - started
+
+        started = time.monotonic()
+        records = await upsert_delta(connection, columns, count, notify_rows)
+        report["upsert_seconds"] = time.monotonic() - started
+
+        changes = [dict(record) for record in records]
+        inserted = sum(change["inserted"] for change in changes)
+
+        report["inserted"] = inserted
+        report["updated"] = len(changes) - inserted
+        report["unchanged"] = count - len(changes)
+
+        # Без изменений версия данных остается прежней
+        if changes:
+            query = "SELECT refresh_dataset()"
+        else:
+            query = "SELECT version FROM dataset"
+        report["version"] = await connection.fetchval(query)
+
+    seconds = report["copy_seconds"] + report["upsert_seconds"]
+    report["rows_per_second"] = count / seconds if seconds else 0.0
+    return report, changes
+
+
+def write_changes(path: Path, changes: List[Dict[str, Any]]) -> None:
+    with path.open("wb") as f:
+        for change in changes:
+            f.write(orjson.dumps(change) + b"\n")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    connection = await asyncpg.connect(args.db_url)
+    try:
+        if not args.delta:
+            return await load(
+                connection,
+                args.path,
+                args.batch_size,
+                args.lock_timeout,
+            )
+
+        report, changes = await load_delta(
+            connection,
+            args.path,
+            args.batch_size,
+        )
+        if args.changes is not None:
+            write_changes(args.changes, changes)
+        return report
+    finally:
+        await connection.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--db-url", default=env.str("DB_URL", None))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lock-timeout", type=float, default=60)
+    parser.add_argument("--delta", action="store_true")
+    parser.add_argument("--changes", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=settings.LEVEL,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt=settings.DATETIME_FORMAT,
+    )
+
+    try:
+        report = asyncio.run(run(args))
+    except (ValueError, asyncpg.PostgresError) as e:
+        logger.error("Dataset was not loaded: %s", e)
+        return 1
+
+    print(json.dumps(report, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from environs import Env
 
@@ -15,19 +15,106 @@ LEVEL = env.str("LOG_LEVEL", "INFO").upper()
 DATETIME_FORMAT = env.str("LOG_DATETIME_FORMAT", "%Y-%m-%d %H:%M:%S")
 
 
+def get_cache_config() -> Dict:
+    return {
+        "backend": env.str("DB_CACHE_BACKEND", "memory"),
+        "eviction": env.str("DB_CACHE_EVICTION", "lru"),
+        "maxsize": env.int("DB_CACHE_MAXSIZE", 512),
+        "path": env.str("DB_CACHE_PATH", None),
+        "size": env.int("DB_CACHE_SIZE", 64 * 1024 * 1024),
+        "slot_size": env.int("DB_CACHE_SLOT_SIZE", 4096),
+        "ttl": env.float("DB_CACHE_TTL", None),
+        "ttls": env.dict("DB_CACHE_TTLS", {}),
+    }
+
+
+def get_snapshot_config() -> Optional[Dict]:
+    path = env.str("DB_CACHE_SNAPSHOT_PATH", None)
+    if not path:
+        return None
+
+    return {
+        "path": path,
+        "interval": env.float("DB_CACHE_SNAPSHOT_INTERVAL", 60),
+        "size": env.int("DB_CACHE_SNAPSHOT_SIZE", 1000),
+    }
+
+
+def get_pool_config(dsn: Optional[str]) -> Dict:
+    return {
+        "dsn": dsn,
+        "min_size": env.int("DB_POOL_MIN_SIZE", 0),
+        "max_size": env.int("DB_POOL_MAX_SIZE", 5),
+        "max_queries": env.int("DB_POOL_MAX_QUERIES", 128),
+        "timeout": env.float("DB_POOL_TIMEOUT", 5),
+        "command_timeout": env.float("DB_POOL_COMMAND_TIMEOUT", 10),
+        "init": {
+            "prepare": env.bool("DB_POOL_PREPARE", True),
+            "text_dates": env.bool("DB_POOL_TEXT_DATES", False),
+        },
+    }
+
+
+def get_replicas_config() -> Optional[Dict]:
+    dsns = env.list("DB_REPLICA_URLS", [])
+    if not dsns:
+        return None
+
+    return {
+        "pools": [get_pool_config(dsn) for dsn in dsns],
+        "strategy": env.str("DB_REPLICA_STRATEGY", "least_loaded"),
+        "check_interval": env.float("DB_REPLICA_CHECK_INTERVAL", 5),
+        "primary_window": env.float("DB_REPLICA_PRIMARY_WINDOW", 5),
+    }
+
+
 def get_config() -> Dict:
     return {
         "db": {
-            "pool": {
-                "dsn": env.str("DB_URL", None),
-                "min_size": env.int("DB_POOL_MIN_SIZE", 0),
-                "max_size": env.int("DB_POOL_MAX_SIZE", 5),
-                "max_queries": env.int("DB_POOL_MAX_QUERIES", 128),
-                "timeout": env.float("DB_POOL_TIMEOUT", 5),
-                "command_timeout": env.float("DB_POOL_COMMAND_TIMEOUT", 10),
-            },
+            "pool": get_pool_config(env.str("DB_URL", None)),
+            "replicas": get_replicas_config(),
             "logger": {
                 "name": "db",
             },
+            "cache": get_cache_config(),
+            "snapshot": get_snapshot_config(),
+            "exact_count_limit": env.int("DB_EXACT_COUNT_LIMIT", 10000),
+            "batch_cache_limit": env.int("DB_BATCH_CACHE_LIMIT", 64),
+            "listener": {
+                "check_interval": env.float("DB_LISTENER_CHECK_INTERVAL", 5),
+            },
+            "slow_queries": {
+                "threshold": env.float("DB_SLOW_QUERY_THRESHOLD", 0.5),
+                "explain_rate": env.float("DB_SLOW_QUERY_EXPLAIN_RATE", 0.1),
+                "explain_timeout": env.float(
+                    "DB_SLOW_QUERY_EXPLAIN_TIMEOUT",
+                    10,
+                ),
+            },
+        },
+        "views": {
+            "json_passthrough": env.bool("VIEWS_JSON_PASSTHROUGH", False),
+            "max_age": env.dict("VIEWS_MAX_AGE", {}),
+        },
+        "compression": {
+            "enabled": env.bool("COMPRESSION_ENABLED", True),
+            "encodings": env.list("COMPRESSION_ENCODINGS", None),
+            "min_size": env.int("COMPRESSION_MIN_SIZE", 1024),
+            "executor_size": env.int("COMPRESSION_EXECUTOR_SIZE", 64 * 1024),
+            "cache_size": env.int("COMPRESSION_CACHE_SIZE", 256),
+        },
+        "typeahead": {
+            "enabled": env.bool("TYPEAHEAD_ENABLED", False),
+        },
+        "selection": {
+            "enabled": env.bool("SELECTION_ENGINE_ENABLED", False),
+        },
+        "export": {
+            "enabled": env.bool("EXPORT_ENABLED", False),
+            "chunk_size": env.int("EXPORT_CHUNK_SIZE", 10000),
+        },
+        "metrics": {
+            "enabled": env.bool("METRICS_ENABLED", False),
+            "pool_interval": env.float("METRICS_POOL_INTERVAL", 5),
         },
     }
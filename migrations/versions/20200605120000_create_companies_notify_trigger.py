@@ -0,0 +1,104 @@
+"""Create companies notify trigger.
+
+Revision ID: 3f1c9a7d2b54
+Revises: 96ad09283de8
+Create Date: 2020-06-05 12:00:00.000000
+
+"""
+
+from alembic import op
+
+revision = "3f1c9a7d2b54"
+down_revision = "96ad09283de8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Сообщает об изменении компаний в канал companies одним сообщением
+    # на запрос: массивом их идентификаторов, для UPDATE и старых, и новых.
+    # Сообщение ограничено 8000 байтами, поэтому об изменении большого
+    # числа строк сообщает пустое сообщение, как об изменении всей таблицы
+    op.execute("""
+        CREATE FUNCTION notify_companies_change() RETURNS TRIGGER AS $$
+        DECLARE
+            payload TEXT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT json_agg(json_build_object('itn', itn, 'psrn', psrn))
+                INTO payload
+                FROM new_rows;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT json_agg(json_build_object('itn', itn, 'psrn', psrn))
+                INTO payload
+                FROM old_rows;
+            ELSE
+                SELECT json_agg(json_build_object('itn', itn, 'psrn', psrn))
+                INTO payload
+                FROM (
+                    SELECT itn, psrn FROM old_rows
+                    UNION
+                    SELECT itn, psrn FROM new_rows
+                ) AS changed;
+            END IF;
+
+            IF payload IS NULL THEN
+                RETURN NULL;
+            END IF;
+
+            IF octet_length(payload) > 7900 THEN
+                payload := '';
+            END IF;
+
+            PERFORM pg_notify('companies', payload);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Пустое сообщение означает, что изменилась вся таблица
+    op.execute("""
+        CREATE FUNCTION notify_companies_truncate() RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('companies', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Таблицы переходов нельзя объявить у триггера на несколько событий
+    op.execute("""
+        CREATE TRIGGER companies_notify_insert
+        AFTER INSERT ON companies
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_companies_change();
+    """)
+
+    op.execute("""
+        CREATE TRIGGER companies_notify_update
+        AFTER UPDATE ON companies
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_companies_change();
+    """)
+
+    op.execute("""
+        CREATE TRIGGER companies_notify_delete
+        AFTER DELETE ON companies
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_companies_change();
+    """)
+
+    op.execute("""
+        CREATE TRIGGER companies_notify_truncate
+        AFTER TRUNCATE ON companies
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_companies_truncate();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER companies_notify_truncate ON companies")
+    op.execute("DROP TRIGGER companies_notify_delete ON companies")
+    op.execute("DROP TRIGGER companies_notify_update ON companies")
+    op.execute("DROP TRIGGER companies_notify_insert ON companies")
+    op.execute("DROP FUNCTION notify_companies_truncate()")
+    op.execute("DROP FUNCTION notify_companies_change()")
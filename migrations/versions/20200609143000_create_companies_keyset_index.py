@@ -0,0 +1,80 @@
+"""Create companies keyset index.
+
+Revision ID: 8b2e4d61c0f7
+Revises: 3f1c9a7d2b54
+Create Date: 2020-06-09 14:30:00.000000
+
+"""
+
+from alembic import op
+
+revision = "8b2e4d61c0f7"
+down_revision = "3f1c9a7d2b54"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Индексы строятся без блокировки записи в таблицу, а CONCURRENTLY
+    # нельзя выполнить внутри транзакции миграции
+    with op.get_context().autocommit_block():
+        # Поля с проверкой на равенство идут первыми, затем ключ сортировки
+        # выборки, чтобы страница по курсору читалась из индекса без
+        # сортировки
+        op.create_index(
+            "companies_selection_keyset_idx",
+            "companies",
+            [
+                "size",
+                "is_acting",
+                "is_liquidating",
+                "not_reported_last_year",
+                "not_in_same_registry",
+                "ceo_has_other_companies",
+                "negative_list_risk",
+                "region_code",
+                "bankruptcy_probability",
+                "id",
+            ],
+            postgresql_using="btree",
+            postgresql_with={
+                "fillfactor": 97,
+            },
+            postgresql_concurrently=True,
+        )
+
+        op.drop_index(
+            "companies_selection_idx",
+            "companies",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "companies_selection_idx",
+            "companies",
+            [
+                "size",
+                "region_code",
+                "is_acting",
+                "bankruptcy_probability",
+                "is_liquidating",
+                "not_reported_last_year",
+                "not_in_same_registry",
+                "ceo_has_other_companies",
+                "negative_list_risk",
+            ],
+            postgresql_using="btree",
+            postgresql_with={
+                "fillfactor": 97,
+            },
+            postgresql_concurrently=True,
+        )
+
+        op.drop_index(
+            "companies_selection_keyset_idx",
+            "companies",
+            postgresql_concurrently=True,
+        )
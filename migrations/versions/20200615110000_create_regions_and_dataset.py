@@ -0,0 +1,87 @@
+"""Create regions and dataset tables.
+
+Revision ID: c47a1e9b5d38
+Revises: 8b2e4d61c0f7
+Create Date: 2020-06-15 11:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql as pg
+
+revision = "c47a1e9b5d38"
+down_revision = "8b2e4d61c0f7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        # Название таблицы
+        "regions",
+
+        # Номер региона страны, например: 05, 77 (2 цифры)
+        sa.Column("code", pg.TEXT, primary_key=True),
+
+        # Название региона страны
+        sa.Column("name", pg.TEXT, nullable=False),
+    )
+
+    op.create_table(
+        # Название таблицы
+        "dataset",
+
+        # Таблица всегда содержит ровно одну строку
+        sa.Column("id", pg.BOOLEAN, primary_key=True, server_default="true"),
+        sa.CheckConstraint("id"),
+
+        # Версия данных, увеличивается при каждой загрузке
+        sa.Column("version", pg.BIGINT, nullable=False),
+
+        # Время последней загрузки данных
+        sa.Column(
+            "updated_at",
+            pg.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+
+    op.execute("INSERT INTO dataset (version) VALUES (1)")
+
+    # Пересобирает производные таблицы и увеличивает версию данных,
+    # вызывается загрузчиком после каждого изменения таблицы companies
+    op.execute("""
+        CREATE FUNCTION refresh_dataset() RETURNS BIGINT AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            DELETE FROM regions;
+
+            INSERT INTO regions (code, name)
+            SELECT DISTINCT ON (region_code)
+                region_code
+                , region_name
+            FROM companies
+            ORDER BY region_code;
+
+            UPDATE dataset SET
+                version = version + 1
+                , updated_at = now()
+            RETURNING version INTO new_version;
+
+            PERFORM pg_notify('dataset', new_version::TEXT);
+
+            RETURN new_version;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("SELECT refresh_dataset()")
+
+
+def downgrade() -> None:
+    op.execute("DROP FUNCTION refresh_dataset()")
+    op.drop_table("dataset")
+    op.drop_table("regions")
@@ -25,6 +25,17 @@ def create_company(invest_api_session: orm.Session) -> Callable:
     return factory
 
 
+@pytest.fixture
+def refresh_dataset(invest_api_session: orm.Session) -> Callable:
+    assert invest_api_session.is_active
+
+    def refresh() -> None:
+        invest_api_session.execute("SELECT refresh_dataset()")
+        invest_api_session.commit()
+
+    return refresh
+
+
 @pytest.fixture
 async def app(invest_api_session: orm.Session) -> Application:
     db_url = str(invest_api_session.bind.url)
@@ -48,3 +59,19 @@ async def app(invest_api_session: orm.Session) -> Application:
 @pytest.fixture
 async def client(aiohttp_client: Callable, app: Application) -> TestClient:
     return await aiohttp_client(app)
+
+
+@pytest.fixture
+async def passthrough_client(
+        aiohttp_client: Callable,
+        app: Application,
+) -> TestClient:
+    config = {
+        **app["config"],
+        "views": {
+            "json_passthrough": True,
+        },
+    }
+
+    passthrough_app = await invest_api.create_app(config)
+    return await aiohttp_client(passthrough_app)
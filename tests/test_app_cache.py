@@ -0,0 +1,348 @@
+import asyncio
+import fcntl
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, cast
+from unittest.mock import patch
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from invest_api.app.cache import (
+    FIFO,
+    LRU,
+    Cache,
+    HotKeys,
+    MemoryBackend,
+    SharedMemoryBackend,
+    cached,
+    default_cache_path,
+    make_key,
+    remove_shared_file,
+)
+from invest_api.app.metrics import Metrics
+
+
+class Source:
+
+    def __init__(self, cache: Cache):
+        self._cache = cache
+        self.calls = 0
+
+    @cached
+    async def load(self, value: int) -> int:
+        self.calls += 1
+        await asyncio.sleep(0)
+        if value < 0:
+            raise ValueError(value)
+        return value * 2
+
+
+async def test_cache_evicts_least_recently_used_key() -> None:
+    cache = Cache(MemoryBackend(maxsize=2))
+
+    cache.set(make_key("m", 1), 1)
+    cache.set(make_key("m", 2), 2)
+    assert cache.get(make_key("m", 1)) == 1
+
+    cache.set(make_key("m", 3), 3)
+
+    assert make_key("m", 1) in cache
+    assert make_key("m", 2) not in cache
+    assert make_key("m", 3) in cache
+
+
+async def test_cached_method_shares_pending_load() -> None:
+    source = Source(Cache())
+
+    results = await asyncio.gather(source.load(1), source.load(1))
+    assert list(results) == [2, 2]
+    assert source.calls == 1
+
+    assert await source.load(1) == 2
+    assert source.calls == 1
+
+
+async def test_cached_method_does_not_cache_exceptions() -> None:
+    cache = Cache()
+    source = Source(cache)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            await source.load(-1)
+
+    assert source.calls == 2
+    assert make_key("load", -1) not in cache
+
+
+@pytest.mark.parametrize("invalidate", [
+    lambda cache: cache.delete(make_key("load", 1)),
+    lambda cache: cache.evict("load"),
+    lambda cache: cache.clear(),
+])
+async def test_cached_method_drops_load_older_than_eviction(
+        invalidate: Callable[[Cache], None],
+) -> None:
+    cache = Cache()
+    source = Source(cache)
+
+    pending = asyncio.ensure_future(source.load(1))
+    await asyncio.sleep(0)
+    invalidate(cache)
+
+    assert await pending == 2
+    assert make_key("load", 1) not in cache
+
+    assert await source.load(1) == 2
+    assert source.calls == 2
+    assert make_key("load", 1) in cache
+
+
+async def test_cache_expires_entries_by_method_ttl() -> None:
+    cache = Cache(ttl=60, ttls={"short": 1})
+
+    cache.set(make_key("short", 1), 1)
+    cache.set(make_key("long", 1), 1)
+
+    now = time.time() + 30
+    with patch.object(time, "time", return_value=now):
+        assert make_key("short", 1) not in cache
+        assert make_key("long", 1) in cache
+
+
+async def test_cache_evicts_all_method_entries() -> None:
+    cache = Cache()
+
+    cache.set(make_key("first", 1), 1)
+    cache.set(make_key("first", 2), 2)
+    cache.set(make_key("second", 1), 1)
+
+    cache.evict("first")
+
+    assert make_key("first", 1) not in cache
+    assert make_key("first", 2) not in cache
+    assert make_key("second", 1) in cache
+
+
+def test_hot_keys_snapshot_is_ordered_by_access_count() -> None:
+    hot_keys = HotKeys()
+
+    for key, count in [("a", 1), ("b", 3), ("c", 2)]:
+        for _ in range(count):
+            hot_keys.touch(make_key("m", key))
+    hot_keys.touch(make_key("n", "d"))
+
+    assert hot_keys.snapshot(2) == {
+        "m": [("b", ), ("c", )],
+        "n": [("d", )],
+    }
+    assert hot_keys.snapshot(2) == {
+        "m": [("b", ), ("c", )],
+    }
+
+
+def test_shared_memory_backend_is_visible_to_other_instances(
+        tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "cache")
+    key = make_key("get_company_by_itn", "7710561081")
+
+    first = SharedMemoryBackend(path, size=1024 * 1024)
+    second = SharedMemoryBackend(path, size=1024 * 1024)
+
+    first.set(key, {"name": "ЗАО ОКБ"})
+    assert second.get(key) == {"name": "ЗАО ОКБ"}
+
+    assert second.delete(key)
+    assert first.get(key) is None
+
+    first.close()
+    second.close()
+
+
+def test_shared_memory_backend_evicts_within_slot_set(
+        tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "cache")
+    backend = SharedMemoryBackend(
+        path,
+        size=4096,
+        slot_size=1024,
+        ways=2,
+        eviction=FIFO,
+    )
+
+    for i in range(3):
+        backend.set(make_key("m", i), i)
+
+    assert backend.get(make_key("m", 0)) is None
+    assert backend.get(make_key("m", 1)) == 1
+    assert backend.get(make_key("m", 2)) == 2
+
+    backend.set(make_key("n", 3), 3)
+    backend.evict("m")
+    assert backend.get(make_key("m", 2)) is None
+    assert backend.get(make_key("n", 3)) == 3
+
+    backend.clear()
+    assert backend.get(make_key("n", 3)) is None
+
+    backend.close()
+
+
+def test_shared_memory_backend_reports_evicted_keys(
+        tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "cache")
+    backend = SharedMemoryBackend(
+        path,
+        size=4096,
+        slot_size=1024,
+        ways=2,
+        eviction=FIFO,
+    )
+
+    assert backend.set(make_key("m", 0), 0) is None
+    assert backend.set(make_key("m", 1), 1) is None
+    assert backend.set(make_key("m", 1), 2) is None
+    assert backend.set(make_key("n", 2), 2) == make_key("m", 0)
+
+    backend.close()
+
+
+def test_shared_memory_backend_skips_oversized_values(
+        tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "cache")
+    backend = SharedMemoryBackend(path, size=1024 * 1024, slot_size=512)
+
+    backend.set(make_key("m", 1), "x" * 1024)
+    assert backend.get(make_key("m", 1)) is None
+
+    backend.close()
+
+
+def test_shared_memory_backend_replaces_file_of_other_layout(
+        tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "cache")
+    key = make_key("m", 1)
+
+    first = SharedMemoryBackend(path, size=1024 * 1024)
+    first.set(key, 1)
+
+    second = SharedMemoryBackend(path, size=1024 * 1024, slot_size=1024)
+    assert second.get(key) is None
+
+    assert first.get(key) == 1
+    first.set(make_key("m", 2), 2)
+
+    third = SharedMemoryBackend(path, size=1024 * 1024, slot_size=1024)
+    second.set(key, 3)
+    assert third.get(key) == 3
+
+    for backend in (first, second, third):
+        backend.close()
+
+
+@pytest.mark.parametrize("eviction, operation", [
+    (LRU, fcntl.LOCK_EX),
+    (FIFO, fcntl.LOCK_SH),
+])
+def test_shared_memory_backend_locks_slot_set_for_reads(
+        tmp_path: Path,
+        eviction: str,
+        operation: int,
+) -> None:
+    backend = SharedMemoryBackend(
+        str(tmp_path / "cache"),
+        size=1024 * 1024,
+        eviction=eviction,
+    )
+    backend.set(make_key("m", 1), 1)
+
+    with patch.object(fcntl, "lockf", wraps=fcntl.lockf) as lockf:
+        assert backend.get(make_key("m", 1)) == 1
+
+    assert lockf.call_args_list[0][0][1] == operation
+
+    backend.close()
+
+
+def test_remove_shared_file(tmp_path: Path) -> None:
+    path = tmp_path / "cache"
+    SharedMemoryBackend(str(path), size=1024 * 1024).close()
+
+    remove_shared_file({"backend": "memory", "path": str(path)})
+    assert path.exists()
+
+    remove_shared_file({"backend": "shared", "path": str(path)})
+    assert not path.exists()
+
+    remove_shared_file({"backend": "shared", "path": str(path)})
+
+
+def test_shared_memory_backend_creates_private_directory(
+        tmp_path: Path,
+) -> None:
+    directory = tmp_path / "runtime" / "invest_api"
+    backend = SharedMemoryBackend(str(directory / "cache"), size=1024 * 1024)
+
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+    backend.close()
+
+
+def test_shared_memory_backend_refuses_shared_directory(
+        tmp_path: Path,
+) -> None:
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    directory.chmod(0o777)
+
+    with pytest.raises(PermissionError):
+        SharedMemoryBackend(str(directory / "cache"), size=1024 * 1024)
+
+
+def test_default_cache_path_is_in_runtime_directory(
+        monkeypatch: MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("RUNTIME_DIRECTORY", "/run/invest_api")
+
+    path = Path(default_cache_path())
+    assert path.parent.parent == Path("/run/invest_api")
+    assert path.name == "cache"
+
+
+class Recorder:
+
+    def __init__(self) -> None:
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.evictions: Counter = Counter()
+
+    def observe_cache(self, method: str, hit: bool) -> None:
+        counter = self.hits if hit else self.misses
+        counter[method] += 1
+
+    def observe_eviction(self, method: str) -> None:
+        self.evictions[method] += 1
+
+
+async def test_cache_reports_hits_misses_and_evictions() -> None:
+    cache = Cache(MemoryBackend(maxsize=1))
+    recorder = Recorder()
+    cache.metrics = cast(Metrics, recorder)
+    source = Source(cache)
+
+    assert await source.load(1) == 2
+    assert await source.load(1) == 2
+    assert await source.load(2) == 4
+
+    assert cache.lookup(make_key("load", 2)) == 4
+    assert cache.lookup(make_key("load", 1)) is None
+
+    assert recorder.hits == {"load": 2}
+    assert recorder.misses == {"load": 3}
+    assert recorder.evictions == {"load": 1}
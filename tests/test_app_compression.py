@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from invest_api.app import compression
+from invest_api.app.compression import Compressor, parse_accept_encoding
+
+
+def test_parse_accept_encoding() -> None:
+    header = "gzip;q=0.5, br, zstd;q=0, *;q=0.1"
+
+    assert parse_accept_encoding(header) == {
+        "gzip": 0.5,
+        "br": 1.0,
+        "zstd": 0.0,
+        "*": 0.1,
+    }
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("gzip, zstd;q=0", "gzip"),
+    ("*", "gzip"),
+    ("*, gzip;q=0", None),
+])
+def test_compressor_negotiates_encoding(header: str, encoding: str) -> None:
+    compressor = Compressor(encodings=["gzip"])
+
+    assert compressor.negotiate(header) == encoding
+
+
+def test_compressor_prefers_server_order() -> None:
+    pytest.importorskip("brotli")
+    compressor = Compressor(encodings=["gzip", "br"])
+
+    assert compressor.negotiate("gzip, br") == "br"
+
+
+async def test_compressor_caches_compressed_body() -> None:
+    compressor = Compressor(encodings=["gzip"], executor_size=0)
+    body = b"company" * 1000
+
+    compressed = await compressor.compress(body, "gzip")
+    assert gzip.decompress(compressed) == body
+
+    assert await compressor.compress(bytes(body), "gzip") is compressed
+
+
+def test_compressor_requires_installed_codec(
+        monkeypatch: MonkeyPatch,
+) -> None:
+    monkeypatch.setitem(compression.MODULES, "zstd", None)
+
+    with pytest.raises(RuntimeError):
+        Compressor(encodings=["zstd"])
+
+    compressor = Compressor()
+    assert compressor.negotiate("zstd") is None
@@ -0,0 +1,242 @@
+import asyncio
+import copy
+import logging
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+from _pytest.logging import LogCaptureFixture
+from aiohttp.test_utils import TestClient
+from aiohttp.web import Application
+
+from invest_api import Company, create_app
+from invest_api.app.cache import make_key
+from invest_api.app.db import PREPARED_QUERIES, gather_limited
+from invest_api.app.snapshot import Snapshot
+
+
+async def test_db_warm_up_from_snapshot(
+        client: TestClient,
+        create_company: Callable,
+        tmp_path: Path,
+) -> None:
+    company = Company(
+        id=1,
+        name="ЗАО ОКБ",
+        size="Крупная",
+        registered_at=date(2010, 1, 1),
+        itn="7710561081",
+        psrn="1047796788819",
+        region_code="77",
+        region_name="Москва",
+        activity_code="5",
+        activity_name="Высокая",
+        charter_capital=1200,
+        is_acting=True,
+        is_liquidating=False,
+        not_reported_last_year=True,
+        not_in_same_registry=False,
+        ceo_has_other_companies=True,
+        negative_list_risk=False,
+        bankruptcy_probability=5,
+        bankruptcy_vars=None,
+        is_enough_finance_data=True,
+        relative_success=7,
+        revenue_forecast=25000,
+        assets_forecast=20000,
+        dev_stage="Развивается активно",
+        dev_stage_coordinates=None,
+    )
+    db = client.app["db"]
+    cache = db._cache  # pylint: disable=W0212
+
+    generation = cache.generation
+    create_company(company)
+    for _ in range(100):
+        if cache.generation != generation:
+            break
+        await asyncio.sleep(0.01)
+
+    snapshot = Snapshot(path=str(tmp_path / "snapshot.json"))
+    snapshot.write({
+        "get_company_by_itn": [[company.itn]],
+        "get_company_by_psrn": [[company.psrn]],
+        "get_companies_by_name": [["окб", 5]],
+    })
+
+    await db.warm_up(snapshot.read())
+    assert make_key("get_company_by_itn", company.itn) in cache
+    assert make_key("get_company_by_psrn", company.psrn) in cache
+
+    companies = cache.get(make_key("get_companies_by_name", "окб", 5))
+    assert [c["itn"] for c in companies] == [company.itn]
+
+
+async def test_db_warm_up_ignores_batch_cache_limit(
+        aiohttp_client: Callable,
+        app: Application,
+        create_company: Callable,
+        tmp_path: Path,
+) -> None:
+    companies = []
+    for i in range(2):
+        company = Company(
+            id=i,
+            name="ЗАО ОКБ",
+            size="Крупная",
+            registered_at=date(2010, 1, 1),
+            itn=f"771056108{i}",
+            psrn=f"104779678881{i}",
+            region_code="77",
+            region_name="Москва",
+            activity_code="5",
+            activity_name="Высокая",
+            charter_capital=1200,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Развивается активно",
+            dev_stage_coordinates=None,
+        )
+        create_company(company)
+        companies.append(company)
+
+    config = copy.deepcopy(app["config"])
+    config["db"]["batch_cache_limit"] = 0
+    client = await aiohttp_client(await create_app(config))
+    db = client.app["db"]
+    cache = db._cache  # pylint: disable=W0212
+
+    snapshot = Snapshot(path=str(tmp_path / "snapshot.json"))
+    snapshot.write({
+        "get_company_by_itn": [[company.itn] for company in companies],
+        "get_company_by_psrn": [[company.psrn] for company in companies],
+    })
+
+    await db.warm_up(snapshot.read())
+    for company in companies:
+        assert make_key("get_company_by_itn", company.itn) in cache
+        assert make_key("get_company_by_psrn", company.psrn) in cache
+
+
+async def test_gather_limited_bounds_concurrency() -> None:
+    running = []
+    peak = []
+
+    async def load(i: int) -> int:
+        running.append(i)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(i)
+        return i
+
+    results = await gather_limited(3, map(load, range(10)))
+    assert results == list(range(10))
+    assert max(peak) == 3
+
+
+async def test_db_pool_init_prepares_queries(client: TestClient) -> None:
+    db = client.app["db"]
+    pool = db._pool  # pylint: disable=W0212
+
+    async with pool.acquire() as connection:
+        cache = connection._stmt_cache  # pylint: disable=W0212
+        assert len(cache) >= len(PREPARED_QUERIES)
+
+
+async def test_db_pool_init_decodes_text_dates(
+        aiohttp_client: Callable,
+        app: Application,
+        create_company: Callable,
+) -> None:
+    company = Company(
+        id=1,
+        name="ЗАО ОКБ",
+        size="Крупная",
+        registered_at=date(2010, 1, 1),
+        itn="7710561081",
+        psrn="1047796788819",
+        region_code="77",
+        region_name="Москва",
+        activity_code="5",
+        activity_name="Высокая",
+        charter_capital=1200,
+        is_acting=True,
+        is_liquidating=False,
+        not_reported_last_year=True,
+        not_in_same_registry=False,
+        ceo_has_other_companies=True,
+        negative_list_risk=False,
+        bankruptcy_probability=5,
+        bankruptcy_vars=None,
+        is_enough_finance_data=True,
+        relative_success=7,
+        revenue_forecast=25000,
+        assets_forecast=20000,
+        dev_stage="Развивается активно",
+        dev_stage_coordinates=None,
+    )
+    create_company(company)
+
+    config = copy.deepcopy(app["config"])
+    config["db"]["pool"]["init"] = {
+        "text_dates": True,
+    }
+    client = await aiohttp_client(await create_app(config))
+
+    companies = await client.app["db"].get_companies_by_name("окб", 5)
+    assert companies[0]["registered_at"] == "2010-01-01"
+
+    response = await client.get(f"/companies/{company.itn}")
+    assert (await response.json())["data"] == company.to_dict()
+
+
+async def test_db_serializes_dataset_refreshes(
+        client: TestClient,
+        caplog: LogCaptureFixture,
+) -> None:
+    db = client.app["db"]
+    running = []
+    refreshes = []
+
+    async def refresh() -> None:
+        running.append(True)
+        assert len(running) == 1
+        await asyncio.sleep(0.05)
+        refreshes.append(True)
+        running.pop()
+
+    async def fail() -> None:
+        raise RuntimeError("Refresh failed")
+
+    db.add_dataset_listener(refresh)
+    db.add_dataset_listener(fail)
+
+    logger = logging.getLogger("db")
+    logger.addHandler(caplog.handler)
+
+    try:
+        for version in ("2", "3", "4"):
+            db._on_dataset_change(  # pylint: disable=W0212
+                None,
+                0,
+                "dataset",
+                version,
+            )
+            await asyncio.sleep(0.01)
+
+        await db._dataset_refresh  # pylint: disable=W0212
+    finally:
+        logger.removeHandler(caplog.handler)
+
+    assert len(refreshes) == 2
+    assert "Dataset refresh failed with RuntimeError" in caplog.text
@@ -0,0 +1,114 @@
+# pylint: disable=W0621
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, List
+
+import asyncpg
+import orjson
+import pytest
+from sqlalchemy import orm
+
+from invest_api.app.listener import Listener
+
+
+@pytest.fixture
+def dsn(invest_api_session: orm.Session) -> str:
+    return str(invest_api_session.bind.url)
+
+
+@pytest.fixture
+async def connection(
+        loop: asyncio.AbstractEventLoop,
+        dsn: str,
+) -> AsyncIterator[asyncpg.Connection]:
+    connection = await asyncpg.connect(dsn)
+    yield connection
+    await connection.close()
+
+
+async def wait_for(condition: Callable[[], bool]) -> None:
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+
+    raise AssertionError("Condition was not met")
+
+
+async def test_listener_reconnects_after_connection_loss(
+        dsn: str,
+        connection: asyncpg.Connection,
+) -> None:
+    payloads: List[str] = []
+    reconnects: List[bool] = []
+
+    listener = Listener(dsn, logging.getLogger("db"), check_interval=0.1)
+    listener.add_listener("test", lambda *args: payloads.append(args[-1]))
+    listener.add_reconnect_listener(lambda: reconnects.append(True))
+    await listener.start()
+
+    try:
+        pid = listener._connection.get_server_pid()  # pylint: disable=W0212
+        await connection.execute("SELECT pg_terminate_backend($1);", pid)
+        await wait_for(lambda: bool(reconnects))
+
+        await connection.execute("SELECT pg_notify('test', 'after');")
+        await wait_for(lambda: payloads == ["after"])
+    finally:
+        await listener.close()
+
+
+INSERT_QUERY = """
+    INSERT INTO companies (
+        id, itn, psrn, name, size, region_code, region_name,
+        registered_at, charter_capital, is_acting
+    )
+    SELECT
+        i, (7700000000 + i)::TEXT, (1000000000000 + i)::TEXT,
+        'ООО ' || i, 'Малая', '77', 'Москва', '2010-01-01', 1, true
+    FROM generate_series(1, $1::INT) AS i
+    ;
+"""
+
+
+async def test_companies_statement_is_notified_once(
+        dsn: str,
+        connection: asyncpg.Connection,
+) -> None:
+    payloads: List[str] = []
+
+    listener = Listener(dsn, logging.getLogger("db"))
+    listener.add_listener("companies", lambda *args: payloads.append(args[-1]))
+    await listener.start()
+
+    try:
+        await connection.execute(INSERT_QUERY, 3)
+        await connection.execute("UPDATE companies SET charter_capital = 2;")
+        await connection.execute("DELETE FROM companies WHERE id = 3;")
+        await wait_for(lambda: len(payloads) == 3)
+    finally:
+        await listener.close()
+
+    itns = [sorted(row["itn"] for row in orjson.loads(p)) for p in payloads]
+    changed = ["7700000001", "7700000002", "7700000003"]
+    assert itns == [changed, changed, ["7700000003"]]
+
+
+async def test_large_companies_change_is_notified_as_table_change(
+        dsn: str,
+        connection: asyncpg.Connection,
+) -> None:
+    payloads: List[str] = []
+
+    listener = Listener(dsn, logging.getLogger("db"))
+    listener.add_listener("companies", lambda *args: payloads.append(args[-1]))
+    await listener.start()
+
+    try:
+        await connection.execute(INSERT_QUERY, 1000)
+        await wait_for(lambda: bool(payloads))
+    finally:
+        await listener.close()
+
+    assert payloads == [""]
@@ -0,0 +1,101 @@
+from datetime import date
+from http import HTTPStatus
+from typing import Callable, Dict, Tuple
+
+import pytest
+from aiohttp.abc import Application
+from aiohttp.test_utils import TestClient
+
+from invest_api import Company, create_app
+
+Samples = Dict[Tuple[str, frozenset], float]
+
+
+def parse_samples(text: str) -> Samples:
+    parser = pytest.importorskip("prometheus_client.parser")
+
+    return {
+        (sample.name, frozenset(sample.labels.items())): sample.value
+        for family in parser.text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+async def test_that_metrics_are_disabled_by_default(
+        client: TestClient,
+) -> None:
+    response = await client.get("/metrics")
+    assert response.status == HTTPStatus.NOT_FOUND
+
+
+async def test_metrics_report_requests_queries_and_cache(
+        aiohttp_client: Callable,
+        app: Application,
+        create_company: Callable,
+) -> None:
+    pytest.importorskip("prometheus_client")
+
+    company = Company(
+        id=1,
+        name="ЗАО ОКБ",
+        size="Крупная",
+        registered_at=date(2010, 1, 1),
+        itn="7710561081",
+        psrn="1047796788819",
+        region_code="77",
+        region_name="Москва",
+        activity_code="5",
+        activity_name="Высокая",
+        charter_capital=1200,
+        is_acting=True,
+        is_liquidating=False,
+        not_reported_last_year=True,
+        not_in_same_registry=False,
+        ceo_has_other_companies=True,
+        negative_list_risk=False,
+        bankruptcy_probability=5,
+        bankruptcy_vars=None,
+        is_enough_finance_data=True,
+        relative_success=7,
+        revenue_forecast=25000,
+        assets_forecast=20000,
+        dev_stage="Развивается активно",
+        dev_stage_coordinates=None,
+    )
+    create_company(company)
+
+    config = {
+        **app["config"],
+        "metrics": {
+            "enabled": True,
+        },
+    }
+    client = await aiohttp_client(await create_app(config))
+
+    for _ in range(2):
+        response = await client.get(f"/companies/{company.itn}")
+        assert response.status == HTTPStatus.OK
+
+    response = await client.get("/metrics")
+    assert response.status == HTTPStatus.OK
+    assert response.content_type == "text/plain"
+
+    samples = parse_samples(await response.text())
+
+    route = frozenset({
+        ("route", "company_details"),
+        ("method", "GET"),
+        ("status", "200"),
+    })
+    assert samples["invest_api_request_duration_seconds_count", route] == 2
+
+    method = frozenset({("method", "get_company_by_itn")})
+    assert samples["invest_api_cache_hits_total", method] == 1
+    assert samples["invest_api_cache_misses_total", method] == 1
+    assert samples["invest_api_db_query_duration_seconds_count", method] == 1
+
+    pool = frozenset({("pool", "primary")})
+    assert samples["invest_api_db_pool_size", pool] >= 1
+    assert samples["invest_api_db_pool_waiters", pool] == 0
+
+    assert samples["invest_api_requests_in_flight", frozenset()] == 1
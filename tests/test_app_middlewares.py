@@ -2,7 +2,9 @@ from http import HTTPStatus
 from typing import Callable, NoReturn
 
 from aiohttp.test_utils import TestClient
-from aiohttp.web import Application, Request
+from aiohttp.web import Application, Request, Response
+
+from invest_api.app.responses import ok
 
 
 async def test_default_error_handler_middleware(
@@ -38,3 +40,36 @@ async def test_client_error_handler_middleware(
     assert await response.json() == {
         "message": "Not found",
     }
+
+
+async def test_compression_handler_middleware(
+        aiohttp_client: Callable,
+        app: Application,
+) -> None:
+    url = "/large"
+    data = ["company"] * 1000
+
+    async def handler(_: Request) -> Response:
+        return ok(data)
+
+    app.router.add_get(url, handler)
+    client = await aiohttp_client(app)
+
+    headers = {
+        "Accept-Encoding": "gzip",
+    }
+    response = await client.get(url, headers=headers)
+    assert response.status == HTTPStatus.OK
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert (await response.json())["data"] == data
+
+    headers = {
+        "Accept-Encoding": "identity",
+    }
+    response = await client.get(url, headers=headers)
+    assert response.status == HTTPStatus.OK
+
+    assert "Content-Encoding" not in response.headers
+    assert (await response.json())["data"] == data
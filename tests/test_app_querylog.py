@@ -0,0 +1,194 @@
+# pylint: disable=W0621
+
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator
+
+import asyncpg
+import pytest
+from _pytest.logging import LogCaptureFixture
+from marshmallow import ValidationError
+from sqlalchemy import orm
+
+from invest_api.app.db import SlowQueriesSchema
+from invest_api.app.querylog import QueryLog
+
+LOGGER = "test.querylog"
+
+
+@pytest.fixture
+def dsn(invest_api_session: orm.Session) -> str:
+    return str(invest_api_session.bind.url)
+
+
+@pytest.fixture
+async def pool(
+        loop: asyncio.AbstractEventLoop,
+        dsn: str,
+) -> AsyncIterator[asyncpg.pool.Pool]:
+    pool = await asyncpg.create_pool(dsn, min_size=0, max_size=1)
+    yield pool
+    await pool.close()
+
+
+def messages(caplog: LogCaptureFixture, level: int) -> list:
+    return [
+        record.getMessage()
+        for record in caplog.records
+        if record.name == LOGGER and record.levelno == level
+    ]
+
+
+async def wait_for_plan(caplog: LogCaptureFixture) -> str:
+    for _ in range(100):
+        for message in messages(caplog, logging.WARNING):
+            if message.startswith("Slow query plan"):
+                return message
+        await asyncio.sleep(0.05)
+
+    raise AssertionError("Plan was not logged")
+
+
+async def test_slow_query_is_logged_with_plan(
+        dsn: str,
+        pool: asyncpg.pool.Pool,
+        caplog: LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, LOGGER)
+    query_log = QueryLog(
+        logging.getLogger(LOGGER),
+        dsn,
+        threshold=0,
+        explain_rate=1,
+    )
+
+    assert await query_log.fetchval(pool, "SELECT   $1::int", 1) == 1
+
+    warning = messages(caplog, logging.WARNING)[0]
+    assert warning.startswith("Slow query took ")
+    assert warning.endswith(": SELECT $1::int with args (1,)")
+
+    plan = await wait_for_plan(caplog)
+    prefix = "Slow query plan: "
+    assert plan.startswith(prefix)
+    assert json.loads(plan[len(prefix):])[0]["Plan"]
+
+
+async def test_plan_is_not_captured_for_writes(
+        dsn: str,
+        pool: asyncpg.pool.Pool,
+        caplog: LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, LOGGER)
+    query_log = QueryLog(
+        logging.getLogger(LOGGER),
+        dsn,
+        threshold=0,
+        explain_rate=1,
+    )
+
+    await query_log.execute(pool, "execute", "CREATE TEMP TABLE t (x int);")
+
+    plan = await wait_for_plan(caplog)
+    assert plan.startswith("Slow query plan was not captured: ")
+
+
+async def test_fast_query_is_logged_at_debug(
+        dsn: str,
+        pool: asyncpg.pool.Pool,
+        caplog: LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, LOGGER)
+    query_log = QueryLog(logging.getLogger(LOGGER), dsn, threshold=60)
+
+    assert await query_log.fetchval(pool, "SELECT 1;") == 1
+
+    assert not messages(caplog, logging.WARNING)
+    debug = messages(caplog, logging.DEBUG)
+    assert len(debug) == 1
+    assert debug[0].startswith("Query took ")
+    assert debug[0].endswith(" ms: SELECT 1;")
+
+
+async def test_failed_query_is_logged(
+        dsn: str,
+        pool: asyncpg.pool.Pool,
+        caplog: LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, LOGGER)
+    query_log = QueryLog(
+        logging.getLogger(LOGGER),
+        dsn,
+        threshold=0,
+        explain_rate=0,
+    )
+
+    with pytest.raises(asyncpg.PostgresError):
+        await query_log.fetchval(pool, "SELECT 1 / $1::int;", 0)
+
+    warning = messages(caplog, logging.WARNING)[0]
+    assert warning.startswith("Slow query failed after ")
+    assert warning.endswith("with args (0,)")
+
+
+async def test_plan_is_captured_outside_of_the_pool(
+        dsn: str,
+        pool: asyncpg.pool.Pool,
+        caplog: LogCaptureFixture,
+) -> None:
+    caplog.set_level(logging.DEBUG, LOGGER)
+    query_log = QueryLog(
+        logging.getLogger(LOGGER),
+        dsn,
+        threshold=0,
+        explain_rate=1,
+    )
+
+    async with pool.acquire() as connection:
+        assert await query_log.fetchval(connection, "SELECT 1;") == 1
+
+        plan = await wait_for_plan(caplog)
+        assert plan.startswith("Slow query plan: ")
+
+
+async def test_close_cancels_plan_capture(dsn: str) -> None:
+    query_log = QueryLog(
+        logging.getLogger(LOGGER),
+        dsn,
+        threshold=0,
+        explain_rate=1,
+        explain_timeout=60,
+    )
+
+    query_log._observe(  # pylint: disable=W0212
+        "SELECT pg_sleep($1::float);",
+        (60, ),
+        1,
+        None,
+    )
+    await asyncio.sleep(0.5)
+
+    started = time.monotonic()
+    await query_log.close()
+    assert time.monotonic() - started < 5
+    assert query_log._explain_task.cancelled()  # pylint: disable=W0212
+
+
+def test_slow_queries_defaults() -> None:
+    assert SlowQueriesSchema().load({}) == {
+        "threshold": 0.5,
+        "explain_rate": 0.1,
+        "explain_timeout": 10,
+    }
+
+
+@pytest.mark.parametrize("data", [
+    {"threshold": -1},
+    {"explain_rate": 1.5},
+    {"explain_timeout": 0},
+])
+def test_slow_queries_validation(data: dict) -> None:
+    with pytest.raises(ValidationError):
+        SlowQueriesSchema().load(data)
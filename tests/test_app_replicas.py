@@ -0,0 +1,176 @@
+# pylint: disable=W0621
+
+import asyncio
+import copy
+import logging
+from http import HTTPStatus
+from typing import AsyncIterator, Callable
+
+import asyncpg
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from aiohttp.web import Application
+from sqlalchemy import orm
+
+from invest_api import create_app
+from invest_api.app.replicas import Router
+
+QUERY = "SELECT current_setting('application_name');"
+
+
+def create_pool(dsn: str, name: str) -> asyncpg.pool.Pool:
+    return asyncpg.create_pool(
+        dsn,
+        min_size=0,
+        max_size=2,
+        server_settings={"application_name": name},
+    )
+
+
+@pytest.fixture
+def dsn(invest_api_session: orm.Session) -> str:
+    return str(invest_api_session.bind.url)
+
+
+@pytest.fixture
+async def primary(
+        loop: asyncio.AbstractEventLoop,
+        dsn: str,
+) -> AsyncIterator[asyncpg.pool.Pool]:
+    pool = await create_pool(dsn, "primary")
+    yield pool
+    await pool.close()
+
+
+async def test_router_reads_from_replica(
+        dsn: str,
+        primary: asyncpg.pool.Pool,
+) -> None:
+    replica = create_pool(dsn, "replica")
+    router = Router(primary, logging.getLogger("db"), [replica])
+    await router.setup()
+
+    try:
+        assert await router.fetchval(QUERY) == "replica"
+
+        async with router.acquire() as connection:
+            assert await connection.fetchval(QUERY) == "replica"
+    finally:
+        await router.close()
+
+
+async def test_router_ejects_unavailable_replica(
+        primary: asyncpg.pool.Pool,
+) -> None:
+    replica = create_pool("postgresql://postgres@127.0.0.1:1/db", "replica")
+    router = Router(primary, logging.getLogger("db"), [replica])
+    await router.setup()
+
+    try:
+        assert not router.replicas[0].healthy
+        assert await router.fetchval(QUERY) == "primary"
+    finally:
+        await router.close()
+
+
+async def test_router_falls_back_to_primary(
+        dsn: str,
+        primary: asyncpg.pool.Pool,
+) -> None:
+    replica = create_pool(dsn, "replica")
+    router = Router(primary, logging.getLogger("db"), [replica])
+    await router.setup()
+
+    try:
+        await replica.close()
+
+        assert await router.fetchval(QUERY) == "primary"
+        assert not router.replicas[0].healthy
+    finally:
+        await router.close()
+
+
+async def test_router_survives_failed_check(
+        dsn: str,
+        primary: asyncpg.pool.Pool,
+        monkeypatch: MonkeyPatch,
+) -> None:
+    async def fetchval(*args: object) -> None:
+        raise asyncpg.TooManyConnectionsError()
+
+    monkeypatch.setattr(asyncpg.pool.Pool, "fetchval", fetchval)
+
+    replica = create_pool(dsn, "replica")
+    router = Router(
+        primary,
+        logging.getLogger("db"),
+        [replica],
+        check_interval=0.1,
+    )
+    await router.setup()
+
+    try:
+        assert not router.replicas[0].healthy
+
+        monkeypatch.undo()
+        for _ in range(100):
+            if router.replicas[0].healthy:
+                break
+            await asyncio.sleep(0.05)
+
+        assert router.replicas[0].healthy
+    finally:
+        await router.close()
+
+
+async def test_router_reads_from_primary_after_change(
+        dsn: str,
+        primary: asyncpg.pool.Pool,
+) -> None:
+    replica = create_pool(dsn, "replica")
+    router = Router(
+        primary,
+        logging.getLogger("db"),
+        [replica],
+        primary_window=60,
+    )
+    await router.setup()
+
+    try:
+        router.read_from_primary()
+        assert await router.fetchval(QUERY) == "primary"
+    finally:
+        await router.close()
+
+
+async def test_router_prefers_least_loaded_replica(
+        dsn: str,
+        primary: asyncpg.pool.Pool,
+) -> None:
+    pools = [create_pool(dsn, "first"), create_pool(dsn, "second")]
+    router = Router(primary, logging.getLogger("db"), pools)
+    await router.setup()
+
+    try:
+        router.replicas[0].active = 1
+        assert await router.fetchval(QUERY) == "second"
+    finally:
+        router.replicas[0].active = 0
+        await router.close()
+
+
+async def test_app_with_replicas(
+        aiohttp_client: Callable,
+        app: Application,
+) -> None:
+    config = copy.deepcopy(app["config"])
+    config["db"]["replicas"] = {
+        "pools": [
+            config["db"]["pool"],
+        ],
+    }
+
+    client = await aiohttp_client(await create_app(config))
+
+    response = await client.get("/companies/query", params={"name": "окб"})
+    assert response.status == HTTPStatus.OK
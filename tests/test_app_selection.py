@@ -0,0 +1,219 @@
+import random
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import attr
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from invest_api.app import selection
+from invest_api.app.models import FACETS, CompanySelection
+from invest_api.app.selection import FLAGS, SelectionIndex
+
+pytest.importorskip("numpy")
+
+SIZES = ("Крупная", "Средняя", "Малая", None)
+REGIONS = ("77", "78", "50", None)
+
+
+def make_rng(seed: int) -> random.Random:
+    return random.Random(seed)  # nosec
+
+
+def make_rows(count: int, seed: int) -> List[tuple]:
+    rng = make_rng(seed)
+    ids = rng.sample(range(1, count * 10), count)
+
+    return [
+        (
+            company_id,
+            rng.choice([None, *range(0, 10)]),
+            rng.choice(SIZES),
+            rng.choice(REGIONS),
+            *(rng.choice([True, False, None]) for _ in FLAGS),
+        )
+        for company_id in ids
+    ]
+
+
+def brute_force(rows: Sequence[tuple], params: CompanySelection) -> List:
+    regions = params.region_codes.split(",")
+    flags = [getattr(params, flag) for flag in FLAGS]
+
+    matched = sorted(
+        (row[1], row[0])
+        for row in rows
+        if row[1] is not None
+        and row[1] <= params.bankruptcy_probability
+        and row[2] == params.size
+        and row[3] in regions
+        and list(row[4:]) == flags
+        and (params.cursor is None or (row[1], row[0]) > params.cursor)
+    )
+
+    offset = params.offset if params.cursor is None else 0
+    page = matched[offset:offset + params.limit]
+    return [company_id for _, company_id in page]
+
+
+def brute_force_facets(
+        rows: Sequence[tuple],
+        params: CompanySelection,
+) -> Dict[str, List[Dict]]:
+    regions = params.region_codes.split(",")
+    expected = [[params.size], regions] + [
+        [getattr(params, flag)]
+        for flag in FLAGS
+    ]
+
+    facets = {}
+    for i, name in enumerate(FACETS):
+        counts: Counter = Counter()
+        for row in rows:
+            if row[1] is None or row[1] > params.bankruptcy_probability:
+                continue
+
+            others = zip(expected, row[2:])
+            if all(v in e for j, (e, v) in enumerate(others) if j != i):
+                counts[row[2 + i]] += 1
+
+        counts.pop(None, None)
+        facets[name] = [
+            {"value": value, "count": count}
+            for value, count in sorted(counts.items())
+        ]
+
+    return facets
+
+
+def make_params(rng: random.Random, rows: Sequence[tuple]) -> CompanySelection:
+    cursor: Optional[Tuple[int, int]] = None
+    if rng.random() < 0.5:
+        row = rng.choice(rows)
+        cursor = (rng.randint(0, 9), int(row[0]))
+
+    return CompanySelection(
+        size=rng.choice(SIZES[:-1]),
+        region_codes=",".join(rng.sample(["77", "78", "50", "99"], 2)),
+        is_acting=rng.choice([True, False]),
+        bankruptcy_probability=rng.randint(-1, 10),
+        is_liquidating=rng.choice([True, False]),
+        not_reported_last_year=rng.choice([True, False]),
+        not_in_same_registry=rng.choice([True, False]),
+        ceo_has_other_companies=rng.choice([True, False]),
+        negative_list_risk=rng.choice([True, False]),
+        limit=rng.choice([1, 5, 100]),
+        offset=rng.choice([0, 0, 2]),
+        cursor=cursor,
+    )
+
+
+class TestSelectionIndex:
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_that_selection_matches_brute_force(self, seed: int) -> None:
+        rng = make_rng(seed)
+        rows = make_rows(5000, seed)
+        index = SelectionIndex(rows)
+
+        assert len(index) == len(rows)
+
+        for _ in range(200):
+            params = make_params(rng, rows)
+            assert index.select(params) == brute_force(rows, params)
+
+    def test_that_selection_is_scanned_by_chunks(
+            self,
+            monkeypatch: MonkeyPatch,
+    ) -> None:
+        monkeypatch.setattr(selection, "CHUNK_SIZE", 3)
+
+        rng = make_rng(0)
+        rows = make_rows(1000, 0)
+        index = SelectionIndex(rows)
+
+        for _ in range(200):
+            params = make_params(rng, rows)
+            assert index.select(params) == brute_force(rows, params)
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_that_count_matches_brute_force(self, seed: int) -> None:
+        rng = make_rng(seed)
+        rows = make_rows(2000, seed)
+        index = SelectionIndex(rows)
+
+        for _ in range(100):
+            params = make_params(rng, rows).without_page()
+            params = attr.evolve(params, limit=len(rows))
+            assert index.count(params) == len(brute_force(rows, params))
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_that_facets_match_brute_force(self, seed: int) -> None:
+        rng = make_rng(seed)
+        rows = make_rows(2000, seed)
+        index = SelectionIndex(rows)
+
+        for _ in range(50):
+            params = make_params(rng, rows)
+            assert index.facets(params) == brute_force_facets(rows, params)
+
+    def test_that_pages_are_ordered_by_probability_and_id(self) -> None:
+        flags = (True, False, True, False, True, False)
+        rows = [
+            (3, 5, "Крупная", "77", *flags),
+            (1, 5, "Крупная", "77", *flags),
+            (2, 3, "Крупная", "77", *flags),
+            (4, None, "Крупная", "77", *flags),
+        ]
+        index = SelectionIndex(rows)
+
+        params = CompanySelection(
+            size="Крупная",
+            region_codes="77",
+            is_acting=True,
+            bankruptcy_probability=5,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            limit=10,
+            offset=0,
+        )
+        assert index.select(params) == [2, 1, 3]
+
+        params = CompanySelection(
+            size="Крупная",
+            region_codes="77",
+            is_acting=True,
+            bankruptcy_probability=5,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            limit=10,
+            offset=0,
+            cursor=(5, 1),
+        )
+        assert index.select(params) == [3]
+
+    def test_that_empty_index_selects_nothing(self) -> None:
+        index = SelectionIndex([])
+
+        params = CompanySelection(
+            size="Крупная",
+            region_codes="77",
+            is_acting=True,
+            bankruptcy_probability=5,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            limit=10,
+            offset=0,
+        )
+
+        assert len(index) == 0
+        assert index.select(params) == []
@@ -0,0 +1,77 @@
+from datetime import date, datetime
+from typing import Any, Dict
+
+import orjson
+import pytest
+
+from invest_api import CompanySchema
+from invest_api.app.models import CompanyRecord
+from invest_api.app.serializers import compile_serializer
+
+ROW: Dict[str, Any] = {
+    "id": 1,
+    "name": "ОАО Ёжики и Грибочки",
+    "size": "Микропредприятие",
+    "registered_at": date(2010, 1, 1),
+    "itn": "2464222938",
+    "psrn": "1102454000670",
+    "region_code": "77",
+    "region_name": "Москва",
+    "activity_code": None,
+    "activity_name": None,
+    "charter_capital": 1000,
+    "is_acting": True,
+    "is_liquidating": False,
+    "not_reported_last_year": None,
+    "not_in_same_registry": False,
+    "ceo_has_other_companies": True,
+    "negative_list_risk": None,
+    "bankruptcy_probability": 5,
+    "bankruptcy_vars": '{"x": 1}',
+    "is_enough_finance_data": True,
+    "relative_success": 7,
+    "revenue_forecast": 25000,
+    "assets_forecast": None,
+    "dev_stage": "Рост активов",
+    "dev_stage_coordinates": None,
+    "distance": 0.25,
+}
+
+
+@pytest.mark.parametrize("row", [
+    ROW,
+    {**ROW, "registered_at": datetime(2010, 1, 1, 12)},
+    {**ROW, "bankruptcy_vars": {"x": 1}},
+    {**ROW, "is_acting": "false", "id": "1", "charter_capital": 1.5},
+])
+def test_serializer_output_matches_schema(row: Dict) -> None:
+    schema = CompanySchema()
+    serialize = compile_serializer(schema)
+
+    assert orjson.dumps(serialize(row)) == orjson.dumps(schema.dump(row))
+
+
+def test_serializer_requires_all_fields() -> None:
+    serialize = compile_serializer(CompanySchema())
+
+    row = dict(ROW)
+    del row["name"]
+
+    with pytest.raises(KeyError):
+        serialize(row)
+
+
+def test_company_record_keeps_serialized_company() -> None:
+    company = CompanyRecord.from_record(ROW)
+
+    assert company.id == ROW["id"]
+    assert company.itn == ROW["itn"]
+    assert company.psrn == ROW["psrn"]
+    assert company.to_dict() == CompanySchema().dump(ROW)
+
+
+def test_serializer_passes_iso_date_strings() -> None:
+    serialize = compile_serializer(CompanySchema())
+    row = {**ROW, "registered_at": "2010-01-01"}
+
+    assert serialize(row) == CompanySchema().dump(ROW)
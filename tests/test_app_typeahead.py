@@ -0,0 +1,49 @@
+import pytest
+
+from invest_api.app.typeahead import TrigramIndex, trigrams
+
+pytest.importorskip("numpy")
+
+
+def test_trigrams_are_padded_per_word() -> None:
+    assert trigrams("Ab c") == {"  a", " ab", "ab ", "  c", " c "}
+
+
+def test_trigrams_ignore_case_and_punctuation() -> None:
+    assert trigrams("ООО «Рога»") == trigrams("ооо рога")
+
+
+class TestTrigramIndex:
+    rows = [
+        (1, "ООО Ромашка"),
+        (2, "ЗАО Ромашка"),
+        (3, "ПАО Лютик"),
+        (4, "ООО Ромашка и партнеры"),
+    ]
+
+    def test_that_similar_names_are_found(self) -> None:
+        index = TrigramIndex(self.rows)
+
+        assert index.search("ромашка", limit=10) == [1, 2, 4]
+
+    def test_that_closest_name_goes_first(self) -> None:
+        index = TrigramIndex(self.rows)
+
+        assert index.search("ЗАО Ромашка", limit=1) == [2]
+
+    def test_that_ties_are_broken_by_id(self) -> None:
+        rows = [(i, "ООО Ромашка") for i in range(10, 0, -1)]
+        index = TrigramIndex(rows)
+
+        assert index.search("ООО Ромашка", limit=3) == [1, 2, 3]
+
+    def test_that_unknown_name_is_not_found(self) -> None:
+        index = TrigramIndex(self.rows)
+
+        assert index.search("кактус") == []
+
+    def test_that_empty_index_finds_nothing(self) -> None:
+        index = TrigramIndex([])
+
+        assert len(index) == 0
+        assert index.search("ромашка") == []
@@ -1,11 +1,29 @@
+# pylint: disable=C0302,R0913
+
+import asyncio
+import copy
+import csv
+import io
+import json
 from datetime import date
 from http import HTTPStatus
-from typing import Callable
+from typing import Callable, Dict, List, Optional
 
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from aiohttp import ClientPayloadError, ClientTimeout
+from aiohttp.abc import Application
 from aiohttp.test_utils import TestClient
+from sqlalchemy import orm
 
-from invest_api import Company
+from invest_api import Company, create_app
+from invest_api.app.cache import make_key
+from invest_api.app.db import DB
+from invest_api.app.models import (
+    CompanySelection,
+    CompanySelectionSchema,
+    encode_cursor,
+)
 from invest_api.utils import is_valid_uuid
 
 
@@ -54,6 +72,12 @@ class TestHealthView:
 class TestCompanyDetailsView:
     url = "/companies/{id}"
 
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        identifier = "8887776655"
+        url = client.app.router["company_details"].url_for(id=identifier)
+
+        assert self.url.format(id=identifier) == str(url)
+
     @pytest.mark.parametrize("identifier", [
         "8887776655",
         "88877766554433",
@@ -72,6 +96,25 @@ class TestCompanyDetailsView:
             "message": "Not found",
         }
 
+    @pytest.mark.parametrize("if_none_match", [
+        "*",
+        None,
+    ])
+    async def test_conditional_request_with_not_existing_company(
+            self,
+            client: TestClient,
+            if_none_match: Optional[str],
+    ) -> None:
+        response = await client.get("/regions")
+        headers = {
+            "If-None-Match": if_none_match or response.headers["ETag"],
+        }
+
+        url = self.url.format(id="8887776655")
+
+        response = await client.get(url, headers=headers)
+        assert response.status == HTTPStatus.NOT_FOUND
+
     @pytest.mark.parametrize("identifier_key", [
         "itn",
         "psrn",
@@ -124,10 +167,66 @@ class TestCompanyDetailsView:
             "message": "OK",
         }
 
+    async def test_cached_company_is_evicted_on_change(
+            self,
+            client: TestClient,
+            create_company: Callable,
+            invest_api_session: orm.Session,
+    ) -> None:
+        company = Company(
+            id=1,
+            name="ЗАО ОКБ",
+            size="Крупная",
+            registered_at=date(2010, 1, 1),
+            itn="7710561081",
+            psrn="1047796788819",
+            region_code="77",
+            region_name="Москва",
+            activity_code="5",
+            activity_name="Высокая",
+            charter_capital=1200,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Развивается активно",
+            dev_stage_coordinates=None,
+        )
+        create_company(company)
+
+        url = self.url.format(id=company.itn)
+
+        response = await client.get(url)
+        assert (await response.json())["data"]["name"] == "ЗАО ОКБ"
+
+        company.name = "ПАО ОКБ"
+        invest_api_session.commit()
+
+        for _ in range(100):
+            response = await client.get(url)
+            if (await response.json())["data"]["name"] == "ПАО ОКБ":
+                break
+            await asyncio.sleep(0.01)
+        else:
+            pytest.fail("Cached company was not evicted")
+
 
 class TestCompaniesQueryView:
     url = "/companies/query"
 
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["companies_query"].url_for()
+
+        assert self.url == str(url)
+
     async def test_request_without_query_params(
             self,
             client: TestClient,
@@ -206,10 +305,116 @@ class TestCompaniesQueryView:
             "message": "OK",
         }
 
+    async def test_request_with_json_passthrough(
+            self,
+            client: TestClient,
+            passthrough_client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        company = Company(
+            id=1,
+            name="ОАО Ёжики и Грибочки",
+            size="Микропредприятие",
+            registered_at=date(2010, 1, 1),
+            itn="2464222938",
+            psrn="1102454000670",
+            region_code="77",
+            region_name="Москва",
+            activity_code="47.51.1",
+            activity_name="Семейный подряд",
+            charter_capital=1000,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Рост активов",
+            dev_stage_coordinates={"x": 1.5, "y": 2},
+        )
+        create_company(company)
+
+        params = {
+            "name": "ежеки",
+        }
+
+        expected = await client.get(self.url, params=params)
+        response = await passthrough_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+
+    async def test_request_with_typeahead_engine(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+    ) -> None:
+        pytest.importorskip("numpy")
+
+        company = Company(
+            id=1,
+            name="ОАО Ёжики и Грибочки",
+            size="Микропредприятие",
+            registered_at=date(2010, 1, 1),
+            itn="2464222938",
+            psrn="1102454000670",
+            region_code="77",
+            region_name="Москва",
+            activity_code="47.51.1",
+            activity_name="Семейный подряд",
+            charter_capital=1000,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Рост активов",
+            dev_stage_coordinates=None,
+        )
+        create_company(company)
+
+        app["config"]["typeahead"] = {
+            "enabled": True,
+        }
+        client = await aiohttp_client(app)
+
+        params = {
+            "name": "ежики",
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == {
+            "data": [
+                company.to_dict(),
+            ],
+            "message": "OK",
+        }
+
 
 class TestCompaniesSelectionView:
     url = "/companies/selection"
 
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["companies_selection"].url_for()
+
+        assert self.url == str(url)
+
     async def test_request_without_query_params(
             self,
             client: TestClient,
@@ -234,6 +439,17 @@ class TestCompaniesSelectionView:
             "message": "Input payload validation failed",
         }
 
+    async def test_conditional_request_without_query_params(
+            self,
+            client: TestClient,
+    ) -> None:
+        headers = {
+            "If-None-Match": "*",
+        }
+
+        response = await client.get(self.url, headers=headers)
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
     async def test_request_with_existing_company(
             self,
             client: TestClient,
@@ -290,34 +506,57 @@ class TestCompaniesSelectionView:
             "message": "OK",
         }
 
+    @pytest.mark.parametrize("cursor", [
+        "invalid",
+        encode_cursor(99999, 1),
+        encode_cursor(-1, 1),
+        encode_cursor(5, 2 ** 63),
+    ])
+    async def test_request_with_invalid_cursor(
+            self,
+            client: TestClient,
+            cursor: str,
+    ) -> None:
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "cursor": cursor,
+        }
 
-class TestRegionsView:
-    url = "/regions"
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
 
-    async def test_request_with_non_empty_data(
+        assert await response.json() == {
+            "errors": {
+                "cursor": ["Not a valid cursor."],
+            },
+            "message": "Input payload validation failed",
+        }
+
+    async def test_request_pages_with_cursor(
             self,
             client: TestClient,
             create_company: Callable,
     ) -> None:
-        regions = {
-            "01": "Алтайский край",
-            "03": "Краснодарский край",
-            "04": "Красноярский край",
-        }
-
-        for i, (region_code, region_name) in enumerate(regions.items()):
-            itn = region_code * 5
-            psrn = f"{region_code * 6}{i}"
+        companies = []
 
+        for i, bankruptcy_probability in enumerate([5, 3, 5]):
             company = Company(
                 id=i,
                 name="ЗАО ОКБ",
                 size="Крупная",
                 registered_at=date(2010, 1, 1),
-                itn=itn,
-                psrn=psrn,
-                region_code=region_code,
-                region_name=region_name,
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
                 activity_code="5",
                 activity_name="Высокая",
                 charter_capital=1200,
@@ -327,7 +566,7 @@ class TestRegionsView:
                 not_in_same_registry=False,
                 ceo_has_other_companies=True,
                 negative_list_risk=False,
-                bankruptcy_probability=5,
+                bankruptcy_probability=bankruptcy_probability,
                 bankruptcy_vars=None,
                 is_enough_finance_data=True,
                 relative_success=7,
@@ -337,10 +576,1106 @@ class TestRegionsView:
                 dev_stage_coordinates=None,
             )
             create_company(company)
+            companies.append(company)
 
-        response = await client.get(self.url)
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "limit": 2,
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
 
         assert await response.json() == {
-            "data": regions,
+            "data": [
+                companies[1].to_dict(),
+                companies[0].to_dict(),
+            ],
+            "message": "OK",
+        }
+
+        params["cursor"] = response.headers["X-Next-Cursor"]
+        params["offset"] = 1
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == {
+            "data": [
+                companies[2].to_dict(),
+            ],
             "message": "OK",
         }
+        assert "X-Next-Cursor" not in response.headers
+
+    async def test_request_with_json_passthrough(
+            self,
+            client: TestClient,
+            passthrough_client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        for i, bankruptcy_probability in enumerate([5, 3, 5]):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name=None,
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=bankruptcy_probability,
+                bankruptcy_vars={"x": [1, 2]},
+                is_enough_finance_data=None,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=None,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "limit": 2,
+        }
+
+        expected = await client.get(self.url, params=params)
+        response = await passthrough_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+        assert len((await response.json())["data"]) == 2
+
+        cursor = response.headers["X-Next-Cursor"]
+        assert cursor == expected.headers["X-Next-Cursor"]
+
+        params["cursor"] = cursor
+
+        expected = await client.get(self.url, params=params)
+        response = await passthrough_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+        assert "X-Next-Cursor" not in response.headers
+
+    async def test_request_with_selection_engine(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        pytest.importorskip("numpy")
+
+        for i, bankruptcy_probability in enumerate([5, 3, 5, None]):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=bankruptcy_probability,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+        config = {
+            **app["config"],
+            "selection": {
+                "enabled": True,
+            },
+        }
+        engine_client = await aiohttp_client(await create_app(config))
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77,78",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "limit": 2,
+        }
+
+        expected = await client.get(self.url, params=params)
+        response = await engine_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+        assert len((await response.json())["data"]) == 2
+
+        cursor = response.headers["X-Next-Cursor"]
+        assert cursor == expected.headers["X-Next-Cursor"]
+
+        params["cursor"] = cursor
+
+        expected = await client.get(self.url, params=params)
+        response = await engine_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+        assert len((await response.json())["data"]) == 1
+        assert "X-Next-Cursor" not in response.headers
+
+        params["with_total"] = 1
+
+        expected = await client.get(self.url, params=params)
+        response = await engine_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert response.headers["X-Total-Count"] == "3"
+        assert expected.headers["X-Total-Count"] == "3"
+
+    async def test_request_with_total(
+            self,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        for i, bankruptcy_probability in enumerate([5, 3, 5]):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=bankruptcy_probability,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "limit": 2,
+            "with_total": 1,
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert response.headers["X-Total-Count"] == "3"
+        assert response.headers["X-Total-Count-Approximate"] == "false"
+
+        exposed = response.headers["Access-Control-Expose-Headers"]
+        assert exposed.split(", ") == [
+            "X-Next-Cursor",
+            "X-Total-Count",
+            "X-Total-Count-Approximate",
+        ]
+
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert response.headers["X-Total-Count"] == "3"
+
+        selection = CompanySelectionSchema().load(params)
+        key = make_key("count_selection", selection.without_page())
+        cache = client.app["db"]._cache  # pylint: disable=W0212
+        assert key in cache
+
+        del params["with_total"]
+        selection = CompanySelectionSchema().load(params)
+        assert make_key("select_company", selection) in cache
+
+    async def test_request_with_estimated_total(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+    ) -> None:
+        config = copy.deepcopy(app["config"])
+        config["db"]["exact_count_limit"] = 0
+        client = await aiohttp_client(await create_app(config))
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "with_total": 1,
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert int(response.headers["X-Total-Count"]) >= 1
+        assert response.headers["X-Total-Count-Approximate"] == "true"
+
+    async def test_failed_stream_is_aborted(
+            self,
+            client: TestClient,
+            create_company: Callable,
+            monkeypatch: MonkeyPatch,
+    ) -> None:
+        company = Company(
+            id=1,
+            name="ЗАО ОКБ",
+            size="Крупная",
+            registered_at=date(2010, 1, 1),
+            itn="7710561081",
+            psrn="1047796788819",
+            region_code="77",
+            region_name="Москва",
+            activity_code="5",
+            activity_name="Высокая",
+            charter_capital=1200,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Развивается активно",
+            dev_stage_coordinates=None,
+        )
+        create_company(company)
+
+        stream_selection = DB.stream_selection
+
+        async def failing_stream(*args, **kwargs):
+            async for records in stream_selection(*args, **kwargs):
+                yield records
+            raise ConnectionResetError("Connection lost")
+
+        monkeypatch.setattr(DB, "stream_selection", failing_stream)
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+        }
+        headers = {
+            "Accept": "application/x-ndjson",
+        }
+
+        response = await client.get(
+            self.url,
+            params=params,
+            headers=headers,
+            timeout=ClientTimeout(total=10),
+        )
+        assert response.status == HTTPStatus.OK
+
+        with pytest.raises(ClientPayloadError):
+            await response.read()
+
+    async def test_request_streams_ndjson(
+            self,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        companies = []
+
+        for i in range(3):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=5,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+            companies.append(company)
+
+        params = {
+            "size": "Крупная",
+            "region_codes": "77",
+            "is_acting": 1,
+            "bankruptcy_probability": 5,
+            "is_liquidating": 0,
+            "not_reported_last_year": 1,
+            "not_in_same_registry": 0,
+            "ceo_has_other_companies": 1,
+            "negative_list_risk": 0,
+            "limit": 1,
+        }
+        headers = {
+            "Accept": "application/x-ndjson",
+        }
+
+        response = await client.get(self.url, params=params, headers=headers)
+        assert response.status == HTTPStatus.OK
+        assert response.content_type == "application/x-ndjson"
+
+        request_id = response.headers.get("X-Request-ID")
+        assert is_valid_uuid(request_id)
+
+        lines = (await response.text()).splitlines()
+
+        assert [json.loads(line) for line in lines] == [
+            company.to_dict()
+            for company in companies
+        ]
+
+
+class TestCompaniesFacetsView:
+    url = "/companies/facets"
+
+    params = {
+        "size": "Крупная",
+        "region_codes": "77",
+        "is_acting": 1,
+        "bankruptcy_probability": 5,
+        "is_liquidating": 0,
+        "not_reported_last_year": 1,
+        "not_in_same_registry": 0,
+        "ceo_has_other_companies": 1,
+        "negative_list_risk": 0,
+    }
+
+    companies = [
+        ("Крупная", "77", 5),
+        ("Крупная", "78", 3),
+        ("Средняя", "77", 4),
+        ("Крупная", "77", 9),
+    ]
+
+    def create_companies(self, create_company: Callable) -> None:
+        for i, (size, region_code, probability) in enumerate(self.companies):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size=size,
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code=region_code,
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=probability,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["companies_facets"].url_for()
+
+        assert self.url == str(url)
+
+    async def test_request_without_query_params(
+            self,
+            client: TestClient,
+    ) -> None:
+        response = await client.get(self.url)
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    async def test_request_with_existing_companies(
+            self,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        self.create_companies(create_company)
+
+        response = await client.get(self.url, params=self.params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == {
+            "data": {
+                "size": [
+                    {"value": "Крупная", "count": 1},
+                    {"value": "Средняя", "count": 1},
+                ],
+                "region_code": [
+                    {"value": "77", "count": 1},
+                    {"value": "78", "count": 1},
+                ],
+                "is_acting": [
+                    {"value": True, "count": 1},
+                ],
+                "is_liquidating": [
+                    {"value": False, "count": 1},
+                ],
+                "not_reported_last_year": [
+                    {"value": True, "count": 1},
+                ],
+                "not_in_same_registry": [
+                    {"value": False, "count": 1},
+                ],
+                "ceo_has_other_companies": [
+                    {"value": True, "count": 1},
+                ],
+                "negative_list_risk": [
+                    {"value": False, "count": 1},
+                ],
+            },
+            "message": "OK",
+        }
+
+    async def test_that_facets_are_cached_per_filter(
+            self,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        self.create_companies(create_company)
+
+        params = {
+            **self.params,
+            "region_codes": "78,77",
+            "limit": 1,
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        selection: CompanySelection = CompanySelectionSchema().load({
+            **self.params,
+            "region_codes": "77,78,77",
+            "offset": 5,
+        })
+
+        key = make_key("get_selection_facets", selection.without_page())
+        cache = client.app["db"]._cache  # pylint: disable=W0212
+        assert cache.get(key) == (await response.json())["data"]
+
+    async def test_request_with_selection_engine(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        pytest.importorskip("numpy")
+
+        self.create_companies(create_company)
+
+        config = {
+            **app["config"],
+            "selection": {
+                "enabled": True,
+            },
+        }
+        engine_client = await aiohttp_client(await create_app(config))
+
+        params = {
+            **self.params,
+            "region_codes": "78,77",
+            "limit": 1,
+        }
+
+        expected = await client.get(self.url, params=params)
+        response = await engine_client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == await expected.json()
+
+
+class TestCompaniesExportView:
+    url = "/companies/export"
+
+    params = {
+        "size": "Крупная",
+        "region_codes": "77",
+        "is_acting": 1,
+        "bankruptcy_probability": 5,
+        "is_liquidating": 0,
+        "not_reported_last_year": 1,
+        "not_in_same_registry": 0,
+        "ceo_has_other_companies": 1,
+        "negative_list_risk": 0,
+    }
+
+    def create_companies(self, create_company: Callable) -> List[Company]:
+        companies = []
+
+        for i in range(3):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=f"771056108{i}",
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=5,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+            companies.append(company)
+
+        return companies
+
+    async def create_client(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+    ) -> TestClient:
+        pytest.importorskip("pyarrow")
+
+        config = {
+            **app["config"],
+            "export": {
+                "enabled": True,
+                "chunk_size": 2,
+            },
+        }
+        return await aiohttp_client(await create_app(config))
+
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["companies_export"].url_for()
+
+        assert self.url == str(url)
+
+    async def test_that_export_is_disabled_by_default(
+            self,
+            client: TestClient,
+    ) -> None:
+        response = await client.get(self.url, params=self.params)
+        assert response.status == HTTPStatus.NOT_FOUND
+
+    async def test_request_with_unknown_format(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+
+        params: Dict[str, object] = {
+            **self.params,
+            "format": "xlsx",
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    async def test_request_without_query_params(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+
+        response = await client.get(self.url)
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    async def test_request_exports_csv(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+        companies = self.create_companies(create_company)
+
+        response = await client.get(self.url, params=self.params)
+        assert response.status == HTTPStatus.OK
+        assert response.content_type == "text/csv"
+
+        disposition = response.headers["Content-Disposition"]
+        assert disposition == 'attachment; filename="companies.csv"'
+
+        request_id = response.headers.get("X-Request-ID")
+        assert is_valid_uuid(request_id)
+
+        reader = csv.DictReader(io.StringIO(await response.text()))
+
+        assert [row["itn"] for row in reader] == [
+            company.itn
+            for company in companies
+        ]
+
+    async def test_failed_export_is_aborted(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+            monkeypatch: MonkeyPatch,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+        self.create_companies(create_company)
+
+        stream_selection = DB.stream_selection
+
+        async def failing_stream(*args, **kwargs):
+            async for records in stream_selection(*args, **kwargs):
+                yield records
+            raise ConnectionResetError("Connection lost")
+
+        monkeypatch.setattr(DB, "stream_selection", failing_stream)
+
+        response = await client.get(
+            self.url,
+            params=self.params,
+            timeout=ClientTimeout(total=10),
+        )
+        assert response.status == HTTPStatus.OK
+
+        with pytest.raises(ClientPayloadError):
+            await response.read()
+
+    async def test_request_exports_parquet(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+        companies = self.create_companies(create_company)
+
+        params: Dict[str, object] = {
+            **self.params,
+            "format": "parquet",
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+        assert response.content_type == "application/vnd.apache.parquet"
+
+        pq = pytest.importorskip("pyarrow.parquet")
+        parquet = pq.ParquetFile(io.BytesIO(await response.read()))
+
+        assert parquet.metadata.num_row_groups == 2
+        assert parquet.read().to_pylist() == [
+            {**company.to_dict(), "registered_at": company.registered_at}
+            for company in companies
+        ]
+
+    async def test_request_exports_arrow(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+    ) -> None:
+        client = await self.create_client(aiohttp_client, app)
+        companies = self.create_companies(create_company)
+
+        params: Dict[str, object] = {
+            **self.params,
+            "format": "arrow",
+        }
+
+        response = await client.get(self.url, params=params)
+        assert response.status == HTTPStatus.OK
+        assert response.content_type == "application/vnd.apache.arrow.stream"
+
+        ipc = pytest.importorskip("pyarrow.ipc")
+        reader = ipc.open_stream(await response.read())
+
+        assert reader.read_all().to_pylist() == [
+            {**company.to_dict(), "registered_at": company.registered_at}
+            for company in companies
+        ]
+
+
+class TestRegionsView:
+    url = "/regions"
+
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["regions"].url_for()
+
+        assert self.url == str(url)
+
+    async def test_request_with_empty_data(self, client: TestClient) -> None:
+        response = await client.get(self.url)
+        assert response.status == HTTPStatus.OK
+
+        assert await response.json() == {
+            "data": {},
+            "message": "OK",
+        }
+
+    async def test_request_with_non_empty_data(
+            self,
+            client: TestClient,
+            create_company: Callable,
+            refresh_dataset: Callable,
+    ) -> None:
+        regions = {
+            "01": "Алтайский край",
+            "03": "Краснодарский край",
+            "04": "Красноярский край",
+        }
+
+        for i, (region_code, region_name) in enumerate(regions.items()):
+            itn = region_code * 5
+            psrn = f"{region_code * 6}{i}"
+
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=itn,
+                psrn=psrn,
+                region_code=region_code,
+                region_name=region_name,
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=5,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+        refresh_dataset()
+
+        for _ in range(100):
+            response = await client.get(self.url)
+            if (await response.json())["data"]:
+                break
+            await asyncio.sleep(0.01)
+
+        assert await response.json() == {
+            "data": regions,
+            "message": "OK",
+        }
+
+    async def test_conditional_request(
+            self,
+            client: TestClient,
+            refresh_dataset: Callable,
+    ) -> None:
+        response = await client.get(self.url)
+        assert response.status == HTTPStatus.OK
+        assert response.headers["Cache-Control"] == "no-cache"
+
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+        vary = response.headers["Vary"]
+
+        headers = {
+            "If-None-Match": etag,
+        }
+        response = await client.get(self.url, headers=headers)
+        assert response.status == HTTPStatus.NOT_MODIFIED
+        assert response.headers["ETag"] == etag
+        assert response.headers["Vary"] == vary
+
+        headers = {
+            "If-Modified-Since": last_modified,
+        }
+        response = await client.get(self.url, headers=headers)
+        assert response.status == HTTPStatus.NOT_MODIFIED
+
+        refresh_dataset()
+
+        headers = {
+            "If-None-Match": etag,
+        }
+        for _ in range(100):
+            response = await client.get(self.url, headers=headers)
+            if response.status == HTTPStatus.OK:
+                break
+            await asyncio.sleep(0.01)
+
+        assert response.status == HTTPStatus.OK
+        assert response.headers["ETag"] != etag
+
+    async def test_request_with_configured_max_age(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+    ) -> None:
+        config = {
+            **app["config"],
+            "views": {
+                "max_age": {
+                    "regions": 3600,
+                },
+            },
+        }
+
+        client = await aiohttp_client(await create_app(config))
+
+        response = await client.get(self.url)
+        assert response.status == HTTPStatus.OK
+
+        cache_control = response.headers["Cache-Control"]
+        assert cache_control == "public, max-age=3600"
+        assert "Expires" not in response.headers
+        assert "Pragma" not in response.headers
+
+
+class TestCompaniesBatchView:
+    url = "/companies/batch"
+
+    async def test_that_route_is_named(self, client: TestClient) -> None:
+        url = client.app.router["companies_batch"].url_for()
+
+        assert self.url == str(url)
+
+    async def test_request_without_payload(self, client: TestClient) -> None:
+        response = await client.post(self.url, data="{")
+        assert response.status == HTTPStatus.BAD_REQUEST
+
+        assert await response.json() == {
+            "message": "Bad request",
+        }
+
+    async def test_request_with_empty_ids(self, client: TestClient) -> None:
+        response = await client.post(self.url, json={"ids": []})
+        assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+        assert await response.json() == {
+            "errors": {
+                "ids": ["Length must be between 1 and 5000."],
+            },
+            "message": "Input payload validation failed",
+        }
+
+    async def test_request_with_existing_companies(
+            self,
+            client: TestClient,
+            create_company: Callable,
+    ) -> None:
+        company = Company(
+            id=1,
+            name="ЗАО ОКБ",
+            size="Крупная",
+            registered_at=date(2010, 1, 1),
+            itn="7710561081",
+            psrn="1047796788819",
+            region_code="77",
+            region_name="Москва",
+            activity_code="5",
+            activity_name="Высокая",
+            charter_capital=1200,
+            is_acting=True,
+            is_liquidating=False,
+            not_reported_last_year=True,
+            not_in_same_registry=False,
+            ceo_has_other_companies=True,
+            negative_list_risk=False,
+            bankruptcy_probability=5,
+            bankruptcy_vars=None,
+            is_enough_finance_data=True,
+            relative_success=7,
+            revenue_forecast=25000,
+            assets_forecast=20000,
+            dev_stage="Развивается активно",
+            dev_stage_coordinates=None,
+        )
+        create_company(company)
+
+        payload = {
+            "ids": [
+                company.itn,
+                company.psrn,
+                "8887776655",
+                "88877766554433",
+                company.itn,
+            ],
+        }
+
+        response = await client.post(self.url, json=payload)
+        assert response.status == HTTPStatus.OK
+
+        data = company.to_dict()
+
+        assert await response.json() == {
+            "data": {
+                "companies": {
+                    company.itn: data,
+                    company.psrn: data,
+                },
+                "not_found": [
+                    "8887776655",
+                    "88877766554433",
+                ],
+            },
+            "message": "OK",
+        }
+
+    async def test_request_caches_limited_number_of_companies(
+            self,
+            aiohttp_client: Callable,
+            app: Application,
+            create_company: Callable,
+    ) -> None:
+        config = copy.deepcopy(app["config"])
+        config["db"]["batch_cache_limit"] = 1
+        client = await aiohttp_client(await create_app(config))
+
+        itns = [f"771056108{i}" for i in range(3)]
+        for i, itn in enumerate(itns):
+            company = Company(
+                id=i,
+                name="ЗАО ОКБ",
+                size="Крупная",
+                registered_at=date(2010, 1, 1),
+                itn=itn,
+                psrn=f"104779678881{i}",
+                region_code="77",
+                region_name="Москва",
+                activity_code="5",
+                activity_name="Высокая",
+                charter_capital=1200,
+                is_acting=True,
+                is_liquidating=False,
+                not_reported_last_year=True,
+                not_in_same_registry=False,
+                ceo_has_other_companies=True,
+                negative_list_risk=False,
+                bankruptcy_probability=5,
+                bankruptcy_vars=None,
+                is_enough_finance_data=True,
+                relative_success=7,
+                revenue_forecast=25000,
+                assets_forecast=20000,
+                dev_stage="Развивается активно",
+                dev_stage_coordinates=None,
+            )
+            create_company(company)
+
+        response = await client.post(self.url, json={"ids": itns})
+        assert response.status == HTTPStatus.OK
+        assert len((await response.json())["data"]["companies"]) == 3
+
+        cache = client.app["db"]._cache  # pylint: disable=W0212
+        cached = [
+            itn
+            for itn in itns
+            if make_key("get_company_by_itn", itn) in cache
+        ]
+        assert len(cached) == 1
@@ -0,0 +1,324 @@
+# pylint: disable=W0621,R0913
+
+import asyncio
+import csv
+from datetime import date
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List
+
+import asyncpg
+import orjson
+import pytest
+from sqlalchemy import orm
+
+from invest_api import Company
+from invest_api.loader import load, load_delta, read_rows
+
+FIELDS = [
+    "id",
+    "itn",
+    "psrn",
+    "name",
+    "size",
+    "region_code",
+    "region_name",
+    "registered_at",
+    "charter_capital",
+    "is_acting",
+    "bankruptcy_probability",
+    "bankruptcy_vars",
+]
+
+
+def make_rows(count: int) -> List[Dict]:
+    return [
+        {
+            "id": i,
+            "itn": f"77105610{i:02}",
+            "psrn": f"10477967888{i:02}",
+            "name": f"ЗАО ОКБ {i}",
+            "size": "Крупная",
+            "region_code": "77",
+            "region_name": "Москва",
+            "registered_at": "2010-01-01",
+            "charter_capital": 1200,
+            "is_acting": True,
+            "bankruptcy_probability": i,
+            "bankruptcy_vars": {"x": [i]},
+        }
+        for i in range(count)
+    ]
+
+
+def write_csv(path: Path, rows: List[Dict]) -> None:
+    with path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            bankruptcy_vars = orjson.dumps(row["bankruptcy_vars"]).decode()
+            writer.writerow({
+                **row,
+                "is_acting": "true" if row["is_acting"] else "false",
+                "bankruptcy_vars": bankruptcy_vars,
+            })
+
+
+def write_jsonl(path: Path, rows: List[Dict]) -> None:
+    path.write_bytes(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+
+
+@pytest.fixture
+async def connection(
+        invest_api_session: orm.Session,
+        loop: asyncio.AbstractEventLoop,
+) -> AsyncIterator[asyncpg.Connection]:
+    connection = await asyncpg.connect(str(invest_api_session.bind.url))
+    yield connection
+    await connection.close()
+
+
+def test_that_csv_values_are_converted(tmp_path: Path) -> None:
+    path = tmp_path / "companies.csv"
+    write_csv(path, make_rows(1))
+
+    columns = [
+        ("id", "bigint"),
+        ("registered_at", "date"),
+        ("is_acting", "boolean"),
+        ("bankruptcy_vars", "jsonb"),
+        ("activity_name", "text"),
+    ]
+
+    assert list(read_rows(path, columns)) == [
+        (0, date(2010, 1, 1), True, '{"x":[0]}', None),
+    ]
+
+
+def test_that_invalid_value_is_reported(tmp_path: Path) -> None:
+    path = tmp_path / "companies.jsonl"
+    write_jsonl(path, [{"is_acting": "maybe"}])
+
+    with pytest.raises(ValueError, match="row 1, is_acting"):
+        list(read_rows(path, [("is_acting", "boolean")]))
+
+
+@pytest.mark.parametrize("write, suffix", [
+    (write_csv, "csv"),
+    (write_jsonl, "jsonl"),
+])
+async def test_that_dataset_replaces_companies(
+        connection: asyncpg.Connection,
+        create_company: Callable,
+        tmp_path: Path,
+        write: Callable,
+        suffix: str,
+) -> None:
+    company = Company(
+        id=100,
+        name="ОАО Ёжики и Грибочки",
+        size="Микропредприятие",
+        registered_at=date(2010, 1, 1),
+        itn="2464222938",
+        psrn="1102454000670",
+        region_code="24",
+        region_name="Красноярский край",
+        activity_code="47.51.1",
+        activity_name="Семейный подряд",
+        charter_capital=1000,
+        is_acting=True,
+        is_liquidating=False,
+        not_reported_last_year=True,
+        not_in_same_registry=False,
+        ceo_has_other_companies=True,
+        negative_list_risk=False,
+        bankruptcy_probability=5,
+        bankruptcy_vars=None,
+        is_enough_finance_data=True,
+        relative_success=7,
+        revenue_forecast=25000,
+        assets_forecast=20000,
+        dev_stage="Рост активов",
+        dev_stage_coordinates=None,
+    )
+    create_company(company)
+
+    indexes = await connection.fetch(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = 'companies' ORDER BY indexname;",
+    )
+    triggers = await connection.fetch(
+        "SELECT tgname FROM pg_trigger WHERE tgrelid = 'companies'::REGCLASS "
+        "AND NOT tgisinternal ORDER BY tgname;",
+    )
+    version = await connection.fetchval("SELECT version FROM dataset;")
+
+    path = tmp_path / f"companies.{suffix}"
+    write(path, make_rows(25))
+
+    report = await load(connection, path, batch_size=10)
+
+    assert report["rows"] == 25
+    assert report["version"] == version + 1
+    assert report["rows_per_second"] > 0
+
+    records = await connection.fetch("SELECT * FROM companies ORDER BY id;")
+    assert [record["id"] for record in records] == list(range(25))
+    assert records[3]["bankruptcy_vars"] == '{"x": [3]}'
+    assert records[3]["registered_at"] == date(2010, 1, 1)
+
+    regions = await connection.fetch("SELECT code FROM regions;")
+    assert [region["code"] for region in regions] == ["77"]
+
+    assert await connection.fetch(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = 'companies' ORDER BY indexname;",
+    ) == indexes
+    assert await connection.fetch(
+        "SELECT tgname FROM pg_trigger WHERE tgrelid = 'companies'::REGCLASS "
+        "AND NOT tgisinternal ORDER BY tgname;",
+    ) == triggers
+
+
+async def test_that_invalid_dataset_is_not_loaded(
+        connection: asyncpg.Connection,
+        tmp_path: Path,
+) -> None:
+    rows = make_rows(5)
+    rows[3]["region_code"] = "777"
+
+    path = tmp_path / "companies.jsonl"
+    write_jsonl(path, rows)
+
+    with pytest.raises(asyncpg.CheckViolationError):
+        await load(connection, path)
+
+    assert await connection.fetchval("SELECT count(*) FROM companies;") == 0
+    assert await connection.fetchval(
+        "SELECT to_regclass('companies_staging');",
+    ) is None
+
+
+async def test_that_duplicate_itns_are_not_loaded(
+        connection: asyncpg.Connection,
+        tmp_path: Path,
+) -> None:
+    rows = make_rows(5)
+    rows[3]["itn"] = rows[2]["itn"]
+
+    path = tmp_path / "companies.csv"
+    write_csv(path, rows)
+
+    with pytest.raises(asyncpg.UniqueViolationError):
+        await load(connection, path)
+
+    assert await connection.fetchval("SELECT count(*) FROM companies;") == 0
+
+
+async def test_that_delta_upserts_changed_companies(
+        connection: asyncpg.Connection,
+        invest_api_session: orm.Session,
+        tmp_path: Path,
+) -> None:
+    path = tmp_path / "companies.jsonl"
+    write_jsonl(path, make_rows(3))
+    await load(connection, path)
+
+    version = await connection.fetchval("SELECT version FROM dataset;")
+
+    rows = make_rows(4)
+    rows[1]["name"] = "ЗАО ОКБ Новое"
+    path = tmp_path / "delta.csv"
+    write_csv(path, rows[1:])
+
+    payloads = []
+    listener = await asyncpg.connect(str(invest_api_session.bind.url))
+    await listener.add_listener(
+        "companies",
+        lambda *args: payloads.append(orjson.loads(args[-1])),
+    )
+
+    try:
+        report, changes = await load_delta(connection, path)
+        await listener.fetchval("SELECT 1;")
+    finally:
+        await listener.close()
+
+    assert report["rows"] == 3
+    assert report["inserted"] == 1
+    assert report["updated"] == 1
+    assert report["unchanged"] == 1
+    assert report["version"] == version + 1
+
+    assert sorted(changes, key=lambda change: change["itn"]) == [
+        {"itn": rows[1]["itn"], "psrn": rows[1]["psrn"], "inserted": False},
+        {"itn": rows[3]["itn"], "psrn": rows[3]["psrn"], "inserted": True},
+    ]
+
+    itns = sorted(
+        identifiers["itn"]
+        for payload in payloads
+        for identifiers in payload
+    )
+    assert itns == [rows[1]["itn"], rows[3]["itn"]]
+
+    name = await connection.fetchval(
+        "SELECT name FROM companies WHERE itn = $1;",
+        rows[1]["itn"],
+    )
+    assert name == "ЗАО ОКБ Новое"
+
+
+async def test_that_large_delta_notifies_about_every_company(
+        connection: asyncpg.Connection,
+        invest_api_session: orm.Session,
+        tmp_path: Path,
+) -> None:
+    rows = make_rows(300)
+    for i, row in enumerate(rows):
+        row["itn"] = f"7710{i:06}"
+        row["psrn"] = f"1047796{i:06}"
+        row["bankruptcy_probability"] = i % 100
+
+    path = tmp_path / "delta.csv"
+    write_csv(path, rows)
+
+    payloads: List[str] = []
+    listener = await asyncpg.connect(str(invest_api_session.bind.url))
+    await listener.add_listener(
+        "companies",
+        lambda *args: payloads.append(args[-1]),
+    )
+
+    try:
+        report, changes = await load_delta(connection, path)
+        await listener.fetchval("SELECT 1;")
+    finally:
+        await listener.close()
+
+    assert report["inserted"] == len(rows)
+    assert len(changes) == len(rows)
+
+    assert "" not in payloads
+    itns = sorted(
+        identifiers["itn"]
+        for payload in payloads
+        for identifiers in orjson.loads(payload)
+    )
+    assert itns == sorted(row["itn"] for row in rows)
+
+
+async def test_that_unchanged_delta_keeps_dataset_version(
+        connection: asyncpg.Connection,
+        tmp_path: Path,
+) -> None:
+    path = tmp_path / "companies.jsonl"
+    write_jsonl(path, make_rows(3))
+    await load(connection, path)
+
+    report, changes = await load_delta(connection, path)
+
+    assert changes == []
+    assert report["unchanged"] == 3
+    assert report["version"] == await connection.fetchval(
+        "SELECT version FROM dataset;",
+    )